@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import math
+import uuid
+
+from osgeo import gdal
+
+from .raster_reader import RasterHandle, _GdalSource
+from .raster_stats import MODE_EXACT, has_cached_statistics, layer_statistics
+
+_TYPE_RANGES = {
+    gdal.GDT_Byte: (0, 255),
+    gdal.GDT_UInt16: (0, 65535),
+    gdal.GDT_Int16: (-32768, 32767),
+    gdal.GDT_UInt32: (0, 4294967295),
+    gdal.GDT_Int32: (-2147483648, 2147483647),
+}
+_WIDER_TYPES = {
+    gdal.GDT_Byte: gdal.GDT_UInt16,
+    gdal.GDT_UInt16: gdal.GDT_UInt32,
+    gdal.GDT_Int16: gdal.GDT_Int32,
+    gdal.GDT_UInt32: gdal.GDT_Float64,
+    gdal.GDT_Int32: gdal.GDT_Float64,
+}
+
+
+def source_range(layer, band=1, progress=None):
+    handle = RasterHandle(layer, band)
+    try:
+        stats = layer_statistics(handle, None, mode=MODE_EXACT, progress=progress)
+    finally:
+        handle.close()
+    return stats['min'], stats['max']
+
+
+def pending_fill_blocks(layers, nodata_list, bands=None, block_size=256):
+    bands = bands or [1] * len(layers)
+    base = layers[0]
+    blocks = 0
+    for layer, nodata, band in zip(layers[1:], nodata_list[1:], bands[1:]):
+        if nodata is not None or grid_matches(layer, base):
+            continue
+        handle = RasterHandle(layer, band)
+        try:
+            dataset = handle.gdal_dataset()
+            if dataset is None or dataset.GetRasterBand(band).GetNoDataValue() is not None:
+                continue
+            if not has_cached_statistics(handle, None, MODE_EXACT):
+                blocks += int(math.ceil(layer.width() / float(block_size))) * int(math.ceil(layer.height() / float(block_size)))
+        finally:
+            handle.close()
+    return blocks
+
+
+def choose_fill_value(data_type, low, high):
+    if low is None:
+        low = high = 0
+    if data_type not in _TYPE_RANGES:
+        return min(-9999.0, float(low) - 1.0), None
+    type_low, type_high = _TYPE_RANGES[data_type]
+    if high < type_high:
+        return type_high, None
+    if low > type_low:
+        return type_low, None
+    return type_high + 1, _WIDER_TYPES[data_type]
+
+
+def grid_matches(layer, base):
+    if layer.crs() != base.crs():
+        return False
+    if abs(layer.rasterUnitsPerPixelX() - base.rasterUnitsPerPixelX()) > 1e-9 or abs(layer.rasterUnitsPerPixelY() - base.rasterUnitsPerPixelY()) > 1e-9:
+        return False
+    if layer.width() != base.width() or layer.height() != base.height():
+        return False
+    return layer.extent() == base.extent()
+
+
+class AlignedLayer:
+    def __init__(self, layer, base, nodata, band=1, progress=None):
+        self.layer = layer
+        self.base = base
+        self.band = band
+        source = gdal.Open(layer.source().split('|')[0], gdal.GA_ReadOnly)
+        if source is None:
+            raise ValueError('Cannot open raster for alignment: {}'.format(layer.name()))
+        source_band = source.GetRasterBand(band)
+        if nodata is None:
+            nodata = source_band.GetNoDataValue()
+        self.fill_value = None
+        output_type = None
+        if nodata is None:
+            low, high = source_range(layer, band, progress=progress)
+            nodata, output_type = choose_fill_value(source_band.DataType, low, high)
+            self.fill_value = nodata
+        self.nodata = nodata
+        extent = base.extent()
+        crs = base.crs()
+        self.grid_key = '|'.join([
+            crs.authid() or crs.toWkt(),
+            repr((extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())),
+            str(base.width()),
+            str(base.height()),
+        ])
+        options = gdal.WarpOptions(
+            format='VRT',
+            outputBounds=(extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()),
+            width=base.width(),
+            height=base.height(),
+            dstSRS=crs.toWkt(),
+            resampleAlg='near',
+            srcNodata=None if self.fill_value is not None else nodata,
+            dstNodata=nodata,
+            outputType=output_type or gdal.GDT_Unknown,
+        )
+        self.path = '/vsimem/lulc_aligned_{}.vrt'.format(uuid.uuid4().hex)
+        dataset = gdal.Warp(self.path, source, options=options)
+        if dataset is None:
+            raise ValueError('Cannot align raster to the base grid: {}'.format(layer.name()))
+        dataset = None
+        self.reader = _GdalSource(self.path, base.width(), base.height())
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    def crs(self):
+        return self.base.crs()
+
+    def extent(self):
+        return self.base.extent()
+
+    def width(self):
+        return self.base.width()
+
+    def height(self):
+        return self.base.height()
+
+    def rasterUnitsPerPixelX(self):
+        return self.base.rasterUnitsPerPixelX()
+
+    def rasterUnitsPerPixelY(self):
+        return self.base.rasterUnitsPerPixelY()
+
+    def gdal_dataset(self):
+        return self.reader.dataset()
+
+    def read_window(self, col, row, cols, rows, factor=1):
+        return self.reader.read(self.band, col, row, cols, rows, factor)
+
+    def close(self):
+        self.reader.close()
+        if self.path is not None:
+            gdal.Unlink(self.path)
+            self.path = None
+
+
+def align_layers(layers, nodata_list, bands=None, progress=None):
+    bands = bands or [1] * len(layers)
+    base = layers[0]
+    aligned_layers = [base]
+    aligned_nodata = [nodata_list[0]]
+    aligned_names = []
+    for layer, nodata, band in zip(layers[1:], nodata_list[1:], bands[1:]):
+        if grid_matches(layer, base):
+            aligned_layers.append(layer)
+            aligned_nodata.append(nodata)
+            continue
+        aligned = AlignedLayer(layer, base, nodata, band, progress=progress)
+        aligned_layers.append(aligned)
+        aligned_nodata.append(aligned.nodata)
+        if aligned.fill_value is None:
+            aligned_names.append(layer.name())
+        else:
+            aligned_names.append('{} (no NoData, outside coverage filled with {})'.format(layer.name(), aligned.fill_value))
+    return aligned_layers, aligned_nodata, aligned_names
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from qgis.core import QgsEllipsoidUtils
+
+WGS84_AXES = (6378137.0, 6356752.314245179)
+
+
+def is_geographic(layer):
+    return layer.crs().isGeographic()
+
+
+def _ellipsoid_axes(crs):
+    acronym = crs.ellipsoidAcronym()
+    if acronym:
+        params = QgsEllipsoidUtils.ellipsoidParameters(acronym)
+        if params.valid and params.semiMajor > 0:
+            return params.semiMajor, params.semiMinor
+    return WGS84_AXES
+
+
+def _authalic_q(lat, eccentricity):
+    sin_lat = np.sin(lat)
+    if eccentricity == 0:
+        return 2.0 * sin_lat
+    e_sin = eccentricity * sin_lat
+    return (1.0 - eccentricity ** 2) * (
+        sin_lat / (1.0 - e_sin ** 2) - np.log((1.0 - e_sin) / (1.0 + e_sin)) / (2.0 * eccentricity)
+    )
+
+
+def pixel_area_rows(layer):
+    semi_major, semi_minor = _ellipsoid_axes(layer.crs())
+    eccentricity = np.sqrt(max(0.0, 1.0 - (semi_minor / semi_major) ** 2))
+    px_x = layer.rasterUnitsPerPixelX()
+    px_y = abs(layer.rasterUnitsPerPixelY())
+    edges = layer.extent().yMaximum() - np.arange(layer.height() + 1, dtype=np.float64) * px_y
+    q = _authalic_q(np.radians(np.clip(edges, -90.0, 90.0)), eccentricity)
+    return 0.5 * semi_major ** 2 * np.radians(px_x) * np.abs(q[:-1] - q[1:])
+
+
+def pixel_edge_rows(layer):
+    semi_major, semi_minor = _ellipsoid_axes(layer.crs())
+    e2 = max(0.0, 1.0 - (semi_minor / semi_major) ** 2)
+    px_x = np.radians(layer.rasterUnitsPerPixelX())
+    px_y = abs(layer.rasterUnitsPerPixelY())
+    edges = np.radians(np.clip(layer.extent().yMaximum() - np.arange(layer.height() + 1, dtype=np.float64) * px_y, -90.0, 90.0))
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    sin2 = np.sin(centers) ** 2
+    heights = semi_major * (1.0 - e2) / (1.0 - e2 * sin2) ** 1.5 * np.abs(edges[:-1] - edges[1:])
+    widths = semi_major * np.cos(edges) / np.sqrt(1.0 - e2 * np.sin(edges) ** 2) * px_x
+    return heights, widths
+
+
+def area_factor_from(counts, areas):
+    counts = np.asarray(counts, dtype=np.float64)
+    return np.where(counts > 0, areas / np.where(counts > 0, counts, 1.0), 0.0)
+
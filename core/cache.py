@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .change_metrics import (
+    area_counts_from_array,
+    area_counts_to_array,
+    compute_area_by_class_stack,
+    compute_interval_metrics,
+    resize_interval_result,
+)
+from .fragmentation import compute_fragmentation_stack
+
+ENGINE_VERSION = 1
+DEFAULT_CACHE_LIMIT_MB = 2048
+
+
+def default_cache_dir():
+    from qgis.core import QgsApplication
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'spatiotemporal_lulc_analysis', 'cache')
+
+
+def _source_path(layer):
+    return layer.source().split('|')[0]
+
+
+def _file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def layer_fingerprint(layer, nodata, band=1, hash_contents=False):
+    path = _source_path(layer)
+    band = getattr(layer, 'band', band)
+    parts = [layer.source(), band, repr(nodata), layer.width(), layer.height()]
+    grid_key = getattr(layer, 'grid_key', None)
+    if grid_key is not None:
+        parts.append(grid_key)
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        parts.extend([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        if hash_contents:
+            parts.append(_file_digest(path))
+    return digest_parts(parts)
+
+
+def geometry_fingerprint(vector_layer):
+    if vector_layer is None:
+        return 'none'
+    digest = hashlib.sha1()
+    digest.update(vector_layer.crs().toWkt().encode('utf-8'))
+    for feature in vector_layer.getFeatures():
+        geometry = feature.geometry()
+        if geometry is None or geometry.isEmpty():
+            continue
+        digest.update(bytes(geometry.asWkb()))
+    return digest.hexdigest()
+
+
+def digest_parts(parts):
+    payload = json.dumps([ENGINE_VERSION] + list(parts), sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir=None, limit_mb=DEFAULT_CACHE_LIMIT_MB, enabled=True):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.limit_bytes = int(limit_mb) * 1024 * 1024
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, *parts):
+        return '{}_{}'.format(kind, digest_parts(parts))
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '{}.npz'.format(key))
+
+    def load(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            self.misses += 1
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path, None)
+        self.hits += 1
+        return arrays
+
+    def store(self, key, **arrays):
+        if not self.enabled:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(temp_path, **arrays)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.limit_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def area_by_class(self, layers, nodata_list, mask_layer, mask_key, progress=None, row_areas=None):
+        keys = [self.key('hist', layer_fingerprint(layer, nodata), mask_key, row_areas is not None) for layer, nodata in zip(layers, nodata_list)]
+        results = []
+        areas = []
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = self.load(key)
+            results.append(None if cached is None else area_counts_from_array(cached['counts']))
+            areas.append(None if cached is None else cached.get('areas'))
+            if cached is None:
+                missing.append(idx)
+        if missing:
+            computed, computed_areas = compute_area_by_class_stack([layers[idx] for idx in missing], [nodata_list[idx] for idx in missing], mask_layer,
+                                                                   progress=progress, row_areas=row_areas)
+            for idx, area_counts, year_areas in zip(missing, computed, computed_areas):
+                extra = {'areas': year_areas} if year_areas is not None else {}
+                self.store(keys[idx], counts=area_counts_to_array(area_counts), **extra)
+                results[idx] = area_counts
+                areas[idx] = year_areas
+        return results, areas
+
+    def interval_metrics(self, layer0, layer1, nodata0, nodata1, mask_layer, mask_key, max_class, progress=None, checkpoint=None, code_writer=None,
+                         row_areas=None):
+        key = self.key('interval', layer_fingerprint(layer0, nodata0), layer_fingerprint(layer1, nodata1), mask_key, row_areas is not None)
+        cached = self.load(key) if code_writer is None else None
+        if cached is not None:
+            return resize_interval_result(cached, max_class)
+        result = compute_interval_metrics(layer0, layer1, nodata0, nodata1, mask_layer, max_class, progress=progress, checkpoint=checkpoint,
+                                          code_writer=code_writer, row_areas=row_areas)
+        extra = {'area_matrix': result['area_matrix']} if 'area_matrix' in result else {}
+        self.store(
+            key,
+            gain=result['gain'],
+            loss=result['loss'],
+            matrix=result['matrix'],
+            changed_pixels=np.int64(result['changed_pixels']),
+            total_pixels=np.int64(result['total_pixels']),
+            **extra
+        )
+        return result
+
+    def fragmentation(self, layers, nodata_list, mask_layer, mask_key, max_class, progress=None, row_areas=None, edge_rows=None):
+        keys = [self.key('patches', layer_fingerprint(layer, nodata), mask_key, max_class, edge_rows is not None, row_areas is not None)
+                for layer, nodata in zip(layers, nodata_list)]
+        results = []
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = self.load(key)
+            if cached is not None:
+                cached['valid_pixels'] = int(cached['valid_pixels'])
+                if 'valid_area' in cached:
+                    cached['valid_area'] = float(cached['valid_area'])
+            else:
+                missing.append(idx)
+            results.append(cached)
+        if missing:
+            computed = compute_fragmentation_stack([layers[idx] for idx in missing], [nodata_list[idx] for idx in missing], mask_layer, max_class,
+                                                   progress=progress, row_areas=row_areas, edge_rows=edge_rows)
+            for idx, result in zip(missing, computed):
+                self.store(keys[idx], **result)
+                results[idx] = result
+        return results
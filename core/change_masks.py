@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .raster_reader import iter_blocks, read_block
+
+MASK_VERSION = 2
+MASK_TILE_SIZE = 256
+
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def popcount(packed):
+    return int(_POPCOUNT[packed].sum(dtype=np.int64))
+
+
+class ChangeMaskStore:
+    def __init__(self, output_dir, key, tile_size=MASK_TILE_SIZE):
+        self.mask_dir = os.path.join(output_dir, 'change_masks')
+        self.key = key
+        self.tile_size = tile_size
+        self.meta = None
+        self._planes = {}
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.mask_dir, 'masks.json')
+
+    @property
+    def intervals(self):
+        return self.meta['years'] - 1
+
+    def _plane_path(self, name):
+        return os.path.join(self.mask_dir, '{}.npy'.format(name))
+
+    def _plane(self, name):
+        plane = self._planes.get(name)
+        if plane is None:
+            plane = np.load(self._plane_path(name), mmap_mode='r')
+            self._planes[name] = plane
+        return plane
+
+    def _read_meta(self):
+        if not os.path.isfile(self.meta_path):
+            return None
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != MASK_VERSION:
+            return None
+        return meta
+
+    def load(self):
+        meta = self._read_meta()
+        if meta is None or meta.get('key') != self.key:
+            return False
+        self.meta = meta
+        return True
+
+    def reusable_years(self, fingerprints, mask_key):
+        meta = self._read_meta()
+        if meta is None or meta.get('mask_key') != json.dumps(mask_key) or meta.get('tile_size') != self.tile_size:
+            return 0
+        stored = meta.get('fingerprints', [])
+        if len(stored) < 2 or len(stored) > len(fingerprints) or list(fingerprints[:len(stored)]) != stored:
+            return 0
+        return len(stored)
+
+    def build(self, layers, nodata_list, mask_layer, progress=None, fingerprints=None, mask_key=None):
+        self.close()
+        reused = self.reusable_years(fingerprints, mask_key) if fingerprints is not None else 0
+        if reused:
+            os.remove(self.meta_path)
+        else:
+            if os.path.isdir(self.mask_dir):
+                shutil.rmtree(self.mask_dir, ignore_errors=True)
+            os.makedirs(self.mask_dir)
+        first = max(0, reused - 1)
+        size = self.tile_size
+        base = layers[0]
+        tile_cols = (base.width() + size - 1) // size
+        tile_rows = (base.height() + size - 1) // size
+        shape = (tile_rows * tile_cols, size * size // 8)
+        valid_all = np.lib.format.open_memmap(self._plane_path('valid_all'), mode='r+' if reused else 'w+', dtype=np.uint8, shape=shape)
+        changes = [
+            np.lib.format.open_memmap(self._plane_path('change_{}'.format(idx)), mode='w+', dtype=np.uint8, shape=shape)
+            for idx in range(first, len(layers) - 1)
+        ]
+
+        tile = np.zeros((size, size), dtype=bool)
+        for tile_index, (col, row, array0) in enumerate(iter_blocks(layers[first], block_cols=size, block_rows=size, on_block=progress)):
+            rows, cols = array0.shape
+            if mask_layer is not None:
+                region = read_block(mask_layer, col, row, cols, rows) == 1
+            else:
+                region = np.ones((rows, cols), dtype=bool)
+            prev = array0
+            prev_valid = _valid_mask(array0, nodata_list[first]) & region
+            if reused:
+                all_valid = np.unpackbits(valid_all[tile_index]).reshape((size, size))[:rows, :cols].astype(bool)
+            else:
+                all_valid = prev_valid.copy()
+            for idx in range(first + 1, len(layers)):
+                curr = read_block(layers[idx], col, row, cols, rows)
+                curr_valid = _valid_mask(curr, nodata_list[idx]) & region
+                tile[:] = False
+                tile[:rows, :cols] = (prev != curr) & prev_valid & curr_valid
+                changes[idx - 1 - first][tile_index] = np.packbits(tile)
+                all_valid &= curr_valid
+                prev = curr
+                prev_valid = curr_valid
+            tile[:] = False
+            tile[:rows, :cols] = all_valid
+            valid_all[tile_index] = np.packbits(tile)
+
+        for plane in changes + [valid_all]:
+            plane.flush()
+        del changes, valid_all
+        meta = {
+            'version': MASK_VERSION,
+            'key': self.key,
+            'years': len(layers),
+            'width': base.width(),
+            'height': base.height(),
+            'tile_size': size,
+            'fingerprints': list(fingerprints or []),
+            'mask_key': json.dumps(mask_key),
+        }
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(meta, handle, indent=2)
+        os.replace(temp_path, self.meta_path)
+        self.meta = meta
+
+    def iter_tiles(self, on_block=None):
+        size = self.tile_size
+        width = self.meta['width']
+        height = self.meta['height']
+        tile_index = 0
+        for row in range(0, height, size):
+            for col in range(0, width, size):
+                if on_block:
+                    on_block()
+                yield tile_index, col, row, min(size, width - col), min(size, height - row)
+                tile_index += 1
+
+    def _unpack(self, name, tile_index, cols, rows):
+        size = self.tile_size
+        bits = np.unpackbits(self._plane(name)[tile_index]).reshape((size, size))
+        return bits[:rows, :cols].astype(bool)
+
+    def change_tile(self, interval, tile_index, cols, rows):
+        return self._unpack('change_{}'.format(interval), tile_index, cols, rows)
+
+    def valid_tile(self, tile_index, cols, rows):
+        return self._unpack('valid_all', tile_index, cols, rows)
+
+    def any_change_tile(self, tile_index, cols, rows):
+        packed = np.zeros(self.tile_size * self.tile_size // 8, dtype=np.uint8)
+        for idx in range(self.intervals):
+            packed |= self._plane('change_{}'.format(idx))[tile_index]
+        size = self.tile_size
+        return np.unpackbits(packed).reshape((size, size))[:rows, :cols].astype(bool)
+
+    def change_frequency_tile(self, tile_index, cols, rows):
+        counts = np.zeros(self.tile_size * self.tile_size, dtype=np.int16)
+        for idx in range(self.intervals):
+            counts += np.unpackbits(self._plane('change_{}'.format(idx))[tile_index])
+        counts = counts.reshape((self.tile_size, self.tile_size))[:rows, :cols]
+        counts[~self.valid_tile(tile_index, cols, rows)] = -1
+        return counts
+
+    def changed_pixels(self, interval):
+        return popcount(self._plane('change_{}'.format(interval)))
+
+    def close(self):
+        self._planes.clear()
@@ -41,19 +41,105 @@ def compute_area_by_class(layer, nodata, mask_layer=None, progress=None):
     return counts
 
 
-def compute_interval_metrics(layer0, layer1, nodata0, nodata1, mask_layer, max_class, progress=None):
+def _add_padded(total, block):
+    if block.shape[0] > total.shape[0]:
+        block[:total.shape[0]] += total
+        return block
+    total[:block.shape[0]] += block
+    return total
+
+
+def compute_area_by_class_stack(layers, nodata_list, mask_layer=None, progress=None, row_areas=None):
+    counts = [np.zeros(0, dtype=np.int64) for _ in layers]
+    areas = [np.zeros(0, dtype=np.float64) for _ in layers]
+    for col, row, array0 in iter_blocks(layers[0], on_block=progress):
+        rows, cols = array0.shape
+        region = None
+        if mask_layer is not None:
+            region = read_block(mask_layer, col, row, cols, rows) == 1
+        weights = None
+        if row_areas is not None:
+            weights = np.broadcast_to(row_areas[row:row + rows, None], (rows, cols))
+        for idx, (layer, nodata) in enumerate(zip(layers, nodata_list)):
+            array = array0 if idx == 0 else read_block(layer, col, row, cols, rows)
+            valid = _valid_mask(array, nodata)
+            if region is not None:
+                valid &= region
+            if not valid.any():
+                continue
+            values = array[valid].astype(np.int64)
+            counts[idx] = _add_padded(counts[idx], np.bincount(values))
+            if weights is not None:
+                areas[idx] = _add_padded(areas[idx], np.bincount(values, weights=weights[valid]))
+    return [area_counts_from_array(year_counts) for year_counts in counts], (areas if row_areas is not None else [None] * len(layers))
+
+
+def area_counts_to_array(area_counts):
+    size = (max(area_counts) + 1) if area_counts else 0
+    counts = np.zeros(size, dtype=np.int64)
+    for class_id, count in area_counts.items():
+        counts[class_id] = count
+    return counts
+
+
+def padded_counts(counts, size):
+    padded = np.zeros(size, dtype=counts.dtype)
+    n = min(size, counts.shape[0])
+    padded[:n] = counts[:n]
+    return padded
+
+
+def area_counts_from_array(counts):
+    return {int(i): int(counts[i]) for i in np.nonzero(counts)[0]}
+
+
+def compute_interval_metrics(layer0, layer1, nodata0, nodata1, mask_layer, max_class, progress=None, checkpoint=None, code_writer=None,
+                             row_areas=None):
     gain = np.zeros(max_class + 1, dtype=np.int64)
     loss = np.zeros(max_class + 1, dtype=np.int64)
     matrix = np.zeros((max_class + 1, max_class + 1), dtype=np.int64)
+    area_matrix = np.zeros(matrix.shape, dtype=np.float64) if row_areas is not None else None
     changed_pixels = 0
     total_pixels = 0
 
-    for col, row, array0 in iter_blocks(layer0, on_block=progress):
+    start_block = 0
+    if checkpoint is not None:
+        start_block, state = checkpoint.load()
+        if (state is not None and state['matrix'].shape == matrix.shape and ('area_matrix' in state) == (row_areas is not None)
+                and (code_writer is None or code_writer.resume())):
+            gain = state['gain']
+            loss = state['loss']
+            matrix = state['matrix']
+            area_matrix = state.get('area_matrix')
+            changed_pixels = int(state['changed_pixels'])
+            total_pixels = int(state['total_pixels'])
+        else:
+            start_block = 0
+            checkpoint.resumed_from = 0
+    if code_writer is not None and not start_block:
+        code_writer.create()
+
+    blocks = iter_blocks(layer0, on_block=progress, start_block=start_block)
+    for block_index, (col, row, array0) in enumerate(blocks, start_block):
+        if checkpoint is not None and checkpoint.due():
+            extra = {'area_matrix': area_matrix} if area_matrix is not None else {}
+            checkpoint.save(
+                block_index,
+                flush=code_writer.flush if code_writer is not None else None,
+                gain=gain,
+                loss=loss,
+                matrix=matrix,
+                changed_pixels=np.int64(changed_pixels),
+                total_pixels=np.int64(total_pixels),
+                **extra
+            )
         array1 = read_block(layer1, col, row, array0.shape[1], array0.shape[0])
         valid = _valid_mask(array0, nodata0) & _valid_mask(array1, nodata1)
         if mask_layer is not None:
             mask = read_block(mask_layer, col, row, array0.shape[1], array0.shape[0])
             valid &= mask == 1
+        if code_writer is not None:
+            code_writer.write(col, row, array0, array1, valid)
         if not valid.any():
             continue
         t0 = array0[valid].astype(np.int64)
@@ -69,28 +155,45 @@ def compute_interval_metrics(layer0, layer1, nodata0, nodata1, mask_layer, max_c
         pair_code = t0 * (max_class + 1) + t1
         counts = np.bincount(pair_code, minlength=(max_class + 1) ** 2)
         matrix += counts.reshape((max_class + 1, max_class + 1))
+        if area_matrix is not None:
+            weights = np.broadcast_to(row_areas[row:row + array0.shape[0], None], array0.shape)[valid]
+            area_matrix += np.bincount(pair_code, weights=weights, minlength=(max_class + 1) ** 2).reshape(area_matrix.shape)
+
+    if code_writer is not None:
+        code_writer.close(matrix)
+    if checkpoint is not None:
+        checkpoint.clear()
 
-    return {
+    result = {
         'gain': gain,
         'loss': loss,
         'matrix': matrix,
         'changed_pixels': changed_pixels,
         'total_pixels': total_pixels,
     }
+    if area_matrix is not None:
+        result['area_matrix'] = area_matrix
+    return result
 
 
-def build_top_transitions(matrix, layer):
-    pixel_area_km2 = layer.rasterUnitsPerPixelX() * layer.rasterUnitsPerPixelY() / 1e6
-    matrix = matrix.copy()
-    np.fill_diagonal(matrix, 0)
-    total_change = matrix.sum()
-    rows = []
-    for i in range(matrix.shape[0]):
-        for j in range(matrix.shape[1]):
-            count = int(matrix[i, j])
-            if count:
-                area_km2 = count * abs(pixel_area_km2)
-                percent = (count / total_change * 100.0) if total_change else 0.0
-                rows.append([i, j, count, area_km2, percent])
-    rows.sort(key=lambda r: r[3], reverse=True)
-    return rows
+def resize_interval_result(result, max_class):
+    size = max_class + 1
+    gain = np.zeros(size, dtype=np.int64)
+    loss = np.zeros(size, dtype=np.int64)
+    matrix = np.zeros((size, size), dtype=np.int64)
+    n = min(size, result['matrix'].shape[0])
+    gain[:n] = result['gain'][:n]
+    loss[:n] = result['loss'][:n]
+    matrix[:n, :n] = result['matrix'][:n, :n]
+    resized = {
+        'gain': gain,
+        'loss': loss,
+        'matrix': matrix,
+        'changed_pixels': int(result['changed_pixels']),
+        'total_pixels': int(result['total_pixels']),
+    }
+    if 'area_matrix' in result:
+        area_matrix = np.zeros((size, size), dtype=np.float64)
+        area_matrix[:n, :n] = result['area_matrix'][:n, :n]
+        resized['area_matrix'] = area_matrix
+    return resized
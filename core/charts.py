@@ -1,6 +1,50 @@
 # -*- coding: utf-8 -*-
+import base64
+import gzip
 import json
 import os
+from html import escape as html_escape
+
+import numpy as np
+
+DEFAULT_SANKEY_TOP_K = 100
+
+_DECODE_JS = [
+    'const TYPED_ARRAYS = {i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array, i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array};',
+    'async function decodeBytes(spec) {',
+    '  const raw = Uint8Array.from(atob(spec.bdata), (c) => c.charCodeAt(0));',
+    "  if (spec.compression !== 'gzip') {",
+    '    return raw.buffer;',
+    '  }',
+    "  const stream = new Blob([raw]).stream().pipeThrough(new DecompressionStream('gzip'));",
+    '  return new Response(stream).arrayBuffer();',
+    '}',
+    'async function decodeArrays(value) {',
+    '  if (Array.isArray(value)) {',
+    '    return Promise.all(value.map(decodeArrays));',
+    '  }',
+    "  if (!value || typeof value !== 'object') {",
+    '    return value;',
+    '  }',
+    "  if (typeof value.bdata === 'string' && value.dtype in TYPED_ARRAYS) {",
+    '    const array = new TYPED_ARRAYS[value.dtype](await decodeBytes(value));',
+    '    if (!value.shape) {',
+    '      return array;',
+    '    }',
+    "    const cols = Number(value.shape.split(',')[1]);",
+    '    const rows = [];',
+    '    for (let start = 0; start < array.length; start += cols) {',
+    '      rows.push(array.subarray(start, start + cols));',
+    '    }',
+    '    return rows;',
+    '  }',
+    '  const decoded = {};',
+    '  for (const [key, item] of Object.entries(value)) {',
+    '    decoded[key] = await decodeArrays(item);',
+    '  }',
+    '  return decoded;',
+    '}',
+]
 
 
 def plotly_available():
@@ -12,21 +56,59 @@ def _plotly_js_path():
     return os.path.join(root, 'vendor', 'js', 'plotly.min.js')
 
 
-def write_plotlyjs_html(output_html_path, title, traces, layout, config=None, inline_plotly=True):
+def _read_plotly_js():
+    js_path = _plotly_js_path()
+    if not os.path.isfile(js_path):
+        raise FileNotFoundError('Plotly.js not found at {}'.format(js_path))
+    with open(js_path, 'r', encoding='utf-8') as handle:
+        return handle.read()
+
+
+def _responsive_config(config):
     if config is None:
-        config = {'responsive': True}
-    elif 'responsive' not in config:
+        return {'responsive': True}
+    if 'responsive' not in config:
         config = dict(config)
         config['responsive'] = True
+    return config
+
+
+def _typed_array(array, compress=False):
+    array = np.asarray(array)
+    if array.dtype.kind in 'iub' and array.size and array.min() >= -2 ** 31 and array.max() < 2 ** 31:
+        dtype = 'i4'
+    else:
+        dtype = 'f8'
+    data = np.ascontiguousarray(array, dtype='<' + dtype).tobytes()
+    encoded = {'dtype': dtype}
+    if compress:
+        data = gzip.compress(data, compresslevel=6)
+        encoded['compression'] = 'gzip'
+    encoded['bdata'] = base64.b64encode(data).decode('ascii')
+    if array.ndim == 2:
+        encoded['shape'] = '{},{}'.format(*array.shape)
+    return encoded
+
+
+def _encode_arrays(value, compress=False):
+    if isinstance(value, np.ndarray):
+        return _typed_array(value, compress)
+    if isinstance(value, dict):
+        return {key: _encode_arrays(item, compress) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_arrays(item, compress) for item in value]
+    return value
+
+
+def _script_json(value):
+    return json.dumps(value, ensure_ascii=False).replace('</', '<\\/')
+
+
+def write_plotlyjs_html(output_html_path, title, traces, layout, config=None, inline_plotly=True, compress=False):
+    config = _responsive_config(config)
 
-    plotly_js = ''
     if inline_plotly:
-        js_path = _plotly_js_path()
-        if not os.path.isfile(js_path):
-            raise FileNotFoundError('Plotly.js not found at {}'.format(js_path))
-        with open(js_path, 'r', encoding='utf-8') as handle:
-            plotly_js = handle.read()
-        plotly_tag = '<script>{}</script>'.format(plotly_js)
+        plotly_tag = '<script>{}</script>'.format(_read_plotly_js())
     else:
         js_rel = os.path.relpath(_plotly_js_path(), os.path.dirname(output_html_path))
         plotly_tag = '<script src="{}"></script>'.format(js_rel.replace(os.sep, '/'))
@@ -45,12 +127,15 @@ def write_plotlyjs_html(output_html_path, title, traces, layout, config=None, in
         '<body>',
         '<div id="chart"></div>',
         plotly_tag,
+        '<script type="application/json" id="chart-data">{}</script>'.format(
+            _script_json({'traces': _encode_arrays(traces, compress), 'layout': layout, 'config': config})
+        ),
         '<script>',
-        'const traces = {};'.format(json.dumps(traces, ensure_ascii=False)),
-        'const layout = {};'.format(json.dumps(layout, ensure_ascii=False)),
-        'const config = {};'.format(json.dumps(config, ensure_ascii=False)),
-        "Plotly.newPlot('chart', traces, layout, config);",
-        "window.onresize = () => Plotly.Plots.resize('chart');",
+    ] + _DECODE_JS + [
+        "decodeArrays(JSON.parse(document.getElementById('chart-data').textContent)).then((chart) => {",
+        "  Plotly.newPlot('chart', chart.traces, chart.layout, chart.config);",
+        "  window.onresize = () => Plotly.Plots.resize('chart');",
+        '});',
         '</script>',
         '</body>',
         '</html>',
@@ -76,9 +161,108 @@ def _axis_label(unit_label):
     return unit_label
 
 
-def _write_plot_html(html_path, title, traces, layout, config=None):
+class Dashboard:
+    def __init__(self, title='Spatiotemporal LULC Analysis', compress=False):
+        self.title = title
+        self.compress = compress
+        self.charts = []
+        self.sections = []
+
+    def add(self, title, traces, layout, config=None, section=None):
+        self.charts.append({
+            'title': title,
+            'traces': _encode_arrays(traces, self.compress),
+            'layout': layout,
+            'config': _responsive_config(config),
+        })
+        self.sections.append(section)
+
+    def section(self, name):
+        return _DashboardSection(self, name)
+
+    def write(self, output_html_path):
+        tabs = []
+        panels = []
+        payloads = []
+        current = None
+        for idx, chart in enumerate(self.charts):
+            if self.sections[idx] != current:
+                current = self.sections[idx]
+                if current:
+                    tabs.append('<span class="section">{}</span>'.format(html_escape(current)))
+            tabs.append('<button class="tab" data-index="{}">{}</button>'.format(idx, html_escape(chart['title'])))
+            panels.append('<div class="panel" id="chart-{}"></div>'.format(idx))
+            payloads.append('<script type="application/json" id="chart-data-{}">{}</script>'.format(idx, _script_json(chart)))
+
+        html = [
+            '<!doctype html>',
+            '<html>',
+            '<head>',
+            '<meta charset="utf-8">',
+            '<title>{}</title>'.format(html_escape(self.title)),
+            '<style>',
+            'html, body { margin: 0; padding: 0; width: 100%; height: 100%; font-family: sans-serif; }',
+            'body { display: flex; flex-direction: column; }',
+            '#tabs { display: flex; flex-wrap: wrap; gap: 4px; padding: 6px; border-bottom: 1px solid #ccc; background: #f5f5f5; }',
+            '.tab { border: 1px solid #bbb; background: #fff; padding: 4px 10px; cursor: pointer; }',
+            '.tab.active { background: #2e7d32; color: #fff; border-color: #2e7d32; }',
+            '.section { align-self: center; margin-left: 12px; font-weight: bold; color: #555; }',
+            '#panels { flex: 1; min-height: 0; }',
+            '.panel { display: none; width: 100%; height: 100%; }',
+            '.panel.active { display: block; }',
+            '</style>',
+            '</head>',
+            '<body>',
+            '<div id="tabs">{}</div>'.format(''.join(tabs)),
+            '<div id="panels">{}</div>'.format(''.join(panels)),
+        ]
+        html.extend(payloads)
+        html.extend([
+            '<script>{}</script>'.format(_read_plotly_js()),
+            '<script>',
+        ] + _DECODE_JS + [
+            'const rendered = {};',
+            'async function showChart(index) {',
+            "  document.querySelectorAll('.tab').forEach((tab) => tab.classList.toggle('active', tab.dataset.index === String(index)));",
+            "  document.querySelectorAll('.panel').forEach((panel) => panel.classList.toggle('active', panel.id === 'chart-' + index));",
+            "  const target = 'chart-' + index;",
+            '  if (rendered[index]) {',
+            '    Plotly.Plots.resize(target);',
+            '    return;',
+            '  }',
+            '  rendered[index] = true;',
+            "  const chart = await decodeArrays(JSON.parse(document.getElementById('chart-data-' + index).textContent));",
+            '  Plotly.newPlot(target, chart.traces, chart.layout, chart.config);',
+            '}',
+            "document.querySelectorAll('.tab').forEach((tab) => tab.addEventListener('click', () => showChart(Number(tab.dataset.index))));",
+            'window.onresize = () => {',
+            "  const active = document.querySelector('.panel.active');",
+            '  if (active && rendered[active.id.slice(6)]) { Plotly.Plots.resize(active.id); }',
+            '};',
+            'showChart(0);' if self.charts else '',
+            '</script>',
+            '</body>',
+            '</html>',
+        ])
+        with open(output_html_path, 'w', encoding='utf-8') as handle:
+            handle.write('\n'.join(html))
+
+
+class _DashboardSection:
+    def __init__(self, dashboard, name):
+        self.dashboard = dashboard
+        self.name = name
+
+    def add(self, title, traces, layout, config=None):
+        self.dashboard.add(title, traces, layout, config, section=self.name)
+
+
+def _write_plot_html(html_path, title, traces, layout, config=None, dashboard=None, compress=False):
+    if dashboard is not None:
+        dashboard.add(title, traces, layout, config)
+        return True, None
     try:
-        write_plotlyjs_html(html_path, title, traces, layout, config=config, inline_plotly=True)
+        write_plotlyjs_html(html_path, title, traces, layout, config=config, inline_plotly=True, compress=compress)
     except FileNotFoundError as exc:
         return False, str(exc)
     return True, None
@@ -89,24 +273,28 @@ def _ensure_dir(path):
         os.makedirs(path, exist_ok=True)
 
 
-def export_area_by_class(rows, output_dir, unit_label):
+def _class_labels(class_ids, labels):
+    return [_class_label(class_id, label) for class_id, label in zip(class_ids.tolist(), labels.tolist())]
+
+
+def export_area_by_class(table, output_dir, unit_label, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
-    years = sorted({row[0] for row in rows})
-    classes = sorted({row[1] for row in rows})
-    labels = {row[1]: row[2] for row in rows}
-    area_map = {(row[1], row[0]): float(row[4]) for row in rows}
+    years, year_idx = np.unique(table[0], return_inverse=True)
+    classes, first, class_idx = np.unique(table[1], return_index=True, return_inverse=True)
+    area = np.zeros((classes.shape[0], years.shape[0]), dtype=np.float64)
+    area[class_idx, year_idx] = table[4]
+    names = _class_labels(classes, table[2][first])
 
     traces = []
-    for class_id in classes:
-        y = [area_map.get((class_id, year), 0.0) for year in years]
+    for idx, name in enumerate(names):
         traces.append({
             'type': 'scatter',
             'mode': 'lines+markers',
-            'x': years,
-            'y': y,
-            'name': _class_label(class_id, labels.get(class_id, '')),
+            'x': years.tolist(),
+            'y': area[idx],
+            'name': name,
         })
 
     layout = {
@@ -116,29 +304,26 @@ def export_area_by_class(rows, output_dir, unit_label):
         'legend': {'title': {'text': 'Class'}},
     }
     html_path = os.path.join(output_dir, 'area_by_class.html')
-    ok, err = _write_plot_html(html_path, 'Area by Class', traces, layout)
+    ok, err = _write_plot_html(html_path, 'Area by Class', traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_net_gross(rows, year0, year1, unit_label, area_factor, output_dir):
+def _gain_loss_areas(table):
+    net = np.asarray(table[6], dtype=np.float64)
+    gross = np.asarray(table[7], dtype=np.float64)
+    return (gross + net) / 2.0, (gross - net) / 2.0
+
+
+def export_net_gross(table, year0, year1, unit_label, output_dir, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
-    labels = []
-    gains = []
-    losses = []
-    for row in rows:
-        class_id = row[0]
-        label = row[1]
-        gain_px = row[2]
-        loss_px = row[3]
-        labels.append(_class_label(class_id, label))
-        gains.append(gain_px * area_factor)
-        losses.append(loss_px * area_factor)
+    labels = _class_labels(table[0], table[1])
+    gains, losses = _gain_loss_areas(table)
 
     traces = [
         {'type': 'bar', 'x': labels, 'y': gains, 'name': 'Gain', 'marker': {'color': '#2ca02c'}},
-        {'type': 'bar', 'x': labels, 'y': [-val for val in losses], 'name': 'Loss', 'marker': {'color': '#d62728'}},
+        {'type': 'bar', 'x': labels, 'y': -losses, 'name': 'Loss', 'marker': {'color': '#d62728'}},
     ]
     layout = {
         'title': 'Net/Gross Change {}-{}'.format(year0, year1),
@@ -148,11 +333,11 @@ def export_net_gross(rows, year0, year1, unit_label, area_factor, output_dir):
     }
     fname = 'net_gross_change_{}_{}'.format(year0, year1)
     html_path = os.path.join(output_dir, '{}.html'.format(fname))
-    ok, err = _write_plot_html(html_path, 'Net/Gross Change {}-{}'.format(year0, year1), traces, layout)
+    ok, err = _write_plot_html(html_path, 'Net/Gross Change {}-{}'.format(year0, year1), traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_net_gross_combined(interval_rows, legend_map, output_dir):
+def export_net_gross_combined(interval_rows, legend_map, output_dir, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
@@ -160,8 +345,7 @@ def export_net_gross_combined(interval_rows, legend_map, output_dir):
     if not interval_rows:
         return False, 'No interval data for combined chart.'
 
-    class_ids = [row[0] for row in interval_rows[0]['rows']]
-    class_labels = [_class_label(class_id, legend_map.get(class_id, '')) for class_id in class_ids]
+    class_labels = _class_labels(interval_rows[0]['table'][0], interval_rows[0]['table'][1])
     palette = [
         'rgba(31, 119, 180, 0.85)',
         'rgba(255, 127, 14, 0.85)',
@@ -179,15 +363,9 @@ def export_net_gross_combined(interval_rows, legend_map, output_dir):
     unit_label = interval_rows[0]['unit_label']
     for idx, interval in enumerate(interval_rows):
         label = interval['label']
-        rows = interval['rows']
-        area_factor = interval['area_factor']
-        gains = []
-        losses = []
-        for row in rows:
-            gain_px = row[2]
-            loss_px = row[3]
-            gains.append(-gain_px * area_factor)
-            losses.append(loss_px * area_factor)
+        table = interval['table']
+        gains, losses = _gain_loss_areas(table)
+        gains = -gains
         color = palette[idx % len(palette)]
         traces.append({
             'type': 'bar',
@@ -219,19 +397,18 @@ def export_net_gross_combined(interval_rows, legend_map, output_dir):
         'yaxis': {'title': 'Class'},
     }
     html_path = os.path.join(output_dir, 'net_gross_change_all_intervals.html')
-    ok, err = _write_plot_html(html_path, 'Net/Gross Change (All Intervals)', traces, layout)
+    ok, err = _write_plot_html(html_path, 'Net/Gross Change (All Intervals)', traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_transition_matrix(matrix, classes, labels, year0, year1, output_dir, unit_label):
+def export_transition_matrix(matrix, classes, labels, year0, year1, output_dir, unit_label, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
     class_labels = [_class_label(c, labels.get(c, '')) for c in classes]
-    matrix_list = matrix.tolist() if hasattr(matrix, 'tolist') else matrix
     traces = [{
         'type': 'heatmap',
-        'z': matrix_list,
+        'z': np.asarray(matrix),
         'x': class_labels,
         'y': class_labels,
         'colorscale': 'Blues',
@@ -244,17 +421,20 @@ def export_transition_matrix(matrix, classes, labels, year0, year1, output_dir,
     }
     fname = 'transition_matrix_{}_{}'.format(year0, year1)
     html_path = os.path.join(output_dir, '{}.html'.format(fname))
-    ok, err = _write_plot_html(html_path, 'Transition Matrix {}-{}'.format(year0, year1), traces, layout)
+    ok, err = _write_plot_html(html_path, 'Transition Matrix {}-{}'.format(year0, year1), traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_top_transitions(rows, year0, year1, output_dir, unit_label, max_items=20):
+def export_top_transitions(table, year0, year1, output_dir, unit_label, max_items=20, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
-    ranked = sorted(rows, key=lambda r: r[5], reverse=True)[:max_items]
-    labels = ['{} -> {}'.format(_class_label(r[0], r[1]), _class_label(r[2], r[3])) for r in ranked]
-    areas = [r[5] for r in ranked]
+    ranked = np.argsort(-table[5], kind='stable')[:max_items]
+    labels = ['{} -> {}'.format(source, target) for source, target in zip(
+        _class_labels(table[0][ranked], table[1][ranked]),
+        _class_labels(table[2][ranked], table[3][ranked]),
+    )]
+    areas = table[5][ranked]
 
     traces = [{
         'type': 'bar',
@@ -270,17 +450,17 @@ def export_top_transitions(rows, year0, year1, output_dir, unit_label, max_items
     }
     fname = 'top_transitions_{}_{}'.format(year0, year1)
     html_path = os.path.join(output_dir, '{}.html'.format(fname))
-    ok, err = _write_plot_html(html_path, 'Top Transitions {}-{}'.format(year0, year1), traces, layout)
+    ok, err = _write_plot_html(html_path, 'Top Transitions {}-{}'.format(year0, year1), traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_intensity(rows, output_dir):
+def export_intensity(table, output_dir, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
-    labels = ['{}-{}'.format(row[0], row[1]) for row in rows]
-    annualized = [row[6] for row in rows]
-    interval = [row[5] for row in rows]
+    labels = ['{}-{}'.format(year0, year1) for year0, year1 in zip(table[0].tolist(), table[1].tolist())]
+    annualized = table[6]
+    interval = table[5]
 
     traces = [
         {'type': 'scatter', 'mode': 'lines+markers', 'x': labels, 'y': interval, 'name': 'Interval'},
@@ -292,70 +472,91 @@ def export_intensity(rows, output_dir):
         'yaxis': {'title': 'Intensity'},
     }
     html_path = os.path.join(output_dir, 'change_intensity.html')
-    ok, err = _write_plot_html(html_path, 'Change Intensity', traces, layout)
+    ok, err = _write_plot_html(html_path, 'Change Intensity', traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
 
 
-def export_sankey(intervals, legend_map, output_dir, max_links=5000):
+def _sankey_flows(matrix, top_k):
+    flat = matrix.ravel()
+    candidates = np.flatnonzero(flat > 0)
+    if candidates.shape[0] > top_k:
+        keep = np.argpartition(flat[candidates], -top_k)[-top_k:]
+        candidates = candidates[keep]
+    rows, cols = np.unravel_index(candidates, matrix.shape)
+    values = flat[candidates]
+    residual = matrix.sum(axis=1) - np.bincount(rows, weights=values, minlength=matrix.shape[0])
+    tolerance = max(1.0, float(np.abs(matrix).sum())) * 1e-9
+    other_rows = np.flatnonzero(residual > tolerance)
+    return rows, cols, values, other_rows, residual[other_rows]
+
+
+def _sankey_positions(node_keys, stride):
+    node_years = node_keys // stride
+    years, column = np.unique(node_years, return_inverse=True)
+    x = np.full(node_keys.shape[0], 0.5) if years.shape[0] == 1 else 0.01 + 0.98 * column / (years.shape[0] - 1)
+    y = np.zeros(node_keys.shape[0])
+    for idx in range(years.shape[0]):
+        members = np.flatnonzero(column == idx)
+        order = np.argsort(node_keys[members] % stride == 0, kind='stable')
+        y[members[order]] = 0.01 + 0.98 * (np.arange(members.shape[0]) + 0.5) / members.shape[0]
+    return x, y
+
+
+def export_sankey(intervals, legend_map, output_dir, top_k=DEFAULT_SANKEY_TOP_K, dashboard=None, compress=False):
     if not plotly_available():
         return False, 'Plotly.js not available.'
     _ensure_dir(output_dir)
 
-    nodes = []
-    node_index = {}
-    links = {'source': [], 'target': [], 'value': []}
-
-    def get_node(year, class_id):
-        key = (year, class_id)
-        if key in node_index:
-            return node_index[key]
-        label = _class_label(class_id, legend_map.get(class_id, ''))
-        node_label = '{} | {}'.format(year, label)
-        node_index[key] = len(nodes)
-        nodes.append(node_label)
-        return node_index[key]
-
-    total_links = 0
-    unit_label = 'pixels'
+    stride = max([interval['matrix'].shape[0] for interval in intervals] + [0]) + 1
+    sources = []
+    targets = []
+    values = []
     for interval in intervals:
-        year0 = interval['year0']
-        year1 = interval['year1']
-        matrix = interval['matrix']
+        matrix = np.asarray(interval['matrix'])
+        scale = 1.0 if interval.get('unit_label', 'pixels') == 'pixels' else interval.get('area_factor', 1.0)
+        if np.ndim(scale):
+            matrix = matrix * scale
+            scale = 1.0
         nodata_class = interval.get('nodata_class')
-        unit_label = interval.get('unit_label', unit_label)
-        area_factor = interval.get('area_factor', 1.0)
         if nodata_class is not None and 0 <= nodata_class < matrix.shape[0]:
             matrix = matrix.copy()
             matrix[nodata_class, :] = 0
             matrix[:, nodata_class] = 0
-        rows, cols = (matrix > 0).nonzero()
-        for i, j in zip(rows.tolist(), cols.tolist()):
-            value = matrix[i, j]
-            if unit_label != 'pixels':
-                value = float(value) * area_factor
-            else:
-                value = int(value)
-            if value <= 0:
-                continue
-            links['source'].append(get_node(year0, i))
-            links['target'].append(get_node(year1, j))
-            links['value'].append(value)
-            total_links += 1
-            if total_links >= max_links:
-                break
-        if total_links >= max_links:
-            break
+        rows, cols, flow, other_rows, other_flow = _sankey_flows(matrix, top_k)
+        sources.append(interval['year0'] * stride + rows + 1)
+        targets.append(interval['year1'] * stride + cols + 1)
+        sources.append(interval['year0'] * stride + other_rows + 1)
+        targets.append(np.full(other_rows.shape[0], interval['year1'] * stride, dtype=np.int64))
+        values.append(flow * scale)
+        values.append(other_flow * scale)
+
+    keys = np.concatenate(sources + targets) if sources else np.zeros(0, dtype=np.int64)
+    node_keys, node_index = np.unique(keys, return_inverse=True)
+    link_count = keys.shape[0] // 2
+    nodes = []
+    for key in node_keys.tolist():
+        year, class_code = divmod(key, stride)
+        if class_code == 0:
+            label = 'Other'
+        else:
+            label = _class_label(class_code - 1, legend_map.get(class_code - 1, ''))
+        nodes.append('{} | {}'.format(year, label))
+    node_x, node_y = _sankey_positions(node_keys, stride)
 
     traces = [{
         'type': 'sankey',
         'arrangement': 'snap',
-        'node': {'label': nodes, 'pad': 12, 'thickness': 14},
-        'link': {'source': links['source'], 'target': links['target'], 'value': links['value']},
+        'node': {'label': nodes, 'x': node_x, 'y': node_y, 'pad': 12, 'thickness': 14},
+        'link': {
+            'source': node_index[:link_count].astype(np.int32),
+            'target': node_index[link_count:].astype(np.int32),
+            'value': np.concatenate(values) if values else np.zeros(0),
+        },
     }]
     layout = {
         'title': 'Class Transitions (All Intervals)',
         'font': {'size': 12},
     }
     html_path = os.path.join(output_dir, 'class_flow_sankey.html')
-    ok, err = _write_plot_html(html_path, 'Class Transitions (All Intervals)', traces, layout)
+    ok, err = _write_plot_html(html_path, 'Class Transitions (All Intervals)', traces, layout, dashboard=dashboard, compress=compress)
     return ok, err
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import numpy as np
+
+DEFAULT_CHECKPOINT_SECONDS = 300
+
+
+class Checkpoint:
+    def __init__(self, output_dir, name, fingerprint, every_seconds=DEFAULT_CHECKPOINT_SECONDS):
+        self.path = os.path.join(output_dir, 'checkpoints', '{}.npz'.format(name))
+        self.fingerprint = fingerprint
+        self.every_seconds = every_seconds
+        self.resumed_from = 0
+        self.overhead_seconds = 0.0
+        self._last_save = time.monotonic()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return 0, None
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return 0, None
+        if str(arrays.pop('fingerprint', '')) != self.fingerprint:
+            return 0, None
+        self.resumed_from = int(arrays.pop('next_block'))
+        return self.resumed_from, arrays
+
+    def due(self):
+        return time.monotonic() - self._last_save >= self.every_seconds
+
+    def save(self, next_block, flush=None, **arrays):
+        start = time.monotonic()
+        if flush is not None:
+            flush()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.tmp.npz'
+        np.savez(temp_path, fingerprint=np.array(self.fingerprint), next_block=np.int64(next_block), **arrays)
+        os.replace(temp_path, self.path)
+        self._last_save = time.monotonic()
+        self.overhead_seconds += self._last_save - start
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
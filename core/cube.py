@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .cache import default_cache_dir, digest_parts
+from .raster_reader import iter_blocks, read_block
+
+CUBE_VERSION = 1
+CUBE_TILE_SIZE = 256
+
+
+def default_cube_root():
+    return os.path.join(default_cache_dir(), 'cubes')
+
+
+def clear_cubes(cube_root=None):
+    cube_root = cube_root or default_cube_root()
+    if not os.path.isdir(cube_root):
+        return 0
+    removed = 0
+    for name in os.listdir(cube_root):
+        path = os.path.join(cube_root, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class CubeBand:
+    def __init__(self, cube, index, layer):
+        self.cube = cube
+        self.index = index
+        self.layer = layer
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    def read_window(self, col, row, cols, rows, factor=1):
+        if factor != 1:
+            return read_block(self.layer, col, row, cols, rows, factor=factor)
+        return self.cube.read_region(self.index, col, row, cols, rows)
+
+    def close(self):
+        self.cube.close()
+        self.layer.close()
+
+
+class CubeStore:
+    def __init__(self, fingerprints, cube_root=None, tile_size=CUBE_TILE_SIZE, cached_tiles=4):
+        self.cube_dir = os.path.join(cube_root or default_cube_root(), digest_parts(list(fingerprints) + [tile_size]))
+        self.fingerprints = list(fingerprints)
+        self.tile_size = tile_size
+        self.cached_tiles = cached_tiles
+        self.meta = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._caches = []
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.cube_dir, 'cube.json')
+
+    def _tile_path(self, tile_row, tile_col):
+        return os.path.join(self.cube_dir, 'tiles', '{}_{}.npz'.format(tile_row, tile_col))
+
+    def load(self):
+        if not os.path.isfile(self.meta_path):
+            return False
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return False
+        if meta.get('version') != CUBE_VERSION or meta.get('fingerprints') != self.fingerprints:
+            return False
+        self.meta = meta
+        return True
+
+    def ingest(self, layers, progress=None):
+        if os.path.isdir(self.cube_dir):
+            shutil.rmtree(self.cube_dir, ignore_errors=True)
+        os.makedirs(os.path.join(self.cube_dir, 'tiles'))
+        size = self.tile_size
+        for col, row, array0 in iter_blocks(layers[0], block_cols=size, block_rows=size, on_block=progress):
+            rows, cols = array0.shape
+            arrays = [array0] + [read_block(layer, col, row, cols, rows) for layer in layers[1:]]
+            years = {'year_{}'.format(idx): array for idx, array in enumerate(arrays)}
+            np.savez_compressed(self._tile_path(row // size, col // size), **years)
+        meta = {
+            'version': CUBE_VERSION,
+            'fingerprints': self.fingerprints,
+            'width': layers[0].width(),
+            'height': layers[0].height(),
+            'tile_size': size,
+        }
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(meta, handle, indent=2)
+        os.replace(temp_path, self.meta_path)
+        self.meta = meta
+
+    def bands(self, layers):
+        return [CubeBand(self, idx, layer) for idx, layer in enumerate(layers)]
+
+    def _thread_tiles(self):
+        tiles = getattr(self._local, 'tiles', None)
+        if tiles is None:
+            tiles = self._local.tiles = OrderedDict()
+            with self._lock:
+                self._caches.append(tiles)
+        return tiles
+
+    def _tile(self, tile_row, tile_col):
+        tiles = self._thread_tiles()
+        key = (tile_row, tile_col)
+        tile = tiles.get(key)
+        if tile is None:
+            tile = {'file': np.load(self._tile_path(tile_row, tile_col)), 'years': {}}
+            tiles[key] = tile
+            while len(tiles) > self.cached_tiles:
+                _, evicted = tiles.popitem(last=False)
+                evicted['file'].close()
+        else:
+            tiles.move_to_end(key)
+        return tile
+
+    def _tile_year(self, tile_row, tile_col, index):
+        tile = self._tile(tile_row, tile_col)
+        array = tile['years'].get(index)
+        if array is None:
+            array = tile['file']['year_{}'.format(index)]
+            array.flags.writeable = False
+            tile['years'][index] = array
+        return array
+
+    def read_region(self, index, col, row, cols, rows):
+        size = self.tile_size
+        if col % size == 0 and row % size == 0 and cols <= size and rows <= size:
+            tile = self._tile_year(row // size, col // size, index)
+            if tile.shape == (rows, cols):
+                return tile
+            return tile[:rows, :cols]
+        region = None
+        for tile_row in range(row // size, (row + rows - 1) // size + 1):
+            for tile_col in range(col // size, (col + cols - 1) // size + 1):
+                tile = self._tile_year(tile_row, tile_col, index)
+                if region is None:
+                    region = np.zeros((rows, cols), dtype=tile.dtype)
+                r0 = max(row, tile_row * size)
+                c0 = max(col, tile_col * size)
+                r1 = min(row + rows, tile_row * size + tile.shape[0])
+                c1 = min(col + cols, tile_col * size + tile.shape[1])
+                region[r0 - row:r1 - row, c0 - col:c1 - col] = tile[r0 - tile_row * size:r1 - tile_row * size, c0 - tile_col * size:c1 - tile_col * size]
+        return region
+
+    def close(self):
+        with self._lock:
+            caches, self._caches = self._caches, []
+        for tiles in caches:
+            for tile in tiles.values():
+                tile['file'].close()
+            tiles.clear()
+        self._local = threading.local()
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 import csv
 import os
+import numpy as np
 import processing
 from qgis.core import QgsProject, QgsRasterLayer
 
+from .change_metrics import area_counts_to_array
+
 
 def _format_value(value):
     if isinstance(value, float):
@@ -19,6 +22,138 @@ def write_csv(path, headers, rows):
             writer.writerow([_format_value(v) for v in row])
 
 
+def _csv_field(value):
+    text = str(value)
+    if any(char in text for char in ',"\r\n'):
+        return '"{}"'.format(text.replace('"', '""'))
+    return text
+
+
+def _format_column(values):
+    if values.dtype.kind == 'f':
+        return np.char.mod('%.3f', values)
+    if values.dtype.kind in 'iub':
+        return values.astype(str)
+    return np.array([_csv_field(value) for value in values.tolist()], dtype=str)
+
+
+def write_table(path, table):
+    if len(table):
+        cells = np.column_stack([_format_column(column) for column in table.columns])
+    else:
+        cells = np.zeros((0, len(table.headers)), dtype=str)
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        np.savetxt(handle, cells, fmt='%s', delimiter=',', newline='\r\n',
+                   header=','.join(_csv_field(header) for header in table.headers), comments='')
+
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_GPKG = 'gpkg'
+GPKG_NAME = 'results.gpkg'
+
+
+def pyarrow_available():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def write_table_parquet(path, table):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrays = []
+    for column in table.columns:
+        if column.dtype.kind == 'O':
+            arrays.append(pa.array(column.tolist(), type=pa.string()))
+        else:
+            arrays.append(pa.array(column))
+    pq.write_table(pa.Table.from_arrays(arrays, names=table.headers), path)
+
+
+def write_table_npz(path, table):
+    columns = {}
+    for header, column in zip(table.headers, table.columns):
+        columns[header] = column.astype(str) if column.dtype.kind == 'O' else column
+    np.savez(path, **columns)
+
+
+def write_table_gpkg(path, name, table):
+    from osgeo import ogr
+    if os.path.isfile(path):
+        dataset = ogr.Open(path, 1)
+    else:
+        dataset = ogr.GetDriverByName('GPKG').CreateDataSource(path)
+    if dataset is None:
+        raise RuntimeError('Could not open {}'.format(path))
+    layer = dataset.CreateLayer(name, geom_type=ogr.wkbNone, options=['OVERWRITE=YES'])
+    for header, column in zip(table.headers, table.columns):
+        if column.dtype.kind == 'f':
+            field_type = ogr.OFTReal
+        elif column.dtype.kind in 'iub':
+            field_type = ogr.OFTInteger64
+        else:
+            field_type = ogr.OFTString
+        layer.CreateField(ogr.FieldDefn(header, field_type))
+    defn = layer.GetLayerDefn()
+    layer.StartTransaction()
+    for values in zip(*[column.tolist() for column in table.columns]):
+        feature = ogr.Feature(defn)
+        for idx, value in enumerate(values):
+            feature.SetField(idx, value)
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    dataset = None
+
+
+class TableWriter:
+    def __init__(self, output_dir, formats=(FORMAT_CSV,)):
+        self.output_dir = output_dir
+        self.formats = set(formats)
+        self.parquet_fallback = FORMAT_PARQUET in self.formats and not pyarrow_available()
+        self._gpkg_started = False
+
+    @property
+    def gpkg_path(self):
+        return os.path.join(self.output_dir, GPKG_NAME)
+
+    def write(self, name, table):
+        written = []
+        if FORMAT_CSV in self.formats:
+            write_table(os.path.join(self.output_dir, name + '.csv'), table)
+            written.append(name + '.csv')
+        if FORMAT_PARQUET in self.formats:
+            if self.parquet_fallback:
+                write_table_npz(os.path.join(self.output_dir, name + '.npz'), table)
+                written.append(name + '.npz')
+            else:
+                write_table_parquet(os.path.join(self.output_dir, name + '.parquet'), table)
+                written.append(name + '.parquet')
+        if FORMAT_GPKG in self.formats:
+            if not self._gpkg_started and os.path.isfile(self.gpkg_path):
+                os.remove(self.gpkg_path)
+            self._gpkg_started = True
+            write_table_gpkg(self.gpkg_path, name, table)
+            written.append('{} ({})'.format(GPKG_NAME, name))
+        return written
+
+
+def write_result_arrays(path, years, area_counts_list, interval_results):
+    arrays = {'years': np.asarray(years, dtype=np.int64)}
+    for year, area_counts in zip(years, area_counts_list):
+        arrays['histogram_{}'.format(year)] = area_counts_to_array(area_counts)
+    for year0, year1, result in interval_results:
+        prefix = '{}_{}'.format(year0, year1)
+        arrays['matrix_' + prefix] = np.asarray(result['matrix'], dtype=np.int64)
+        arrays['gain_' + prefix] = np.asarray(result['gain'], dtype=np.int64)
+        arrays['loss_' + prefix] = np.asarray(result['loss'], dtype=np.int64)
+        arrays['changed_pixels_' + prefix] = np.int64(result['changed_pixels'])
+        arrays['total_pixels_' + prefix] = np.int64(result['total_pixels'])
+    np.savez(path, **arrays)
+
+
 def add_raster_to_project(path):
     layer = QgsRasterLayer(path, path)
     if layer.isValid():
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .raster_reader import iter_blocks, read_block
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def merge_components(count, a, b):
+    labels = np.arange(count, dtype=np.int64)
+    while a.shape[0]:
+        la = labels[a]
+        lb = labels[b]
+        pending = la != lb
+        if not pending.any():
+            break
+        la = la[pending]
+        lb = lb[pending]
+        low = np.minimum(la, lb)
+        np.minimum.at(labels, la, low)
+        np.minimum.at(labels, lb, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+def label_patches(array, valid, connectivity=4):
+    rows, cols = array.shape
+    index = np.arange(rows * cols, dtype=np.int64).reshape((rows, cols))
+    same_h = valid[:, 1:] & valid[:, :-1] & (array[:, 1:] == array[:, :-1])
+    same_v = valid[1:, :] & valid[:-1, :] & (array[1:, :] == array[:-1, :])
+    a = [index[:, 1:][same_h], index[1:, :][same_v]]
+    b = [index[:, :-1][same_h], index[:-1, :][same_v]]
+    if connectivity == 8:
+        same_d = valid[1:, 1:] & valid[:-1, :-1] & (array[1:, 1:] == array[:-1, :-1])
+        same_a = valid[1:, :-1] & valid[:-1, 1:] & (array[1:, :-1] == array[:-1, 1:])
+        a += [index[1:, 1:][same_d], index[1:, :-1][same_a]]
+        b += [index[:-1, :-1][same_d], index[:-1, 1:][same_a]]
+    roots = merge_components(rows * cols, np.concatenate(a), np.concatenate(b)).reshape((rows, cols))
+    labels = np.full((rows, cols), -1, dtype=np.int64)
+    unique, inverse = np.unique(roots[valid], return_inverse=True)
+    labels[valid] = inverse
+    return labels, unique.shape[0]
+
+
+def _boundary_pairs(labels0, classes0, labels1, classes1):
+    linked = (labels0 >= 0) & (labels1 >= 0) & (classes0 == classes1)
+    return labels0[linked], labels1[linked]
+
+
+def _edge_counts(classes0, valid0, classes1, valid1, size, weights=None):
+    differ = valid0 & valid1 & (classes0 != classes1)
+    if weights is not None:
+        weights = np.broadcast_to(weights, differ.shape)[differ]
+    return (np.bincount(classes0[differ], weights=weights, minlength=size)[:size]
+            + np.bincount(classes1[differ], weights=weights, minlength=size)[:size])
+
+
+class _PatchStats:
+    def __init__(self, size):
+        self.size = size
+        self.patch_count = np.zeros(size, dtype=np.int64)
+        self.area_sum = np.zeros(size, dtype=np.int64)
+        self.area_max = np.zeros(size, dtype=np.int64)
+        self.weighted_sum = np.zeros(size, dtype=np.float64)
+        self.weighted_max = np.zeros(size, dtype=np.float64)
+
+    def finalize(self, classes, areas, weighted):
+        if classes.shape[0] == 0:
+            return
+        self.patch_count += np.bincount(classes, minlength=self.size)[:self.size]
+        self.area_sum += np.bincount(classes, weights=areas, minlength=self.size)[:self.size].astype(np.int64)
+        np.maximum.at(self.area_max, classes, areas)
+        self.weighted_sum += np.bincount(classes, weights=weighted, minlength=self.size)[:self.size]
+        np.maximum.at(self.weighted_max, classes, weighted)
+
+
+class _FragmentationScan:
+    def __init__(self, width, size, row_areas=None, edge_rows=None):
+        self.width = width
+        self.size = size
+        self.row_areas = row_areas
+        self.edge_rows = edge_rows
+        self.stats = _PatchStats(size)
+        self.edges_h = np.zeros(size, dtype=np.int64)
+        self.edges_v = np.zeros(size, dtype=np.int64)
+        self.edge_length = np.zeros(size, dtype=np.float64)
+        self.valid_pixels = 0
+        self.valid_area = 0.0
+        self.open_class = np.zeros(0, dtype=np.int64)
+        self.open_area = np.zeros(0, dtype=np.int64)
+        self.open_weighted = np.zeros(0, dtype=np.float64)
+        self.frontier_labels = None
+        self.frontier_classes = None
+        self.frontier_valid = None
+        self.current_row = None
+        self.row_class = self.row_area = self.row_weighted = None
+        self.links = []
+        self.bottom_labels = self.bottom_classes = self.bottom_valid = None
+        self.left_labels = self.left_classes = self.left_valid = None
+
+    def _close_row(self, bottom_labels):
+        node_class = self.row_class
+        count = node_class.shape[0]
+        if self.links:
+            a = np.concatenate([pair[0] for pair in self.links])
+            b = np.concatenate([pair[1] for pair in self.links])
+        else:
+            a = b = np.zeros(0, dtype=np.int64)
+        roots = merge_components(count, a, b)
+        unique, inverse = np.unique(roots, return_inverse=True)
+        merged_area = np.bincount(inverse, weights=self.row_area, minlength=unique.shape[0]).astype(np.int64)
+        merged_weighted = np.bincount(inverse, weights=self.row_weighted, minlength=unique.shape[0])
+        merged_class = np.zeros(unique.shape[0], dtype=np.int64)
+        merged_class[inverse] = node_class
+        keep = np.zeros(unique.shape[0], dtype=bool)
+        bottom_valid = bottom_labels >= 0
+        keep[inverse[bottom_labels[bottom_valid]]] = True
+        self.stats.finalize(merged_class[~keep], merged_area[~keep], merged_weighted[~keep])
+        compact = np.cumsum(keep) - 1
+        new_labels = np.full(bottom_labels.shape[0], -1, dtype=np.int64)
+        new_labels[bottom_valid] = compact[inverse[bottom_labels[bottom_valid]]]
+        return merged_class[keep], merged_area[keep], merged_weighted[keep], new_labels
+
+    def add(self, col, row, array, valid):
+        rows, cols = array.shape
+        size = self.size
+        if row != self.current_row:
+            if self.current_row is not None:
+                self.open_class, self.open_area, self.open_weighted, self.frontier_labels = self._close_row(self.bottom_labels)
+                self.frontier_classes = self.bottom_classes
+                self.frontier_valid = self.bottom_valid
+            self.current_row = row
+            self.links = []
+            self.bottom_labels = np.full(self.width, -1, dtype=np.int64)
+            self.bottom_classes = np.zeros(self.width, dtype=np.int64)
+            self.bottom_valid = np.zeros(self.width, dtype=bool)
+            self.left_labels = None
+            self.row_class = self.open_class
+            self.row_area = self.open_area
+            self.row_weighted = self.open_weighted
+
+        classes = np.where(valid, array, 0).astype(np.int64)
+        self.valid_pixels += int(valid.sum())
+        if self.row_areas is not None:
+            self.valid_area += float(valid.sum(axis=1) @ self.row_areas[row:row + rows])
+        self.edges_h += _edge_counts(classes[:, 1:], valid[:, 1:], classes[:, :-1], valid[:, :-1], size)
+        self.edges_v += _edge_counts(classes[1:, :], valid[1:, :], classes[:-1, :], valid[:-1, :], size)
+        if self.edge_rows is not None:
+            heights, widths = self.edge_rows
+            self.edge_length += _edge_counts(classes[:, 1:], valid[:, 1:], classes[:, :-1], valid[:, :-1], size, heights[row:row + rows, None])
+            self.edge_length += _edge_counts(classes[1:, :], valid[1:, :], classes[:-1, :], valid[:-1, :], size, widths[row + 1:row + rows, None])
+
+        labels, count = label_patches(classes, valid)
+        offset = self.row_class.shape[0]
+        tile_labels = np.where(labels >= 0, labels + offset, -1)
+        tile_class = np.zeros(count, dtype=np.int64)
+        tile_class[labels[valid]] = classes[valid]
+        tile_area = np.bincount(labels[valid], minlength=count).astype(np.int64)
+        if self.row_areas is not None:
+            weights = np.broadcast_to(self.row_areas[row:row + rows, None], valid.shape)[valid]
+            tile_weighted = np.bincount(labels[valid], weights=weights, minlength=count)
+        else:
+            tile_weighted = tile_area.astype(np.float64)
+        self.row_class = np.concatenate([self.row_class, tile_class])
+        self.row_area = np.concatenate([self.row_area, tile_area])
+        self.row_weighted = np.concatenate([self.row_weighted, tile_weighted])
+
+        if self.left_labels is not None:
+            self.edges_h += _edge_counts(classes[:, 0], valid[:, 0], self.left_classes, self.left_valid, size)
+            if self.edge_rows is not None:
+                self.edge_length += _edge_counts(classes[:, 0], valid[:, 0], self.left_classes, self.left_valid, size, heights[row:row + rows])
+            self.links.append(_boundary_pairs(tile_labels[:, 0], classes[:, 0], self.left_labels, self.left_classes))
+        if self.frontier_labels is not None:
+            above = slice(col, col + cols)
+            frontier_classes = self.frontier_classes[above]
+            frontier_valid = self.frontier_valid[above]
+            self.edges_v += _edge_counts(classes[0, :], valid[0, :], frontier_classes, frontier_valid, size)
+            if self.edge_rows is not None:
+                self.edge_length += _edge_counts(classes[0, :], valid[0, :], frontier_classes, frontier_valid, size, widths[row])
+            self.links.append(_boundary_pairs(tile_labels[0, :], classes[0, :], self.frontier_labels[above], frontier_classes))
+
+        self.left_labels = tile_labels[:, -1]
+        self.left_classes = classes[:, -1]
+        self.left_valid = valid[:, -1]
+        self.bottom_labels[col:col + cols] = tile_labels[-1, :]
+        self.bottom_classes[col:col + cols] = classes[-1, :]
+        self.bottom_valid[col:col + cols] = valid[-1, :]
+
+    def result(self):
+        if self.current_row is not None:
+            self._close_row(np.full(0, -1, dtype=np.int64))
+            self.current_row = None
+        result = {
+            'patch_count': self.stats.patch_count,
+            'area_sum': self.stats.area_sum,
+            'area_max': self.stats.area_max,
+            'edges_h': self.edges_h,
+            'edges_v': self.edges_v,
+            'valid_pixels': self.valid_pixels,
+        }
+        if self.edge_rows is not None:
+            result['edge_length'] = self.edge_length
+        if self.row_areas is not None:
+            result['valid_area'] = self.valid_area
+            result['weighted_area_sum'] = self.stats.weighted_sum
+            result['weighted_area_max'] = self.stats.weighted_max
+        return result
+
+
+def compute_fragmentation_stack(layers, nodata_list, mask_layer, max_class, progress=None, row_areas=None, edge_rows=None):
+    base = layers[0]
+    scans = [_FragmentationScan(base.width(), max_class + 1, row_areas, edge_rows) for _ in layers]
+    for col, row, array0 in iter_blocks(base, on_block=progress):
+        rows, cols = array0.shape
+        region = None
+        if mask_layer is not None:
+            region = read_block(mask_layer, col, row, cols, rows) == 1
+        for idx, (scan, layer, nodata) in enumerate(zip(scans, layers, nodata_list)):
+            array = array0 if idx == 0 else read_block(layer, col, row, cols, rows)
+            valid = _valid_mask(array, nodata)
+            if region is not None:
+                valid &= region
+            scan.add(col, row, array, valid)
+    return [scan.result() for scan in scans]
+
+
+def compute_fragmentation(layer, nodata, mask_layer, max_class, progress=None, row_areas=None, edge_rows=None):
+    return compute_fragmentation_stack([layer], [nodata], mask_layer, max_class, progress, row_areas, edge_rows)[0]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import re
+
+import numpy as np
+
+from .area import area_factor_from
+
+
+def parse_group(text):
+    match = re.match(r'^(\d+)\s*(?:[:=]\s*(.*))?$', text.strip())
+    if match is None:
+        raise ValueError('Invalid group "{}" (expected an ID, optionally followed by ": label").'.format(text.strip()))
+    return int(match.group(1)), (match.group(2) or '').strip()
+
+
+def unmapped_offset(groups):
+    return max(groups.values(), default=-1) + 1
+
+
+def group_targets(groups, size, exclude=()):
+    offset = unmapped_offset(groups)
+    return np.array([groups[class_id] if class_id in groups and class_id not in exclude else offset + class_id
+                     for class_id in range(size)], dtype=np.int64)
+
+
+def grouping_matrix(groups, size, exclude=()):
+    targets = group_targets(groups, size, exclude)
+    grouping = np.zeros((size, int(targets.max()) + 1 if size else 0), dtype=np.int64)
+    grouping[np.arange(size), targets] = 1
+    return grouping
+
+
+def unmapped_classes(groups, area_counts_list):
+    present = set()
+    for area_counts in area_counts_list:
+        present.update(class_id for class_id, count in area_counts.items() if count)
+    return sorted(present - set(groups))
+
+
+def group_counts(counts, grouping):
+    counts = np.asarray(counts)
+    padded = np.zeros(grouping.shape[0], dtype=counts.dtype)
+    padded[:counts.shape[0]] = counts[:grouping.shape[0]]
+    return padded @ grouping
+
+
+def group_matrix(matrix, grouping):
+    size = grouping.shape[0]
+    return grouping.T @ np.asarray(matrix)[:size, :size] @ grouping
+
+
+def group_area_counts(area_counts, grouping):
+    counts = np.zeros(grouping.shape[0], dtype=np.int64)
+    for class_id, count in area_counts.items():
+        counts[class_id] = count
+    grouped = counts @ grouping
+    return {int(i): int(grouped[i]) for i in np.nonzero(grouped)[0]}
+
+
+def group_area_factor(counts, areas, grouping, scale=1.0):
+    if np.ndim(counts) == 1:
+        return area_factor_from(group_counts(counts, grouping), group_counts(areas, grouping)) * scale
+    return area_factor_from(group_matrix(counts, grouping), group_matrix(areas, grouping)) * scale
@@ -32,7 +32,23 @@ def _write_blank_raster(layer, output_path):
     dataset = None
 
 
-def build_hotspot_raster(layer0, layer1, nodata0, nodata1, mask_layer, output_path, max_points=50000, progress=None):
+def _changed_blocks(layer0, layer1, nodata0, nodata1, mask_layer, progress=None):
+    for col, row, array0 in iter_blocks(layer0, on_block=progress):
+        array1 = read_block(layer1, col, row, array0.shape[1], array0.shape[0])
+        valid = _valid_mask(array0, nodata0) & _valid_mask(array1, nodata1)
+        if mask_layer is not None:
+            mask = read_block(mask_layer, col, row, array0.shape[1], array0.shape[0])
+            valid &= mask == 1
+        yield col, row, valid & (array0 != array1)
+
+
+def _mask_blocks(change_masks, interval, progress=None):
+    for tile_index, col, row, cols, rows in change_masks.iter_tiles(on_block=progress):
+        yield col, row, change_masks.change_tile(interval, tile_index, cols, rows)
+
+
+def build_hotspot_raster(layer0, layer1, nodata0, nodata1, mask_layer, output_path, max_points=50000, progress=None,
+                         change_masks=None, interval=None):
     authid = layer0.crs().authid()
     crs = authid if authid else layer0.crs().toWkt()
     vlayer = QgsVectorLayer('Point?crs={}'.format(crs), 'change_points', 'memory')
@@ -48,14 +64,13 @@ def build_hotspot_raster(layer0, layer1, nodata0, nodata1, mask_layer, output_pa
     x_min = extent.xMinimum()
     y_max = extent.yMaximum()
 
+    if change_masks is not None:
+        blocks = _mask_blocks(change_masks, interval, progress)
+    else:
+        blocks = _changed_blocks(layer0, layer1, nodata0, nodata1, mask_layer, progress)
+
     points_added = 0
-    for col, row, array0 in iter_blocks(layer0, on_block=progress):
-        array1 = read_block(layer1, col, row, array0.shape[1], array0.shape[0])
-        valid = _valid_mask(array0, nodata0) & _valid_mask(array1, nodata1)
-        if mask_layer is not None:
-            mask = read_block(mask_layer, col, row, array0.shape[1], array0.shape[0])
-            valid &= mask == 1
-        changed = valid & (array0 != array1)
+    for col, row, changed in blocks:
         if not changed.any():
             continue
 
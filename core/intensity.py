@@ -1,20 +1,18 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 
-def compute_intensity_rows(interval_results):
-    rows = []
-    for r0, r1, _, _, result in interval_results:
-        total = result['total_pixels']
-        changed = result['changed_pixels']
-        interval_years = r1.year - r0.year
-        interval_intensity = (changed / total) if total else 0.0
-        annualized = interval_intensity / interval_years if interval_years else 0.0
-        rows.append([
-            r0.year,
-            r1.year,
-            interval_years,
-            changed,
-            total,
-            interval_intensity,
-            annualized,
-        ])
-    return rows
+from .tables import Table
+
+
+def compute_intensity_table(interval_results):
+    year0 = np.array([r0.year for r0, _, _, _, _ in interval_results], dtype=np.int64)
+    year1 = np.array([r1.year for _, r1, _, _, _ in interval_results], dtype=np.int64)
+    changed = np.array([result['changed_pixels'] for _, _, _, _, result in interval_results])
+    total = np.array([result['total_pixels'] for _, _, _, _, result in interval_results])
+    interval_years = year1 - year0
+    interval_intensity = np.where(total > 0, changed / np.where(total > 0, total, 1), 0.0)
+    annualized = np.where(interval_years != 0, interval_intensity / np.where(interval_years != 0, interval_years, 1), 0.0)
+    return Table(
+        ['year0', 'year1', 'interval_years', 'changed_pixels', 'total_pixels', 'interval_intensity', 'annualized_intensity'],
+        [year0, year1, interval_years, changed, total, interval_intensity, annualized],
+    )
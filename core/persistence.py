@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import os
+
 import numpy as np
 from osgeo import gdal
 from .raster_reader import iter_blocks, read_block
@@ -10,22 +12,37 @@ def _valid_mask(array, nodata):
     return array != nodata
 
 
-def write_change_frequency(layers, nodata_list, mask_layer, output_path, progress=None):
-    base = layers[0]
-    width = base.width()
-    height = base.height()
+def _create_frequency_raster(base, output_path):
     extent = base.extent()
     px_x = base.rasterUnitsPerPixelX()
     px_y = abs(base.rasterUnitsPerPixelY())
-
     driver = gdal.GetDriverByName('GTiff')
-    dataset = driver.Create(output_path, width, height, 1, gdal.GDT_Int16)
+    dataset = driver.Create(output_path, base.width(), base.height(), 1, gdal.GDT_Int16)
     dataset.SetGeoTransform((extent.xMinimum(), px_x, 0.0, extent.yMaximum(), 0.0, -px_y))
     dataset.SetProjection(base.crs().toWkt())
+    dataset.GetRasterBand(1).SetNoDataValue(-1)
+    return dataset
+
+
+def write_change_frequency(layers, nodata_list, mask_layer, output_path, progress=None, checkpoint=None):
+    base = layers[0]
+    start_block = 0
+    dataset = None
+    if checkpoint is not None and os.path.isfile(output_path):
+        start_block, _ = checkpoint.load()
+        if start_block:
+            dataset = gdal.Open(output_path, gdal.GA_Update)
+            if dataset is None:
+                start_block = 0
+                checkpoint.resumed_from = 0
+    if dataset is None:
+        dataset = _create_frequency_raster(base, output_path)
     band = dataset.GetRasterBand(1)
-    band.SetNoDataValue(-1)
 
-    for col, row, array0 in iter_blocks(base, on_block=progress):
+    blocks = iter_blocks(base, on_block=progress, start_block=start_block)
+    for block_index, (col, row, array0) in enumerate(blocks, start_block):
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.save(block_index, flush=dataset.FlushCache)
         rows = array0.shape[0]
         cols = array0.shape[1]
         valid_all = _valid_mask(array0, nodata_list[0])
@@ -52,3 +69,49 @@ def write_change_frequency(layers, nodata_list, mask_layer, output_path, progres
     band.FlushCache()
     dataset.FlushCache()
     dataset = None
+    if checkpoint is not None:
+        checkpoint.clear()
+
+
+def update_change_frequency(path, layers, nodata_list, mask_layer, progress=None):
+    dataset = gdal.Open(path, gdal.GA_Update)
+    if dataset is None:
+        raise ValueError('Cannot open change frequency raster for update: {}'.format(path))
+    band = dataset.GetRasterBand(1)
+
+    for col, row, array0 in iter_blocks(layers[0], on_block=progress):
+        rows = array0.shape[0]
+        cols = array0.shape[1]
+        change_count = band.ReadAsArray(col, row, cols, rows).astype(np.int16)
+        valid_all = change_count >= 0
+        mask = None
+        if mask_layer is not None:
+            mask = read_block(mask_layer, col, row, cols, rows)
+        prev = array0
+
+        for idx in range(1, len(layers)):
+            curr = read_block(layers[idx], col, row, cols, rows)
+            valid = _valid_mask(curr, nodata_list[idx])
+            if mask is not None:
+                valid &= mask == 1
+            valid_all &= valid
+            changed = (prev != curr) & valid_all
+            change_count[changed] += 1
+            prev = curr
+
+        change_count[~valid_all] = -1
+        band.WriteArray(change_count, xoff=col, yoff=row)
+
+    band.FlushCache()
+    dataset.FlushCache()
+    dataset = None
+
+
+def write_change_frequency_from_masks(change_masks, base, output_path, progress=None):
+    dataset = _create_frequency_raster(base, output_path)
+    band = dataset.GetRasterBand(1)
+    for tile_index, col, row, cols, rows in change_masks.iter_tiles(on_block=progress):
+        band.WriteArray(change_masks.change_frequency_tile(tile_index, cols, rows), xoff=col, yoff=row)
+    band.FlushCache()
+    dataset.FlushCache()
+    dataset = None
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from .fragmentation import label_patches, merge_components
+from .raster_reader import iter_blocks, read_block
+
+PATCHES_NAME = 'change_patches.gpkg'
+DEFAULT_MIN_AREA_HA = 1.0
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+TRANSACTION_SIZE = 100000
+LABEL_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE']
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def _geotransform(layer):
+    extent = layer.extent()
+    return (extent.xMinimum(), layer.rasterUnitsPerPixelX(), 0.0, extent.yMaximum(), 0.0, -abs(layer.rasterUnitsPerPixelY()))
+
+
+def _label_changes(layer0, layer1, nodata0, nodata1, mask_layer, max_class, label_path, row_areas, progress=None):
+    size = max_class + 1
+    width = layer0.width()
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(label_path, width, layer0.height(), 1, gdal.GDT_UInt32, options=LABEL_OPTIONS)
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(0)
+
+    patch_codes = []
+    patch_areas = []
+    links = []
+    offset = 0
+    current_row = None
+    left_ids = left_codes = None
+    above_ids = above_codes = None
+    bottom_ids = bottom_codes = None
+
+    for col, row, array0 in iter_blocks(layer0, on_block=progress):
+        rows, cols = array0.shape
+        if row != current_row:
+            current_row = row
+            above_ids, above_codes = bottom_ids, bottom_codes
+            bottom_ids = np.full(width, -1, dtype=np.int64)
+            bottom_codes = np.full(width, -1, dtype=np.int64)
+            left_ids = None
+        array1 = read_block(layer1, col, row, cols, rows)
+        changed = _valid_mask(array0, nodata0) & _valid_mask(array1, nodata1) & (array0 != array1)
+        if mask_layer is not None:
+            changed &= read_block(mask_layer, col, row, cols, rows) == 1
+        codes = np.where(changed, array0.astype(np.int64) * size + array1.astype(np.int64), -1)
+
+        labels, count = label_patches(codes, changed)
+        ids = np.where(labels >= 0, labels + offset, -1)
+        tile_codes = np.zeros(count, dtype=np.int64)
+        tile_codes[labels[changed]] = codes[changed]
+        weights = np.broadcast_to(row_areas[row:row + rows, None], (rows, cols))
+        patch_codes.append(tile_codes)
+        patch_areas.append(np.bincount(labels[changed], weights=weights[changed], minlength=count))
+        band.WriteArray((ids + 1).astype(np.uint32), xoff=col, yoff=row)
+
+        for edge_ids, edge_codes, other_ids, other_codes in (
+            (ids[:, 0], codes[:, 0], left_ids, left_codes),
+            (ids[0, :], codes[0, :], None if above_ids is None else above_ids[col:col + cols],
+             None if above_codes is None else above_codes[col:col + cols]),
+        ):
+            if other_ids is None:
+                continue
+            linked = (edge_ids >= 0) & (other_ids >= 0) & (edge_codes == other_codes)
+            if linked.any():
+                links.append(np.unique(np.stack([edge_ids[linked], other_ids[linked]]), axis=1))
+
+        left_ids = ids[:, -1]
+        left_codes = codes[:, -1]
+        bottom_ids[col:col + cols] = ids[-1, :]
+        bottom_codes[col:col + cols] = codes[-1, :]
+        offset += count
+
+    band.FlushCache()
+    dataset = None
+    if links:
+        pairs = np.concatenate(links, axis=1)
+        roots = merge_components(offset, pairs[0], pairs[1])
+    else:
+        roots = np.arange(offset, dtype=np.int64)
+    codes = np.concatenate(patch_codes) if patch_codes else np.zeros(0, dtype=np.int64)
+    areas = np.concatenate(patch_areas) if patch_areas else np.zeros(0, dtype=np.float64)
+    return roots, codes, areas
+
+
+class _TilePolygonizer:
+    def __init__(self, label_path, roots, keep, geotransform):
+        self.label_path = label_path
+        self.roots = roots
+        self.keep = keep
+        self.geotransform = geotransform
+        self._local = threading.local()
+
+    def _band(self):
+        dataset = getattr(self._local, 'dataset', None)
+        if dataset is None:
+            dataset = gdal.Open(self.label_path, gdal.GA_ReadOnly)
+            self._local.dataset = dataset
+        return dataset.GetRasterBand(1)
+
+    def __call__(self, window):
+        col, row, cols, rows = window
+        labels = self._band().ReadAsArray(col, row, cols, rows).astype(np.int64) - 1
+        present = labels >= 0
+        local_ids = np.unique(labels[present])
+        patch = np.zeros((rows, cols), dtype=np.uint32)
+        roots = self.roots[labels[present]]
+        kept = self.keep[roots]
+        if not kept.any():
+            return local_ids, []
+        values = np.zeros(roots.shape[0], dtype=np.uint32)
+        values[kept] = (roots[kept] + 1).astype(np.uint32)
+        patch[present] = values
+
+        x0, px_x, _, y0, _, px_y = self.geotransform
+        raster = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, gdal.GDT_UInt32)
+        raster.SetGeoTransform((x0 + col * px_x, px_x, 0.0, y0 + row * px_y, 0.0, px_y))
+        source = raster.GetRasterBand(1)
+        source.WriteArray(patch)
+        vector = ogr.GetDriverByName('Memory').CreateDataSource('')
+        layer = vector.CreateLayer('patches', geom_type=ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn('patch', ogr.OFTInteger64))
+        gdal.Polygonize(source, source, layer, 0, [])
+        pieces = [(feature.GetField(0) - 1, feature.GetGeometryRef().ExportToWkb()) for feature in layer]
+        return local_ids, pieces
+
+
+class PatchWriter:
+    def __init__(self, path, name, crs_wkt, legend_map=None, transaction_size=TRANSACTION_SIZE):
+        if os.path.isfile(path):
+            self.dataset = ogr.Open(path, 1)
+        else:
+            self.dataset = ogr.GetDriverByName('GPKG').CreateDataSource(path)
+        if self.dataset is None:
+            raise RuntimeError('Could not open {}'.format(path))
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(crs_wkt)
+        self.layer = self.dataset.CreateLayer(name, srs=srs, geom_type=ogr.wkbMultiPolygon,
+                                              options=['OVERWRITE=YES', 'SPATIAL_INDEX=YES'])
+        for field_name, field_type in (
+            ('from_class', ogr.OFTInteger),
+            ('to_class', ogr.OFTInteger),
+            ('from_label', ogr.OFTString),
+            ('to_label', ogr.OFTString),
+            ('area_ha', ogr.OFTReal),
+        ):
+            self.layer.CreateField(ogr.FieldDefn(field_name, field_type))
+        self.defn = self.layer.GetLayerDefn()
+        self.legend_map = legend_map or {}
+        self.transaction_size = transaction_size
+        self.pending = 0
+        self.count = 0
+        self.layer.StartTransaction()
+
+    def add(self, geometry, from_class, to_class, area_m2):
+        feature = ogr.Feature(self.defn)
+        feature.SetField(0, int(from_class))
+        feature.SetField(1, int(to_class))
+        feature.SetField(2, self.legend_map.get(int(from_class), str(from_class)))
+        feature.SetField(3, self.legend_map.get(int(to_class), str(to_class)))
+        feature.SetField(4, float(area_m2) / 10000.0)
+        feature.SetGeometry(ogr.ForceToMultiPolygon(geometry))
+        self.layer.CreateFeature(feature)
+        self.count += 1
+        self.pending += 1
+        if self.pending >= self.transaction_size:
+            self.layer.CommitTransaction()
+            self.layer.StartTransaction()
+            self.pending = 0
+
+    def close(self):
+        if self.dataset is None:
+            return
+        self.layer.CommitTransaction()
+        self.layer = None
+        self.dataset = None
+
+
+def polygonize_changes(layer0, layer1, nodata0, nodata1, mask_layer, max_class, output_path, name, legend_map=None,
+                       min_area_ha=DEFAULT_MIN_AREA_HA, row_areas=None, workers=DEFAULT_WORKERS,
+                       progress=None):
+    if row_areas is None:
+        row_areas = np.full(layer0.height(), abs(layer0.rasterUnitsPerPixelX() * layer0.rasterUnitsPerPixelY()))
+    label_path = os.path.splitext(output_path)[0] + '_{}_labels.tif'.format(name)
+    size = max_class + 1
+    try:
+        roots, codes, areas = _label_changes(layer0, layer1, nodata0, nodata1, mask_layer, max_class, label_path, row_areas, progress)
+        root_area = np.bincount(roots, weights=areas, minlength=roots.shape[0])
+        keep = root_area >= min_area_ha * 10000.0
+        remaining = np.bincount(roots, minlength=roots.shape[0])
+        members = remaining.copy()
+
+        writer = PatchWriter(output_path, name, layer0.crs().toWkt(), legend_map)
+        pieces = {}
+        polygonizer = _TilePolygonizer(label_path, roots, keep, _geotransform(layer0))
+        windows = [(col, row, min(256, layer0.width() - col), min(256, layer0.height() - row))
+                   for row in range(0, layer0.height(), 256) for col in range(0, layer0.width(), 256)]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for start in range(0, len(windows), max(1, workers) * 4):
+                    for local_ids, tile_pieces in executor.map(polygonizer, windows[start:start + max(1, workers) * 4]):
+                        if progress:
+                            progress()
+                        for root, wkb in tile_pieces:
+                            geometry = ogr.CreateGeometryFromWkb(wkb)
+                            if members[root] == 1:
+                                writer.add(geometry, codes[root] // size, codes[root] % size, root_area[root])
+                            else:
+                                pieces.setdefault(root, []).append(geometry)
+                        if local_ids.shape[0] == 0:
+                            continue
+                        tile_roots = roots[local_ids]
+                        np.subtract.at(remaining, tile_roots, 1)
+                        for root in np.unique(tile_roots[(remaining[tile_roots] == 0) & (members[tile_roots] > 1)]).tolist():
+                            parts = pieces.pop(root, None)
+                            if not parts:
+                                continue
+                            merged = ogr.Geometry(ogr.wkbMultiPolygon)
+                            for part in parts:
+                                merged.AddGeometry(part)
+                            writer.add(merged.UnionCascaded(), codes[root] // size, codes[root] % size, root_area[root])
+        finally:
+            writer.close()
+        return writer.count
+    finally:
+        if os.path.isfile(label_path):
+            gdal.GetDriverByName('GTiff').Delete(label_path)
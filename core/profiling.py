@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .exports import write_csv
+
+PROFILE_ENV_VAR = 'LULC_PROFILE'
+
+
+def profiling_requested(enabled=False):
+    value = os.environ.get(PROFILE_ENV_VAR, '').strip().lower()
+    return bool(enabled) or value in ('1', 'true', 'yes', 'on')
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, thread_id, root, counts, interval=0.005):
+        super().__init__(name='lulc-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.counts = counts
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            stack.append(self.root)
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class StageProfiler:
+    def __init__(self, output_dir, enabled=False, top_allocations=25, sample_interval=0.005):
+        self.enabled = enabled
+        self.profile_dir = os.path.join(output_dir, 'profile')
+        self.top_allocations = top_allocations
+        self.sample_interval = sample_interval
+        self.stages = []
+        self._collapsed = {}
+        self._active = False
+        self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled or self._active:
+            yield
+            return
+        self._active = True
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler = _StackSampler(threading.get_ident(), name, self._collapsed, self.sample_interval)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            sampler.stop()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            prefix = '{:02d}_{}'.format(len(self.stages) + 1, name)
+            profiler.dump_stats(os.path.join(self.profile_dir, '{}.pstats'.format(prefix)))
+            self._write_allocations(os.path.join(self.profile_dir, '{}_allocations.txt'.format(prefix)), name, before, after)
+            self.stages.append([name, elapsed, peak / (1024.0 * 1024.0)])
+            self._active = False
+
+    def _write_allocations(self, path, name, before, after):
+        stats = after.compare_to(before, 'lineno')
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write('Top allocation sites for stage: {}\n\n'.format(name))
+            for stat in stats[:self.top_allocations]:
+                handle.write('{}\n'.format(stat))
+
+    def finish(self):
+        if not self.enabled:
+            return False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if not self.stages:
+            return False
+        with open(os.path.join(self.profile_dir, 'stacks.collapsed'), 'w', encoding='utf-8') as handle:
+            for key, count in sorted(self._collapsed.items()):
+                handle.write('{} {}\n'.format(key, count))
+        write_csv(os.path.join(self.profile_dir, 'stages.csv'),
+                  ['stage', 'seconds', 'peak_traced_mb'],
+                  self.stages)
+        return True
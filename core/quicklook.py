@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .raster_reader import decimated_size, iter_blocks, read_block
+
+DEFAULT_QUICKLOOK_FACTOR = 8
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def _grow(array, shape):
+    target = tuple(max(a, b) for a, b in zip(array.shape, shape))
+    if target == array.shape:
+        return array
+    grown = np.zeros(target, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+def _ratio_variance(totals, squares, cross, sampled_sum, sampled_squares, blocks):
+    totals = np.asarray(totals, dtype=np.float64)
+    if blocks <= 1 or sampled_sum <= 0:
+        return np.zeros(totals.shape, dtype=np.float64)
+    ratio = totals / sampled_sum
+    residual = squares - 2.0 * ratio * cross + ratio * ratio * sampled_squares
+    return blocks * np.maximum(residual, 0.0) / (blocks - 1)
+
+
+class _BlockSums:
+    def __init__(self, shape):
+        self.total = np.zeros(shape, dtype=np.int64)
+        self.squares = np.zeros(shape, dtype=np.float64)
+        self.cross = np.zeros(shape, dtype=np.float64)
+
+    def grow(self, shape):
+        self.total = _grow(self.total, shape)
+        self.squares = _grow(self.squares, shape)
+        self.cross = _grow(self.cross, shape)
+
+    def add(self, index, counts, sampled):
+        weights = counts.astype(np.float64)
+        self.total[index] += counts
+        self.squares[index] += weights * weights
+        self.cross[index] += weights * sampled
+
+
+def compute_quicklook(layers, nodata_list, mask_layer=None, factor=DEFAULT_QUICKLOOK_FACTOR, block_size=128, progress=None):
+    base = layers[0]
+    width, height = decimated_size(base, factor)
+    scale = float(base.width() * base.height()) / float(width * height)
+    fpc = max(0.0, 1.0 - 1.0 / scale)
+    years = len(layers)
+
+    hist = _BlockSums((years, 1))
+    matrices = [_BlockSums((1, 1)) for _ in range(years - 1)]
+    changed = _BlockSums(years - 1)
+    total = _BlockSums(years - 1)
+    blocks = 0
+    sampled_sum = 0.0
+    sampled_squares = 0.0
+
+    for col, row, array0 in iter_blocks(base, block_cols=block_size, block_rows=block_size, on_block=progress, factor=factor):
+        rows, cols = array0.shape
+        sampled = rows * cols
+        blocks += 1
+        sampled_sum += sampled
+        sampled_squares += float(sampled) * sampled
+        mask = None
+        if mask_layer is not None:
+            mask = read_block(mask_layer, col, row, cols, rows, factor=factor) == 1
+        arrays = [array0] + [read_block(layer, col, row, cols, rows, factor=factor) for layer in layers[1:]]
+        valids = []
+        for idx, array in enumerate(arrays):
+            valid = _valid_mask(array, nodata_list[idx])
+            if mask is not None:
+                valid &= mask
+            valids.append(valid)
+            if not valid.any():
+                continue
+            counts = np.bincount(array[valid].astype(np.int64))
+            hist.grow((years, counts.shape[0]))
+            hist.add((idx, slice(0, counts.shape[0])), counts, sampled)
+
+        for idx in range(years - 1):
+            valid = valids[idx] & valids[idx + 1]
+            n_valid = int(valid.sum())
+            total.add(idx, np.int64(n_valid), sampled)
+            if not n_valid:
+                continue
+            t0 = arrays[idx][valid].astype(np.int64)
+            t1 = arrays[idx + 1][valid].astype(np.int64)
+            changed.add(idx, np.int64((t0 != t1).sum()), sampled)
+            size = int(max(t0.max(), t1.max())) + 1
+            matrices[idx].grow((size, size))
+            n = matrices[idx].total.shape[0]
+            counts = np.bincount(t0 * n + t1, minlength=n * n).reshape((n, n))
+            matrices[idx].add(slice(None), counts, sampled)
+
+    def estimate(sums, index=slice(None)):
+        variance = _ratio_variance(sums.total[index], sums.squares[index], sums.cross[index], sampled_sum, sampled_squares, blocks)
+        return sums.total[index] * scale, scale * np.sqrt(fpc * variance)
+
+    area, area_se = estimate(hist)
+    intervals = []
+    for idx in range(years - 1):
+        matrix, matrix_se = estimate(matrices[idx])
+        changed_est, changed_se = estimate(changed, idx)
+        total_est, total_se = estimate(total, idx)
+        intervals.append({
+            'matrix': matrix,
+            'matrix_se': matrix_se,
+            'changed_pixels': float(changed_est),
+            'changed_pixels_se': float(changed_se),
+            'total_pixels': float(total_est),
+            'total_pixels_se': float(total_se),
+        })
+    return {
+        'factor': factor,
+        'scale': scale,
+        'area': area,
+        'area_se': area_se,
+        'intervals': intervals,
+    }
@@ -1,57 +1,72 @@
 # -*- coding: utf-8 -*-
+import threading
+
 import numpy as np
+from osgeo import gdal
 from qgis.core import QgsRectangle, Qgis
 
+_GDAL_DTYPES = {
+    gdal.GDT_Byte: np.uint8,
+    gdal.GDT_UInt16: np.uint16,
+    gdal.GDT_Int16: np.int16,
+    gdal.GDT_UInt32: np.uint32,
+    gdal.GDT_Int32: np.int32,
+    gdal.GDT_Float32: np.float32,
+    gdal.GDT_Float64: np.float64,
+}
+
 
-def get_nodata_value(layer):
+def get_nodata_value(layer, band=1):
     provider = layer.dataProvider()
     try:
-        if provider.sourceHasNoDataValue(1):
-            return provider.sourceNoDataValue(1)
+        if provider.sourceHasNoDataValue(band):
+            return provider.sourceNoDataValue(band)
     except Exception:
         pass
     return None
 
 
-def iter_blocks(layer, block_cols=256, block_rows=256, on_block=None):
-    provider = layer.dataProvider()
-    extent = layer.extent()
-    width = layer.width()
-    height = layer.height()
-    px_x = layer.rasterUnitsPerPixelX()
-    px_y = abs(layer.rasterUnitsPerPixelY())
-    x_min = extent.xMinimum()
-    y_max = extent.yMaximum()
+def decimated_size(layer, factor):
+    return max(1, layer.width() // factor), max(1, layer.height() // factor)
+
 
+def iter_blocks(layer, block_cols=256, block_rows=256, on_block=None, start_block=0, factor=1):
+    width, height = decimated_size(layer, factor)
+    block_index = -1
     for row in range(0, height, block_rows):
         for col in range(0, width, block_cols):
+            block_index += 1
+            if block_index < start_block:
+                if on_block:
+                    on_block()
+                continue
             cols = min(block_cols, width - col)
             rows = min(block_rows, height - row)
-            x0 = x_min + col * px_x
-            x1 = x_min + (col + cols) * px_x
-            y1 = y_max - row * px_y
-            y0 = y_max - (row + rows) * px_y
-            rect = QgsRectangle(x0, y0, x1, y1)
-            block = provider.block(1, rect, cols, rows)
-            array = _block_to_array(block)
+            array = read_block(layer, col, row, cols, rows, factor=factor)
             if on_block:
                 on_block()
             yield col, row, array
 
 
-def read_block(layer, col, row, cols, rows):
-    provider = layer.dataProvider()
+def read_block(layer, col, row, cols, rows, factor=1):
+    read_window = getattr(layer, 'read_window', None)
+    if read_window is not None:
+        return read_window(col, row, cols, rows, factor=factor)
     extent = layer.extent()
-    px_x = layer.rasterUnitsPerPixelX()
-    px_y = abs(layer.rasterUnitsPerPixelY())
-    x_min = extent.xMinimum()
-    y_max = extent.yMaximum()
+    return _provider_block(
+        layer.dataProvider(), extent.xMinimum(), extent.yMaximum(),
+        layer.rasterUnitsPerPixelX() * factor, abs(layer.rasterUnitsPerPixelY()) * factor,
+        col, row, cols, rows,
+    )
+
+
+def _provider_block(provider, x_min, y_max, px_x, px_y, col, row, cols, rows, band=1):
     x0 = x_min + col * px_x
     x1 = x_min + (col + cols) * px_x
     y1 = y_max - row * px_y
     y0 = y_max - (row + rows) * px_y
     rect = QgsRectangle(x0, y0, x1, y1)
-    block = provider.block(1, rect, cols, rows)
+    block = provider.block(band, rect, cols, rows)
     return _block_to_array(block)
 
 
@@ -93,3 +108,164 @@ def _qgis_dtype_to_numpy(qgis_type):
     if qgis_type == Qgis.Float64:
         return np.float64
     return np.float32
+
+
+def _read_array(source, col, row, cols, rows, factor, width, height):
+    if factor == 1:
+        return source.ReadAsArray(col, row, cols, rows)
+    x_size = min(cols * factor, width - col * factor)
+    y_size = min(rows * factor, height - row * factor)
+    return source.ReadAsArray(
+        col * factor, row * factor, x_size, y_size,
+        buf_xsize=cols, buf_ysize=rows, resample_alg=gdal.GRIORA_NearestNeighbour,
+    )
+
+
+class _GdalSource:
+    def __init__(self, path, width, height, stacked=False):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.stacked = stacked
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._datasets = []
+
+    def dataset(self):
+        dataset = getattr(self._local, 'dataset', None)
+        if dataset is None and not getattr(self._local, 'failed', False):
+            try:
+                dataset = gdal.Open(self.path, gdal.GA_ReadOnly)
+            except RuntimeError:
+                dataset = None
+            if dataset is None or dataset.RasterXSize != self.width or dataset.RasterYSize != self.height:
+                dataset = None
+                self._local.failed = True
+            else:
+                self._local.dataset = dataset
+                with self._lock:
+                    self._datasets.append(dataset)
+        return dataset
+
+    def read(self, band, col, row, cols, rows, factor=1):
+        dataset = self.dataset()
+        if not self.stacked:
+            return _read_array(dataset.GetRasterBand(band), col, row, cols, rows, factor, self.width, self.height)
+        window = (col, row, cols, rows, factor)
+        if getattr(self._local, 'window', None) != window:
+            self._local.block = _read_array(dataset, col, row, cols, rows, factor, self.width, self.height)
+            self._local.window = window
+        return self._local.block[band - 1]
+
+    def close(self):
+        with self._lock:
+            self._datasets = []
+        self._local = threading.local()
+
+
+class RasterHandle:
+    def __init__(self, layer, band=1, reader=None):
+        self.layer = layer
+        self.band = band
+        extent = layer.extent()
+        self._extent = extent
+        self._x_min = extent.xMinimum()
+        self._y_max = extent.yMaximum()
+        self._width = layer.width()
+        self._height = layer.height()
+        self._px_x = layer.rasterUnitsPerPixelX()
+        self._px_y = layer.rasterUnitsPerPixelY()
+        self._crs = layer.crs()
+        self._lock = threading.Lock()
+        self.reader = reader or _GdalSource(layer.source().split('|')[0], self._width, self._height)
+        dataset = self.reader.dataset()
+        if dataset is None:
+            self.dtype = _qgis_dtype_to_numpy(layer.dataProvider().dataType(band))
+            self.nodata = get_nodata_value(layer, band)
+        else:
+            gdal_band = dataset.GetRasterBand(band)
+            self.dtype = _GDAL_DTYPES.get(gdal_band.DataType, np.float32)
+            self.nodata = gdal_band.GetNoDataValue()
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    def crs(self):
+        return self._crs
+
+    def extent(self):
+        return self._extent
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def rasterUnitsPerPixelX(self):
+        return self._px_x
+
+    def rasterUnitsPerPixelY(self):
+        return self._px_y
+
+    def gdal_dataset(self):
+        return self.reader.dataset()
+
+    def read_window(self, col, row, cols, rows, factor=1):
+        if self.reader.dataset() is None:
+            with self._lock:
+                return _provider_block(
+                    self.layer.dataProvider(), self._x_min, self._y_max,
+                    self._px_x * factor, abs(self._px_y) * factor,
+                    col, row, cols, rows, band=self.band,
+                )
+        return self.reader.read(self.band, col, row, cols, rows, factor)
+
+    def close(self):
+        self.reader.close()
+
+
+class RasterStack:
+    def __init__(self, layers, bands=None):
+        bands = bands or [1] * len(layers)
+        stacked = {}
+        for layer, band in zip(layers, bands):
+            if not hasattr(layer, 'read_window'):
+                stacked.setdefault(id(layer), set()).add(band)
+        readers = {}
+        self.layers = []
+        for layer, band in zip(layers, bands):
+            if hasattr(layer, 'read_window'):
+                self.layers.append(layer)
+                continue
+            reader = readers.get(id(layer))
+            if reader is None and len(stacked[id(layer)]) > 1:
+                reader = _GdalSource(layer.source().split('|')[0], layer.width(), layer.height(), stacked=True)
+                readers[id(layer)] = reader
+            self.layers.append(RasterHandle(layer, band, reader=reader))
+        self._extra = []
+        self._wrappers = []
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def handle(self, layer):
+        if layer is None or hasattr(layer, 'read_window'):
+            return layer
+        handle = RasterHandle(layer)
+        self._extra.append(handle)
+        return handle
+
+    def adopt(self, layers):
+        self._wrappers.extend(layers)
+        return layers
+
+    def close(self):
+        for layer in self._wrappers + self.layers + self._extra:
+            layer.close()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+from osgeo import gdal
+
+from .cache import layer_fingerprint
+from .raster_reader import iter_blocks
+
+MODE_EXACT = 'exact'
+MODE_SAMPLED = 'sampled'
+MAX_HISTOGRAM_BUCKETS = 65536
+
+_INTEGER_TYPES = (gdal.GDT_Byte, gdal.GDT_UInt16, gdal.GDT_Int16, gdal.GDT_UInt32, gdal.GDT_Int32)
+_STATS_CACHE = {}
+
+
+def _cache_key(layer, nodata, mode):
+    return (layer_fingerprint(layer, nodata), mode)
+
+
+def has_cached_statistics(layer, nodata, mode=MODE_EXACT):
+    return _cache_key(layer, nodata, mode) in _STATS_CACHE
+
+
+def clear_statistics_cache():
+    _STATS_CACHE.clear()
+
+
+def layer_statistics(layer, nodata, mode=MODE_EXACT, max_unique=1024, progress=None):
+    key = _cache_key(layer, nodata, mode)
+    if key in _STATS_CACHE:
+        return _STATS_CACHE[key]
+    stats = None
+    if layer.providerType() == 'gdal':
+        stats = _gdal_statistics(layer, nodata, mode)
+    if stats is None:
+        stats = _scan_statistics(layer, nodata, max_unique=max_unique, progress=progress)
+    elif progress is not None:
+        for _ in range(_block_count(layer)):
+            progress()
+    _STATS_CACHE[key] = stats
+    return stats
+
+
+def _block_count(layer, block_size=256):
+    cols = int(math.ceil(layer.width() / float(block_size)))
+    rows = int(math.ceil(layer.height() / float(block_size)))
+    return cols * rows
+
+
+def _gdal_statistics(layer, nodata, mode):
+    gdal_dataset = getattr(layer, 'gdal_dataset', None)
+    try:
+        dataset = gdal_dataset() if gdal_dataset is not None else gdal.Open(layer.source(), gdal.GA_ReadOnly)
+    except RuntimeError:
+        return None
+    if dataset is None:
+        return None
+    band = dataset.GetRasterBand(getattr(layer, 'band', 1))
+    if band.DataType not in _INTEGER_TYPES:
+        return None
+    source_nodata = band.GetNoDataValue()
+    if source_nodata is not None and nodata != source_nodata:
+        return None
+
+    approx = mode == MODE_SAMPLED
+    method = 'stored histogram'
+    histogram = _stored_histogram(band) if approx else None
+    if histogram is None:
+        method = 'GDAL histogram (overviews)' if approx else 'GDAL histogram'
+        histogram = _computed_histogram(band, approx)
+    if histogram is None:
+        return None
+    low, counts = histogram
+    if nodata is not None and source_nodata is None:
+        index = int(nodata) - low
+        if float(nodata).is_integer() and 0 <= index < counts.shape[0]:
+            counts[index] = 0
+    return _statistics_from_histogram(low, counts, method, exact=not approx)
+
+
+def _stored_histogram(band):
+    try:
+        result = band.GetDefaultHistogram(force=0)
+    except RuntimeError:
+        return None
+    if not result:
+        return None
+    hist_min, hist_max, buckets, values = result
+    if not buckets or abs((hist_max - hist_min) / float(buckets) - 1.0) > 1e-9:
+        return None
+    low = hist_min + 0.5
+    if not float(low).is_integer():
+        return None
+    return int(low), np.asarray(values, dtype=np.int64)
+
+
+def _computed_histogram(band, approx):
+    try:
+        min_max = band.ComputeRasterMinMax(approx)
+    except RuntimeError:
+        return None
+    if min_max is None:
+        return None
+    low = int(math.floor(min_max[0]))
+    high = int(math.ceil(min_max[1]))
+    buckets = high - low + 1
+    if buckets <= 0 or buckets > MAX_HISTOGRAM_BUCKETS:
+        return None
+    try:
+        values = band.GetHistogram(low - 0.5, high + 0.5, buckets=buckets, include_out_of_range=0, approx_ok=int(approx))
+    except RuntimeError:
+        return None
+    if values is None:
+        return None
+    return low, np.asarray(values, dtype=np.int64)
+
+
+def _statistics_from_histogram(low, counts, method, exact):
+    present = np.nonzero(counts)[0]
+    if present.shape[0] == 0:
+        return {'min': None, 'max': None, 'unique_count': 0, 'capped': False, 'histogram': None, 'method': method}
+    min_val = float(low + present[0])
+    max_val = float(low + present[-1])
+    histogram = None
+    if exact and low + present[0] >= 0:
+        histogram = np.zeros(low + present[-1] + 1, dtype=np.int64)
+        histogram[low:low + counts.shape[0]] = counts[:histogram.shape[0] - low]
+    return {
+        'min': min_val,
+        'max': max_val,
+        'unique_count': int(present.shape[0]),
+        'capped': False,
+        'histogram': histogram,
+        'method': method,
+    }
+
+
+def _scan_statistics(layer, nodata, max_unique=1024, progress=None):
+    min_val = None
+    max_val = None
+    unique_vals = set()
+    capped = False
+    for _, _, array in iter_blocks(layer, on_block=progress):
+        if nodata is None:
+            valid = np.ones(array.shape, dtype=bool)
+        else:
+            valid = array != nodata
+        if not valid.any():
+            continue
+        values = array[valid]
+        local_min = float(np.min(values))
+        local_max = float(np.max(values))
+        min_val = local_min if min_val is None else min(min_val, local_min)
+        max_val = local_max if max_val is None else max(max_val, local_max)
+        if not capped:
+            uniques = np.unique(values)
+            for val in uniques:
+                unique_vals.add(int(val))
+                if len(unique_vals) >= max_unique:
+                    capped = True
+                    break
+    return {
+        'min': min_val,
+        'max': max_val,
+        'unique_count': len(unique_vals),
+        'capped': capped,
+        'histogram': None,
+        'method': 'block scan',
+    }
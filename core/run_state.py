@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import numpy as np
+
+from .change_metrics import area_counts_from_array, area_counts_to_array, resize_interval_result
+
+STATE_VERSION = 2
+
+
+class RunState:
+    def __init__(self, output_dir):
+        self.state_dir = os.path.join(output_dir, 'run_state')
+        self.meta = None
+        self.arrays = {}
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.state_dir, 'state.json')
+
+    @property
+    def arrays_path(self):
+        return os.path.join(self.state_dir, 'state.npz')
+
+    @property
+    def change_frequency_path(self):
+        return os.path.join(self.state_dir, 'change_frequency.tif')
+
+    def load(self):
+        if not os.path.isfile(self.meta_path) or not os.path.isfile(self.arrays_path):
+            return False
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as handle:
+                meta = json.load(handle)
+            with np.load(self.arrays_path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return False
+        if meta.get('version') != STATE_VERSION:
+            return False
+        self.meta = meta
+        self.arrays = arrays
+        return True
+
+    def reusable_years(self, fingerprints, mask_key, weighted=False):
+        if self.meta is None:
+            return 0
+        if self.meta.get('mask_key') != json.dumps(mask_key) or self.meta.get('weighted', False) != weighted:
+            return 0
+        stored = self.meta.get('fingerprints', [])
+        if len(stored) > len(fingerprints) or list(fingerprints[:len(stored)]) != stored:
+            return 0
+        return len(stored)
+
+    def has_change_frequency(self):
+        return bool(self.meta and self.meta.get('change_frequency')) and os.path.isfile(self.change_frequency_path)
+
+    def area_counts(self, idx):
+        return area_counts_from_array(self.arrays['hist_{}'.format(idx)])
+
+    def code_classes(self):
+        return self.meta.get('code_classes') if self.meta else None
+
+    def year_areas(self, idx):
+        return self.arrays.get('hist_area_{}'.format(idx))
+
+    def interval_result(self, idx, max_class):
+        prefix = 'interval_{}_'.format(idx)
+        result = {
+            'gain': self.arrays[prefix + 'gain'],
+            'loss': self.arrays[prefix + 'loss'],
+            'matrix': self.arrays[prefix + 'matrix'],
+            'changed_pixels': self.arrays[prefix + 'changed_pixels'],
+            'total_pixels': self.arrays[prefix + 'total_pixels'],
+        }
+        if prefix + 'area_matrix' in self.arrays:
+            result['area_matrix'] = self.arrays[prefix + 'area_matrix']
+        return resize_interval_result(result, max_class)
+
+    def save(self, years, fingerprints, mask_key, area_counts_list, interval_results, change_frequency=False, year_areas=None, code_classes=None):
+        os.makedirs(self.state_dir, exist_ok=True)
+        arrays = {}
+        for idx, area_counts in enumerate(area_counts_list):
+            arrays['hist_{}'.format(idx)] = area_counts_to_array(area_counts)
+            if year_areas is not None:
+                arrays['hist_area_{}'.format(idx)] = year_areas[idx]
+        for idx, result in enumerate(interval_results):
+            prefix = 'interval_{}_'.format(idx)
+            arrays[prefix + 'gain'] = result['gain']
+            arrays[prefix + 'loss'] = result['loss']
+            arrays[prefix + 'matrix'] = result['matrix']
+            arrays[prefix + 'changed_pixels'] = np.int64(result['changed_pixels'])
+            arrays[prefix + 'total_pixels'] = np.int64(result['total_pixels'])
+            if 'area_matrix' in result:
+                arrays[prefix + 'area_matrix'] = result['area_matrix']
+        meta = {
+            'version': STATE_VERSION,
+            'years': list(years),
+            'fingerprints': list(fingerprints),
+            'mask_key': json.dumps(mask_key),
+            'change_frequency': bool(change_frequency),
+            'weighted': year_areas is not None,
+            'code_classes': code_classes,
+        }
+        temp_arrays = self.arrays_path + '.tmp.npz'
+        np.savez_compressed(temp_arrays, **arrays)
+        os.replace(temp_arrays, self.arrays_path)
+        temp_meta = self.meta_path + '.tmp'
+        with open(temp_meta, 'w', encoding='utf-8') as handle:
+            json.dump(meta, handle, indent=2)
+        os.replace(temp_meta, self.meta_path)
+        self.meta = meta
+        self.arrays = arrays
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .fragmentation import label_patches
+from .raster_reader import read_block
+
+DEFAULT_SIEVE_PIXELS = 4
+MAX_SIEVE_HALO = 256
+MAX_SIEVE_PIXELS = MAX_SIEVE_HALO + 1
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def _neighbour_pairs(labels, array, valid, small):
+    sources = []
+    targets = []
+    for here, there in (
+        ((slice(None), slice(1, None)), (slice(None), slice(None, -1))),
+        ((slice(None), slice(None, -1)), (slice(None), slice(1, None))),
+        ((slice(1, None), slice(None)), (slice(None, -1), slice(None))),
+        ((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+    ):
+        label_here = labels[here]
+        linked = small[here] & valid[there] & (labels[there] != label_here)
+        sources.append(label_here[linked])
+        targets.append(array[there][linked])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def sieve_window(array, valid, min_pixels, connectivity=4, open_sides=(False, False, False, False)):
+    labels, count = label_patches(array, valid, connectivity)
+    if count == 0:
+        return array
+    sizes = np.bincount(labels[valid], minlength=count)
+    small_ids = sizes < min_pixels
+    top, bottom, left, right = open_sides
+    edges = [labels[0, :] if top else None, labels[-1, :] if bottom else None,
+             labels[:, 0] if left else None, labels[:, -1] if right else None]
+    for edge in edges:
+        if edge is not None:
+            small_ids[edge[edge >= 0]] = False
+    if not small_ids.any():
+        return array
+    small = np.zeros(array.shape, dtype=bool)
+    small[valid] = small_ids[labels[valid]]
+    patch, neighbour = _neighbour_pairs(labels, array, valid, small)
+    if patch.shape[0] == 0:
+        return array
+    pairs, counts = np.unique(np.stack([patch, neighbour.astype(np.int64)]), axis=1, return_counts=True)
+    order = np.lexsort((pairs[1], -counts, pairs[0]))
+    first = np.ones(order.shape[0], dtype=bool)
+    first[1:] = pairs[0][order[1:]] != pairs[0][order[:-1]]
+    best = order[first]
+    replacement = np.zeros(count, dtype=np.int64)
+    replaced = np.zeros(count, dtype=bool)
+    replacement[pairs[0][best]] = pairs[1][best]
+    replaced[pairs[0][best]] = True
+    update = small & replaced[np.where(labels >= 0, labels, 0)]
+    result = array.copy()
+    result[update] = replacement[labels[update]].astype(array.dtype)
+    return result
+
+
+class SievedLayer:
+    def __init__(self, layer, nodata, min_pixels=DEFAULT_SIEVE_PIXELS, connectivity=4):
+        self.layer = layer
+        self.nodata = nodata
+        if int(min_pixels) > MAX_SIEVE_PIXELS:
+            raise ValueError('Sieve size must be at most {} px.'.format(MAX_SIEVE_PIXELS))
+        self.min_pixels = int(min_pixels)
+        self.connectivity = connectivity
+        self.halo = max(0, self.min_pixels - 1)
+        self.grid_key = '|'.join([
+            getattr(layer, 'grid_key', ''),
+            'sieve',
+            str(self.min_pixels),
+            str(connectivity),
+        ])
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    def providerType(self):
+        return 'sieve'
+
+    def close(self):
+        self.layer.close()
+
+    def read_window(self, col, row, cols, rows, factor=1):
+        if factor != 1 or self.min_pixels <= 1:
+            return read_block(self.layer, col, row, cols, rows, factor=factor)
+        width = self.layer.width()
+        height = self.layer.height()
+        col0 = max(0, col - self.halo)
+        row0 = max(0, row - self.halo)
+        col1 = min(width, col + cols + self.halo)
+        row1 = min(height, row + rows + self.halo)
+        window = read_block(self.layer, col0, row0, col1 - col0, row1 - row0)
+        sieved = sieve_window(
+            window,
+            _valid_mask(window, self.nodata),
+            self.min_pixels,
+            self.connectivity,
+            open_sides=(row0 > 0, row1 < height, col0 > 0, col1 < width),
+        )
+        return sieved[row - row0:row - row0 + rows, col - col0:col - col0 + cols]
+
+
+def sieve_layers(layers, nodata_list, min_pixels, connectivity=4):
+    return [SievedLayer(layer, nodata, min_pixels, connectivity) for layer, nodata in zip(layers, nodata_list)]
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class Table:
+    def __init__(self, headers, columns):
+        self.headers = list(headers)
+        self.columns = [np.asarray(column) for column in columns]
+
+    def __len__(self):
+        return self.columns[0].shape[0] if self.columns else 0
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.headers.index(key)
+        return self.columns[key]
+
+
+def label_column(class_ids, legend_map):
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    if class_ids.shape[0] == 0:
+        return np.zeros(0, dtype=object)
+    unique, inverse = np.unique(class_ids, return_inverse=True)
+    labels = np.array([legend_map.get(class_id, '') for class_id in unique.tolist()], dtype=object)
+    return labels[inverse]
+
+
+def _percent(values, total):
+    total = np.asarray(total, dtype=np.float64)
+    safe = np.where(total > 0, total, 1.0)
+    return np.where(total > 0, values / safe * 100.0, 0.0)
+
+
+def _scale(counts, area_factor, index=None):
+    if np.ndim(area_factor):
+        area_factor = np.asarray(area_factor, dtype=np.float64)
+        return counts * (area_factor if index is None else area_factor[index])
+    return counts * float(area_factor)
+
+
+def area_by_class_table(years, area_counts_list, area_factors, legend_map, unit_label):
+    year_parts = []
+    class_parts = []
+    count_parts = []
+    area_parts = []
+    total_parts = []
+    for year, area_counts, area_factor in zip(years, area_counts_list, area_factors):
+        class_ids = np.array(sorted(area_counts), dtype=np.int64)
+        counts = np.array([area_counts[class_id] for class_id in class_ids.tolist()], dtype=np.int64)
+        year_parts.append(np.full(class_ids.shape[0], year, dtype=np.int64))
+        class_parts.append(class_ids)
+        count_parts.append(counts)
+        area_parts.append(_scale(counts, area_factor, class_ids))
+        total_parts.append(np.full(class_ids.shape[0], counts.sum(), dtype=np.int64))
+    if not year_parts:
+        year_parts = class_parts = count_parts = total_parts = [np.zeros(0, dtype=np.int64)]
+        area_parts = [np.zeros(0, dtype=np.float64)]
+    class_ids = np.concatenate(class_parts)
+    counts = np.concatenate(count_parts)
+    return Table(
+        ['year', 'class_id', 'class_label', 'pixel_count', 'area_{}'.format(unit_label), 'percent_share'],
+        [
+            np.concatenate(year_parts),
+            class_ids,
+            label_column(class_ids, legend_map),
+            counts,
+            np.concatenate(area_parts),
+            _percent(counts, np.concatenate(total_parts)),
+        ],
+    )
+
+
+def net_gross_table(matrix, max_class, area_factor, legend_map, unit_label):
+    class_ids = np.arange(max_class + 1, dtype=np.int64)
+    matrix = np.asarray(matrix[:max_class + 1, :max_class + 1], dtype=np.int64)
+    persistence = np.diagonal(matrix)
+    gain = matrix.sum(axis=0) - persistence
+    loss = matrix.sum(axis=1) - persistence
+    net = gain - loss
+    gross = gain + loss
+    if np.ndim(area_factor):
+        area = _scale(matrix, np.asarray(area_factor)[:max_class + 1, :max_class + 1])
+        gain_area = area.sum(axis=0) - np.diagonal(area)
+        loss_area = area.sum(axis=1) - np.diagonal(area)
+        net_area = gain_area - loss_area
+        gross_area = gain_area + loss_area
+    else:
+        net_area = net * area_factor
+        gross_area = gross * area_factor
+    return Table(
+        ['class_id', 'class_label', 'gain_pixels', 'loss_pixels', 'net_pixels', 'gross_pixels',
+         'area_{}_net'.format(unit_label), 'area_{}_gross'.format(unit_label)],
+        [class_ids, label_column(class_ids, legend_map), gain, loss, net, gross, net_area, gross_area],
+    )
+
+
+def transition_values(matrix, classes, unit_label, area_factor):
+    values = matrix[np.ix_(classes, classes)]
+    if unit_label != 'pixels':
+        values = _scale(values.astype(np.float64), area_factor, np.ix_(classes, classes))
+    return values
+
+
+def transition_matrix_table(values, classes, legend_map):
+    classes = np.asarray(classes, dtype=np.int64)
+    labels = label_column(classes, legend_map)
+    headers = ['from_class', 'from_label'] + [
+        '{} {}'.format(class_id, label).strip() for class_id, label in zip(classes.tolist(), labels.tolist())
+    ]
+    return Table(headers, [classes, labels] + [values[:, idx] for idx in range(values.shape[1])])
+
+
+def top_transitions_table(matrix, area_factor, legend_map, unit_label):
+    matrix = matrix.copy()
+    np.fill_diagonal(matrix, 0)
+    from_ids, to_ids = np.nonzero(matrix)
+    counts = matrix[from_ids, to_ids].astype(np.int64)
+    areas = _scale(counts, area_factor, (from_ids, to_ids))
+    order = np.argsort(-areas, kind='stable')
+    from_ids = from_ids[order].astype(np.int64)
+    to_ids = to_ids[order].astype(np.int64)
+    counts = counts[order]
+    areas = areas[order]
+    return Table(
+        ['from_class', 'from_label', 'to_class', 'to_label', 'pixel_count', 'area_{}'.format(unit_label), 'percent_of_total_change'],
+        [
+            from_ids,
+            label_column(from_ids, legend_map),
+            to_ids,
+            label_column(to_ids, legend_map),
+            counts,
+            areas,
+            _percent(areas, areas.sum()),
+        ],
+    )
+
+
+def zonal_area_table(zone_ids, years, area, area_factors, legend_map, unit_label):
+    by_zone = area.transpose(1, 0, 2)
+    zone_idx, year_idx, class_ids = np.nonzero(by_zone)
+    counts = by_zone[zone_idx, year_idx, class_ids]
+    area_factors = np.asarray(area_factors, dtype=np.float64)
+    if area_factors.ndim == 1:
+        areas = counts * area_factors[year_idx]
+    else:
+        areas = _scale(counts, area_factors, (year_idx, zone_idx, class_ids))
+    return Table(
+        ['zone_id', 'year', 'class_id', 'class_label', 'pixel_count', 'area_{}'.format(unit_label), 'percent_share'],
+        [
+            zone_ids[zone_idx],
+            np.asarray(years, dtype=np.int64)[year_idx],
+            class_ids,
+            label_column(class_ids, legend_map),
+            counts,
+            areas,
+            _percent(counts, by_zone.sum(axis=2)[zone_idx, year_idx]),
+        ],
+    )
+
+
+def zonal_transition_table(zone_ids, transitions, area_factor, legend_map, unit_label, exclude_class=None):
+    zone_idx = transitions['zone']
+    from_ids = transitions['from']
+    to_ids = transitions['to']
+    counts = transitions['count']
+    keep = counts > 0
+    if exclude_class is not None:
+        keep &= (from_ids != exclude_class) & (to_ids != exclude_class)
+    return Table(
+        ['zone_id', 'from_class', 'from_label', 'to_class', 'to_label', 'pixel_count', 'area_{}'.format(unit_label)],
+        [
+            zone_ids[zone_idx[keep]],
+            from_ids[keep],
+            label_column(from_ids[keep], legend_map),
+            to_ids[keep],
+            label_column(to_ids[keep], legend_map),
+            counts[keep],
+            _scale(counts, area_factor)[keep],
+        ],
+    )
+
+
+def zonal_net_gross_table(zone_ids, transitions, area_factor, legend_map, unit_label):
+    zone_idx = transitions['zone']
+    from_ids = transitions['from']
+    to_ids = transitions['to']
+    counts = transitions['count']
+    areas = _scale(counts.astype(np.float64), area_factor)
+    size = int(max(from_ids.max(), to_ids.max())) + 1 if counts.shape[0] else 1
+    entries = counts.shape[0]
+    unique, inverse = np.unique(np.concatenate([zone_idx * size + to_ids, zone_idx * size + from_ids]), return_inverse=True)
+    changed = np.flatnonzero(from_ids != to_ids)
+    gain = np.zeros(unique.shape[0], dtype=np.int64)
+    loss = np.zeros(unique.shape[0], dtype=np.int64)
+    np.add.at(gain, inverse[changed], counts[changed])
+    np.add.at(loss, inverse[entries + changed], counts[changed])
+    gain_area = np.bincount(inverse[changed], weights=areas[changed], minlength=unique.shape[0])
+    loss_area = np.bincount(inverse[entries + changed], weights=areas[changed], minlength=unique.shape[0])
+    zone_idx, class_ids = np.divmod(unique, size)
+    return Table(
+        ['zone_id', 'class_id', 'class_label', 'gain_pixels', 'loss_pixels', 'net_pixels', 'gross_pixels',
+         'area_{}_net'.format(unit_label), 'area_{}_gross'.format(unit_label)],
+        [zone_ids[zone_idx], class_ids, label_column(class_ids, legend_map), gain, loss, gain - loss, gain + loss,
+         gain_area - loss_area, gain_area + loss_area],
+    )
+
+
+def fragmentation_table(years, results, area_factors, legend_map, unit_label, edge_lengths, pixel_area, area_scale=None):
+    edge_x, edge_y = edge_lengths
+    year_parts = []
+    class_parts = []
+    count_parts = []
+    mean_parts = []
+    max_parts = []
+    edge_parts = []
+    density_parts = []
+    for year, result, area_factor in zip(years, results, area_factors):
+        class_ids = np.nonzero(result['patch_count'])[0]
+        patch_count = result['patch_count'][class_ids]
+        if 'edge_length' in result:
+            edge_m = result['edge_length'][class_ids]
+        else:
+            edge_m = result['edges_h'][class_ids] * edge_y + result['edges_v'][class_ids] * edge_x
+        landscape_m2 = result['valid_area'] if 'valid_area' in result else float(result['valid_pixels']) * pixel_area
+        year_parts.append(np.full(class_ids.shape[0], year, dtype=np.int64))
+        class_parts.append(class_ids)
+        count_parts.append(patch_count)
+        if area_scale is not None and 'weighted_area_sum' in result:
+            mean_parts.append(result['weighted_area_sum'][class_ids] * area_scale / patch_count)
+            max_parts.append(result['weighted_area_max'][class_ids] * area_scale)
+        else:
+            mean_parts.append(_scale(result['area_sum'][class_ids], area_factor, class_ids) / patch_count)
+            max_parts.append(_scale(result['area_max'][class_ids], area_factor, class_ids))
+        edge_parts.append(edge_m)
+        density_parts.append(edge_m / landscape_m2 * 10000.0 if landscape_m2 > 0 else np.zeros(class_ids.shape[0]))
+    if not year_parts:
+        year_parts = class_parts = count_parts = [np.zeros(0, dtype=np.int64)]
+        mean_parts = max_parts = edge_parts = density_parts = [np.zeros(0, dtype=np.float64)]
+    class_ids = np.concatenate(class_parts).astype(np.int64)
+    return Table(
+        [
+            'year', 'class_id', 'class_label', 'patch_count',
+            'mean_patch_area_{}'.format(unit_label), 'largest_patch_area_{}'.format(unit_label),
+            'edge_length_m', 'edge_density_m_per_ha',
+        ],
+        [
+            np.concatenate(year_parts),
+            class_ids,
+            label_column(class_ids, legend_map),
+            np.concatenate(count_parts),
+            np.concatenate(mean_parts),
+            np.concatenate(max_parts),
+            np.concatenate(edge_parts),
+            np.concatenate(density_parts),
+        ],
+    )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+
+import numpy as np
+
+from .cache import digest_parts, layer_fingerprint
+from .raster_reader import read_block
+
+DEFAULT_TEMPORAL_WINDOW = 3
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def parse_forbidden_transitions(text):
+    rules = []
+    for part in re.split(r'[,;\s]+', text.strip()):
+        if not part:
+            continue
+        match = re.match(r'^(-?\d+)\s*(?:>|->)\s*(-?\d+)$', part)
+        if match is None:
+            raise ValueError('Invalid forbidden transition "{}" (expected from>to, e.g. 5>1).'.format(part))
+        rules.append((int(match.group(1)), int(match.group(2))))
+    return rules
+
+
+def mode_filter(stack, valid, window=DEFAULT_TEMPORAL_WINDOW):
+    years = stack.shape[0]
+    half = window // 2
+    result = stack.copy()
+    if half == 0:
+        return result
+    for idx in range(years):
+        lo = max(0, idx - half)
+        hi = min(years, idx + half + 1)
+        values = stack[lo:hi]
+        votes = valid[lo:hi]
+        counts = ((values[:, None] == values[None, :]) & votes[None, :]).sum(axis=1)
+        counts[~votes] = -1
+        best = np.argmax(counts, axis=0)
+        best_count = np.take_along_axis(counts, best[None], axis=0)[0]
+        update = valid[idx] & (best_count > counts[idx - lo])
+        winner = np.take_along_axis(values, best[None], axis=0)[0]
+        result[idx][update] = winner[update]
+    return result
+
+
+def apply_forbidden(stack, valid, rules):
+    if not rules:
+        return stack
+    for idx in range(1, stack.shape[0]):
+        prev = stack[idx - 1]
+        curr = stack[idx]
+        both = valid[idx - 1] & valid[idx]
+        for from_class, to_class in rules:
+            blocked = both & (prev == from_class) & (curr == to_class)
+            curr[blocked] = from_class
+    return stack
+
+
+class TemporalFilter:
+    def __init__(self, layers, nodata_list, window=DEFAULT_TEMPORAL_WINDOW, forbidden=None):
+        self.layers = list(layers)
+        self.nodata_list = list(nodata_list)
+        self.window = int(window)
+        self.forbidden = list(forbidden or [])
+        self.key = 'temporal|{}|{}'.format(self.window, ','.join('{}>{}'.format(a, b) for a, b in self.forbidden))
+        self._local = threading.local()
+
+    def bands(self):
+        return [TemporalBand(self, idx, layer) for idx, layer in enumerate(self.layers)]
+
+    def dependencies(self, index):
+        half = self.window // 2
+        start = 0 if self.forbidden else max(0, index - half)
+        return range(start, min(len(self.layers), index + half + 1))
+
+    def band_key(self, index):
+        fingerprints = [layer_fingerprint(self.layers[idx], self.nodata_list[idx]) for idx in self.dependencies(index)]
+        return '|'.join([self.key, str(index), digest_parts(fingerprints)])
+
+    def read_stack(self, col, row, cols, rows, factor=1):
+        window = (col, row, cols, rows, factor)
+        if getattr(self._local, 'window', None) == window:
+            return self._local.stack
+        arrays = [read_block(layer, col, row, cols, rows, factor=factor) for layer in self.layers]
+        valid = np.stack([_valid_mask(array, nodata) for array, nodata in zip(arrays, self.nodata_list)])
+        stack = mode_filter(np.stack(arrays), valid, self.window)
+        stack = apply_forbidden(stack, valid, self.forbidden)
+        result = [filtered.astype(array.dtype, copy=False) for filtered, array in zip(stack, arrays)]
+        for array in result:
+            array.flags.writeable = False
+        self._local.window = window
+        self._local.stack = result
+        return result
+
+    def close(self):
+        self._local = threading.local()
+
+
+class TemporalBand:
+    def __init__(self, temporal, index, layer):
+        self.temporal = temporal
+        self.index = index
+        self.layer = layer
+        self.grid_key = '|'.join([getattr(layer, 'grid_key', ''), temporal.band_key(index)])
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    def providerType(self):
+        return 'temporal'
+
+    def close(self):
+        self.temporal.close()
+        self.layer.close()
+
+    def read_window(self, col, row, cols, rows, factor=1):
+        return self.temporal.read_stack(col, row, cols, rows, factor)[self.index]
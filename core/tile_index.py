@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+
+import numpy as np
+from osgeo import gdal, ogr
+from qgis.core import QgsGeometry, QgsRectangle
+
+from .area import is_geographic, pixel_area_rows
+from .raster_reader import iter_blocks, read_block
+
+INDEX_VERSION = 3
+INDEX_TILE_SIZE = 512
+PROGRESS_BLOCK_SIZE = 256
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def _sparse_counts(values, slot, size, weights=None):
+    counts = np.bincount(values, minlength=size)
+    codes = np.nonzero(counts)[0]
+    areas = None if weights is None else np.bincount(values, weights=weights, minlength=size)[codes]
+    return np.full(codes.shape[0], slot, dtype=np.int32), codes.astype(np.int64), counts[codes], areas
+
+
+def _pack(cells, slots, codes, counts, cell_count, areas=None):
+    order = np.lexsort((codes, slots, cells))
+    cells = cells[order]
+    offsets = np.searchsorted(cells, np.arange(cell_count + 1))
+    level = {'offsets': offsets, 'slot': slots[order], 'code': codes[order], 'count': counts[order]}
+    if areas is not None:
+        level['area'] = areas[order]
+    return level
+
+
+def _coarsen(level, tile_rows, tile_cols, slot_count, code_count):
+    offsets = level['offsets']
+    cells = np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+    parent_cols = (tile_cols + 1) // 2
+    parents = (cells // tile_cols) // 2 * parent_cols + (cells % tile_cols) // 2
+    keys = (parents * slot_count + level['slot']) * code_count + level['code']
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=level['count']).astype(np.int64)
+    areas = np.bincount(inverse, weights=level['area']) if 'area' in level else None
+    code = unique % code_count
+    slot = (unique // code_count) % slot_count
+    parent = unique // code_count // slot_count
+    parent_rows = (tile_rows + 1) // 2
+    return _pack(parent, slot.astype(np.int32), code, counts, parent_rows * parent_cols, areas)
+
+
+class TileIndex:
+    def __init__(self, output_dir, key, tile_size=INDEX_TILE_SIZE):
+        self.index_dir = os.path.join(output_dir, 'tile_index')
+        self.key = key
+        self.tile_size = tile_size
+        self.meta = None
+        self._levels = {}
+        self._row_areas = None
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.index_dir, 'index.json')
+
+    def _level_path(self, level):
+        return os.path.join(self.index_dir, 'level_{}.npz'.format(level))
+
+    @property
+    def row_areas_path(self):
+        return os.path.join(self.index_dir, 'row_areas.npy')
+
+    def _read_meta(self):
+        if not os.path.isfile(self.meta_path):
+            return None
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != INDEX_VERSION:
+            return None
+        return meta
+
+    def load(self):
+        meta = self._read_meta()
+        if meta is None or meta.get('key') != self.key:
+            return False
+        self.meta = meta
+        self.tile_size = meta['tile_size']
+        return True
+
+    def reusable_years(self, fingerprints, mask_key):
+        meta = self._read_meta()
+        if meta is None or meta.get('mask_key') != json.dumps(mask_key) or meta.get('tile_size') != self.tile_size:
+            return 0
+        stored = meta.get('fingerprints', [])
+        if len(stored) < 2 or len(stored) > len(fingerprints) or list(fingerprints[:len(stored)]) != stored:
+            return 0
+        return len(stored)
+
+    def _previous_parts(self, size):
+        old_size = self.meta['size']
+        level = self._level(0)
+        parts = {}
+        for kind in ('hist', 'trans'):
+            offsets = level['{}_offsets'.format(kind)]
+            cells = np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+            codes = level['{}_code'.format(kind)]
+            if kind == 'trans':
+                codes = codes // old_size * size + codes % old_size
+            parts[kind] = [(cells, level['{}_slot'.format(kind)], codes, level['{}_count'.format(kind)], level.get('{}_area'.format(kind)))]
+        return parts
+
+    def build(self, layers, nodata_list, mask_layer, max_class, progress=None, fingerprints=None, mask_key=None):
+        size = max_class + 1
+        base = layers[0]
+        row_areas = pixel_area_rows(base) if is_geographic(base) else None
+        parts = {'hist': [], 'trans': []}
+        reused = self.reusable_years(fingerprints, mask_key) if fingerprints is not None else 0
+        if reused:
+            self.meta = self._read_meta()
+            if self.meta['weighted'] == (row_areas is not None) and self.meta['size'] <= size:
+                parts = self._previous_parts(size)
+            else:
+                reused = 0
+        self.meta = None
+        self._levels = {}
+        self._row_areas = None
+        if os.path.isdir(self.index_dir):
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+        os.makedirs(self.index_dir)
+        tile = self.tile_size
+        tile_rows = (base.height() + tile - 1) // tile
+        tile_cols = (base.width() + tile - 1) // tile
+        years = len(layers)
+        intervals = max(0, years - 1)
+        first = max(0, reused - 1)
+
+        for cell, (col, row, array0) in enumerate(iter_blocks(layers[first], block_cols=tile, block_rows=tile)):
+            rows, cols = array0.shape
+            if progress:
+                for _ in range(-(-rows // PROGRESS_BLOCK_SIZE) * -(-cols // PROGRESS_BLOCK_SIZE)):
+                    progress()
+            weights = None
+            if row_areas is not None:
+                weights = np.broadcast_to(row_areas[row:row + rows, None], array0.shape)
+            region = None
+            if mask_layer is not None:
+                region = read_block(mask_layer, col, row, cols, rows) == 1
+            arrays = [None] * first + [array0] + [read_block(layer, col, row, cols, rows) for layer in layers[first + 1:]]
+            valids = [None] * first
+            for idx in range(first, years):
+                array = arrays[idx]
+                valid = _valid_mask(array, nodata_list[idx])
+                if region is not None:
+                    valid &= region
+                valids.append(valid)
+                if idx < reused:
+                    continue
+                slots, codes, counts, areas = _sparse_counts(array[valid].astype(np.int64), idx, size, None if weights is None else weights[valid])
+                parts['hist'].append((np.full(codes.shape[0], cell, dtype=np.int64), slots, codes, counts, areas))
+            for idx in range(first, intervals):
+                valid = valids[idx] & valids[idx + 1]
+                pairs = arrays[idx][valid].astype(np.int64) * size + arrays[idx + 1][valid].astype(np.int64)
+                slots, codes, counts, areas = _sparse_counts(pairs, idx, size * size, None if weights is None else weights[valid])
+                parts['trans'].append((np.full(codes.shape[0], cell, dtype=np.int64), slots, codes, counts, areas))
+
+        levels = {}
+        for kind, slot_count, code_count in (('hist', years, size), ('trans', max(1, intervals), size * size)):
+            pieces = parts[kind]
+            if pieces:
+                arrays = [np.concatenate([piece[idx] for piece in pieces]) for idx in range(4)]
+                areas = np.concatenate([piece[4] for piece in pieces]) if row_areas is not None else None
+            else:
+                arrays = [np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)]
+                areas = np.zeros(0, dtype=np.float64) if row_areas is not None else None
+            level = _pack(arrays[0], arrays[1], arrays[2], arrays[3], tile_rows * tile_cols, areas)
+            rows, cols = tile_rows, tile_cols
+            number = 0
+            while True:
+                levels.setdefault(number, {}).update({'{}_{}'.format(kind, name): value for name, value in level.items()})
+                if rows == 1 and cols == 1:
+                    break
+                level = _coarsen(level, rows, cols, slot_count, code_count)
+                rows, cols = (rows + 1) // 2, (cols + 1) // 2
+                number += 1
+        for number, arrays in levels.items():
+            np.savez_compressed(self._level_path(number), **arrays)
+        if row_areas is not None:
+            np.save(self.row_areas_path, row_areas)
+
+        extent = base.extent()
+        meta = {
+            'version': INDEX_VERSION,
+            'key': self.key,
+            'years': years,
+            'size': size,
+            'width': base.width(),
+            'height': base.height(),
+            'tile_size': tile,
+            'levels': len(levels),
+            'weighted': row_areas is not None,
+            'fingerprints': list(fingerprints or []),
+            'mask_key': json.dumps(mask_key),
+            'origin': [extent.xMinimum(), extent.yMaximum()],
+            'pixel': [base.rasterUnitsPerPixelX(), abs(base.rasterUnitsPerPixelY())],
+        }
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(meta, handle, indent=2)
+        os.replace(temp_path, self.meta_path)
+        self.meta = meta
+
+    def _level(self, number):
+        level = self._levels.get(number)
+        if level is None:
+            with np.load(self._level_path(number)) as data:
+                level = {name: data[name] for name in data.files}
+            self._levels[number] = level
+        return level
+
+    def _weights(self):
+        if self._row_areas is None:
+            self._row_areas = np.load(self.row_areas_path)
+        return self._row_areas
+
+    def _cell_window(self, number, cell_row, cell_col):
+        span = self.tile_size << number
+        col = cell_col * span
+        row = cell_row * span
+        return col, row, min(span, self.meta['width'] - col), min(span, self.meta['height'] - row)
+
+    def _map_rect(self, col, row, cols, rows):
+        x0, y0 = self.meta['origin']
+        px_x, px_y = self.meta['pixel']
+        return QgsRectangle(x0 + col * px_x, y0 - (row + rows) * px_y, x0 + (col + cols) * px_x, y0 - row * px_y)
+
+    def _add_cell(self, totals, number, cell_row, cell_col):
+        level = self._level(number)
+        cols = -(-self.meta['width'] // (self.tile_size << number))
+        cell = cell_row * cols + cell_col
+        for kind in ('hist', 'trans'):
+            offsets = level['{}_offsets'.format(kind)]
+            start, stop = offsets[cell], offsets[cell + 1]
+            if stop > start:
+                index = (level['{}_slot'.format(kind)][start:stop], level['{}_code'.format(kind)][start:stop])
+                np.add.at(totals[kind], index, level['{}_count'.format(kind)][start:stop])
+                if self.meta['weighted']:
+                    np.add.at(totals[kind + '_area'], index, level['{}_area'.format(kind)][start:stop])
+
+    def _geometry_mask(self, geometry, col, row, cols, rows):
+        x0, y0 = self.meta['origin']
+        px_x, px_y = self.meta['pixel']
+        raster = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, gdal.GDT_Byte)
+        raster.SetGeoTransform((x0 + col * px_x, px_x, 0.0, y0 - row * px_y, 0.0, -px_y))
+        vector = ogr.GetDriverByName('Memory').CreateDataSource('')
+        layer = vector.CreateLayer('query', geom_type=ogr.wkbUnknown)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geometry.asWkb())))
+        layer.CreateFeature(feature)
+        gdal.RasterizeLayer(raster, [1], layer, burn_values=[1])
+        return raster.GetRasterBand(1).ReadAsArray() == 1
+
+    def _clip_window(self, bounds, col, row, cols, rows):
+        x0, y0 = self.meta['origin']
+        px_x, px_y = self.meta['pixel']
+        col0 = max(col, int(np.floor((bounds.xMinimum() - x0) / px_x)))
+        col1 = min(col + cols, int(np.ceil((bounds.xMaximum() - x0) / px_x)))
+        row0 = max(row, int(np.floor((y0 - bounds.yMaximum()) / px_y)))
+        row1 = min(row + rows, int(np.ceil((y0 - bounds.yMinimum()) / px_y)))
+        return col0, row0, col1 - col0, row1 - row0
+
+    def _add_window(self, totals, geometry, layers, nodata_list, mask_layer, col, row, cols, rows):
+        size = self.meta['size']
+        col, row, cols, rows = self._clip_window(geometry.boundingBox(), col, row, cols, rows)
+        if cols <= 0 or rows <= 0:
+            return
+        inside = self._geometry_mask(geometry, col, row, cols, rows)
+        if not inside.any():
+            return
+        if mask_layer is not None:
+            inside &= read_block(mask_layer, col, row, cols, rows) == 1
+        arrays = [read_block(layer, col, row, cols, rows) for layer in layers]
+        valids = [inside & _valid_mask(array, nodata) for array, nodata in zip(arrays, nodata_list)]
+        weights = None
+        if self.meta['weighted']:
+            weights = np.broadcast_to(self._weights()[row:row + rows, None], inside.shape)
+        for idx, (array, valid) in enumerate(zip(arrays, valids)):
+            values = array[valid].astype(np.int64)
+            totals['hist'][idx] += np.bincount(values, minlength=size)[:size]
+            if weights is not None:
+                totals['hist_area'][idx] += np.bincount(values, weights=weights[valid], minlength=size)[:size]
+        for idx in range(len(layers) - 1):
+            valid = valids[idx] & valids[idx + 1]
+            pairs = arrays[idx][valid].astype(np.int64) * size + arrays[idx + 1][valid].astype(np.int64)
+            totals['trans'][idx] += np.bincount(pairs, minlength=size * size)[:size * size]
+            if weights is not None:
+                totals['trans_area'][idx] += np.bincount(pairs, weights=weights[valid], minlength=size * size)[:size * size]
+
+    def query(self, geometry, layers, nodata_list, mask_layer=None):
+        years = self.meta['years']
+        size = self.meta['size']
+        totals = {
+            'hist': np.zeros((years, size), dtype=np.int64),
+            'trans': np.zeros((max(1, years - 1), size * size), dtype=np.int64),
+        }
+        if self.meta['weighted']:
+            totals['hist_area'] = np.zeros(totals['hist'].shape, dtype=np.float64)
+            totals['trans_area'] = np.zeros(totals['trans'].shape, dtype=np.float64)
+        stats = {'full_cells': 0, 'boundary_tiles': 0}
+        bounds = geometry.boundingBox()
+        top = self.meta['levels'] - 1
+        pending = [(top, 0, 0)]
+        while pending:
+            number, cell_row, cell_col = pending.pop()
+            col, row, cols, rows = self._cell_window(number, cell_row, cell_col)
+            if cols <= 0 or rows <= 0:
+                continue
+            rect = self._map_rect(col, row, cols, rows)
+            if not rect.intersects(bounds):
+                continue
+            cell_geometry = QgsGeometry.fromRect(rect)
+            if geometry.contains(cell_geometry):
+                self._add_cell(totals, number, cell_row, cell_col)
+                stats['full_cells'] += 1
+            elif geometry.intersects(cell_geometry):
+                if number == 0:
+                    self._add_window(totals, geometry, layers, nodata_list, mask_layer, col, row, cols, rows)
+                    stats['boundary_tiles'] += 1
+                else:
+                    for child_row in (cell_row * 2, cell_row * 2 + 1):
+                        for child_col in (cell_col * 2, cell_col * 2 + 1):
+                            pending.append((number - 1, child_row, child_col))
+        result = {
+            'area': totals['hist'],
+            'matrices': totals['trans'][:max(0, years - 1)].reshape((-1, size, size)),
+            'full_cells': stats['full_cells'],
+            'boundary_tiles': stats['boundary_tiles'],
+        }
+        if self.meta['weighted']:
+            result['weighted_area'] = totals['hist_area']
+            result['weighted_matrices'] = totals['trans_area'][:max(0, years - 1)].reshape((-1, size, size))
+        return result
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+from osgeo import gdal
+
+CODE_NODATA = 65535
+MAX_CODE_CLASSES = 255
+CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE']
+DEFAULT_COLORS = [
+    (31, 119, 180),
+    (255, 127, 14),
+    (44, 160, 44),
+    (214, 39, 40),
+    (148, 103, 189),
+    (140, 86, 75),
+    (227, 119, 194),
+    (127, 127, 127),
+    (188, 189, 34),
+    (23, 190, 207),
+]
+
+
+def dense_class_ids(area_counts_list):
+    class_ids = set()
+    for area_counts in area_counts_list:
+        class_ids.update(class_id for class_id, count in area_counts.items() if count)
+    return np.array(sorted(class_ids), dtype=np.int64)
+
+
+def _blend(color, weight):
+    return tuple(int(round(channel * (1.0 - weight) + 255 * weight)) for channel in color)
+
+
+class TransitionCodeWriter:
+    def __init__(self, base, output_path, class_ids, legend_map=None, colors=None):
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        if class_ids.shape[0] > MAX_CODE_CLASSES:
+            raise ValueError('Transition rasters support at most {} classes ({} found).'.format(MAX_CODE_CLASSES, class_ids.shape[0]))
+        self.base = base
+        self.path = output_path
+        self.class_ids = class_ids
+        self.legend_map = legend_map or {}
+        self.colors = colors or {}
+        self.lookup = np.full(int(class_ids.max()) + 1 if class_ids.shape[0] else 1, -1, dtype=np.int64)
+        self.lookup[class_ids] = np.arange(class_ids.shape[0])
+        self.dataset = None
+        self.band = None
+
+    def create(self):
+        base = self.base
+        extent = base.extent()
+        px_x = base.rasterUnitsPerPixelX()
+        px_y = abs(base.rasterUnitsPerPixelY())
+        driver = gdal.GetDriverByName('GTiff')
+        self.dataset = driver.Create(self.path, base.width(), base.height(), 1, gdal.GDT_UInt16, options=CREATION_OPTIONS)
+        self.dataset.SetGeoTransform((extent.xMinimum(), px_x, 0.0, extent.yMaximum(), 0.0, -px_y))
+        self.dataset.SetProjection(base.crs().toWkt())
+        self.band = self.dataset.GetRasterBand(1)
+        self.band.SetNoDataValue(CODE_NODATA)
+        self.band.Fill(CODE_NODATA)
+
+    def resume(self):
+        if not os.path.isfile(self.path):
+            return False
+        self.dataset = gdal.Open(self.path, gdal.GA_Update)
+        if self.dataset is None:
+            return False
+        self.band = self.dataset.GetRasterBand(1)
+        return True
+
+    def write(self, col, row, array0, array1, valid):
+        codes = np.full(array0.shape, CODE_NODATA, dtype=np.uint16)
+        if valid.any():
+            size = self.lookup.shape[0]
+            t0 = array0[valid].astype(np.int64)
+            t1 = array1[valid].astype(np.int64)
+            from_idx = self.lookup[np.clip(t0, 0, size - 1)]
+            to_idx = self.lookup[np.clip(t1, 0, size - 1)]
+            known = (t0 >= 0) & (t1 >= 0) & (t0 < size) & (t1 < size) & (from_idx >= 0) & (to_idx >= 0)
+            block = np.full(t0.shape[0], CODE_NODATA, dtype=np.uint16)
+            block[known] = (from_idx[known] * self.class_ids.shape[0] + to_idx[known]).astype(np.uint16)
+            codes[valid] = block
+        self.band.WriteArray(codes, xoff=col, yoff=row)
+
+    def flush(self):
+        if self.dataset is not None:
+            self.dataset.FlushCache()
+
+    def _class_color(self, idx):
+        class_id = int(self.class_ids[idx])
+        return self.colors.get(class_id, DEFAULT_COLORS[idx % len(DEFAULT_COLORS)])
+
+    def close(self, matrix=None):
+        if self.dataset is None:
+            return
+        count = self.class_ids.shape[0]
+        from_idx, to_idx = np.divmod(np.arange(count * count), count)
+        pixels = np.zeros(count * count, dtype=np.int64)
+        if matrix is not None:
+            size = matrix.shape[0]
+            inside = (self.class_ids[from_idx] < size) & (self.class_ids[to_idx] < size)
+            pixels[inside] = matrix[self.class_ids[from_idx[inside]], self.class_ids[to_idx[inside]]]
+            used = np.nonzero(pixels)[0]
+        else:
+            used = np.arange(count * count)
+
+        rat = gdal.RasterAttributeTable()
+        rat.CreateColumn('Value', gdal.GFT_Integer, gdal.GFU_MinMax)
+        rat.CreateColumn('From', gdal.GFT_Integer, gdal.GFU_Generic)
+        rat.CreateColumn('To', gdal.GFT_Integer, gdal.GFU_Generic)
+        rat.CreateColumn('From_Label', gdal.GFT_String, gdal.GFU_Generic)
+        rat.CreateColumn('To_Label', gdal.GFT_String, gdal.GFU_Generic)
+        rat.CreateColumn('Pixels', gdal.GFT_Real, gdal.GFU_PixelCount)
+        rat.SetRowCount(int(used.shape[0]))
+        palette = gdal.ColorTable()
+        for row, code in enumerate(used.tolist()):
+            from_id = int(self.class_ids[from_idx[code]])
+            to_id = int(self.class_ids[to_idx[code]])
+            rat.SetValueAsInt(row, 0, code)
+            rat.SetValueAsInt(row, 1, from_id)
+            rat.SetValueAsInt(row, 2, to_id)
+            rat.SetValueAsString(row, 3, self.legend_map.get(from_id, str(from_id)))
+            rat.SetValueAsString(row, 4, self.legend_map.get(to_id, str(to_id)))
+            rat.SetValueAsDouble(row, 5, float(pixels[code]))
+            color = self._class_color(to_idx[code])
+            if from_id == to_id:
+                color = _blend(color, 0.7)
+            palette.SetColorEntry(code, color + (255,))
+        self.band.SetDefaultRAT(rat)
+        self.band.SetColorTable(palette)
+        self.band.FlushCache()
+        self.dataset.FlushCache()
+        self.band = None
+        self.dataset = None
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from .raster_reader import iter_blocks, read_block
+
+
+def _valid_mask(array, nodata):
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+
+def _accumulate(flat, codes, weights=None):
+    if flat.shape[0] <= 4 * codes.shape[0]:
+        flat += np.bincount(codes, weights=weights, minlength=flat.shape[0])
+    elif weights is None:
+        unique, counts = np.unique(codes, return_counts=True)
+        flat[unique] += counts
+    else:
+        unique, inverse = np.unique(codes, return_inverse=True)
+        flat[unique] += np.bincount(inverse, weights=weights)
+
+
+def _relayout(array, positions, zone_count, axis):
+    shape = list(array.shape)
+    shape[axis] = zone_count
+    grown = np.zeros(shape, dtype=array.dtype)
+    index = [slice(None)] * array.ndim
+    index[axis] = positions
+    grown[tuple(index)] = array
+    return grown
+
+
+class _SparseCounts:
+    def __init__(self, weighted=False, flush_size=1 << 20):
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.float64) if weighted else None
+        self.flush_size = flush_size
+        self._pending = []
+        self._pending_size = 0
+
+    def add(self, codes, weights=None):
+        unique, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+        block_weights = None
+        if self.weights is not None:
+            block_weights = np.bincount(inverse, weights=weights, minlength=unique.shape[0])
+        self._pending.append((unique, counts, block_weights))
+        self._pending_size += unique.shape[0]
+        if self._pending_size >= self.flush_size:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        parts = [(self.codes, self.counts, self.weights)] + self._pending
+        codes = np.concatenate([part[0] for part in parts])
+        unique, inverse = np.unique(codes, return_inverse=True)
+        counts = np.zeros(unique.shape[0], dtype=np.int64)
+        np.add.at(counts, inverse, np.concatenate([part[1] for part in parts]))
+        if self.weights is not None:
+            self.weights = np.bincount(inverse, weights=np.concatenate([part[2] for part in parts]), minlength=unique.shape[0])
+        self.codes = unique
+        self.counts = counts
+        self._pending = []
+        self._pending_size = 0
+
+    def result(self, zone_ids, size):
+        self._merge()
+        zones, pairs = np.divmod(self.codes, size * size)
+        from_ids, to_ids = np.divmod(pairs, size)
+        return {
+            'zone': np.searchsorted(zone_ids, zones),
+            'from': from_ids,
+            'to': to_ids,
+            'count': self.counts,
+            'area': self.weights,
+        }
+
+
+def compute_zonal_metrics(layers, nodata_list, zone_layer, mask_layer, max_class, progress=None, row_areas=None):
+    size = max_class + 1
+    years = len(layers)
+    zone_ids = np.zeros(0, dtype=np.int64)
+    area = np.zeros((years, 0, size), dtype=np.int64)
+    transitions = [_SparseCounts(weighted=row_areas is not None) for _ in range(max(0, years - 1))]
+    weighted_area = None
+    if row_areas is not None:
+        weighted_area = np.zeros(area.shape, dtype=np.float64)
+
+    for col, row, array0 in iter_blocks(layers[0], on_block=progress):
+        rows, cols = array0.shape
+        zones = read_block(zone_layer, col, row, cols, rows).astype(np.int64)
+        in_zone = zones >= 0
+        if mask_layer is not None:
+            in_zone &= read_block(mask_layer, col, row, cols, rows) == 1
+        if not in_zone.any():
+            continue
+        block_ids = np.unique(zones[in_zone])
+        if not np.isin(block_ids, zone_ids).all():
+            merged = np.union1d(zone_ids, block_ids)
+            positions = np.searchsorted(merged, zone_ids)
+            area = _relayout(area, positions, merged.shape[0], 1)
+            if weighted_area is not None:
+                weighted_area = _relayout(weighted_area, positions, merged.shape[0], 1)
+            zone_ids = merged
+        zone_index = np.searchsorted(zone_ids, zones)
+
+        arrays = [array0] + [read_block(layer, col, row, cols, rows) for layer in layers[1:]]
+        valids = [in_zone & _valid_mask(array, nodata) for array, nodata in zip(arrays, nodata_list)]
+        weights = None
+        if weighted_area is not None:
+            weights = np.broadcast_to(row_areas[row:row + rows, None], (rows, cols))
+        for idx, (array, valid) in enumerate(zip(arrays, valids)):
+            codes = zone_index[valid] * size + array[valid].astype(np.int64)
+            _accumulate(area[idx].reshape(-1), codes)
+            if weighted_area is not None:
+                _accumulate(weighted_area[idx].reshape(-1), codes, weights[valid])
+        for idx in range(years - 1):
+            valid = valids[idx] & valids[idx + 1]
+            codes = (zones[valid] * size + arrays[idx][valid].astype(np.int64)) * size + arrays[idx + 1][valid].astype(np.int64)
+            transitions[idx].add(codes, None if weights is None else weights[valid])
+
+    return {
+        'zone_ids': zone_ids,
+        'area': area,
+        'transitions': [counts.result(zone_ids, size) for counts in transitions],
+        'weighted_area': weighted_area,
+    }
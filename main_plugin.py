@@ -1,31 +1,63 @@
 # -*- coding: utf-8 -*-
+import math
 import os
 import re
+import shutil
+import time
 from collections import namedtuple
 
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QColor, QBrush, QIcon
 from qgis.PyQt.QtWidgets import QAction, QDockWidget, QFileDialog, QDialog, QListWidget, QPushButton, QVBoxLayout, QMessageBox, QDialogButtonBox, QPlainTextEdit
-from qgis.core import QgsProject, QgsRasterLayer, QgsMapLayerType, QgsMapLayerProxyModel, Qgis
-from qgis.gui import QgsMapLayerComboBox, QgsProjectionSelectionWidget
+from qgis.core import QgsCoordinateTransform, QgsGeometry, QgsProject, QgsRasterLayer, QgsVectorLayer, QgsMapLayerType, QgsMapLayerProxyModel, QgsFieldProxyModel, Qgis
+from qgis.gui import QgsFieldComboBox, QgsMapLayerComboBox, QgsMapToolExtent, QgsProjectionSelectionWidget
+import numpy as np
 import processing
 
 from .core.validator import validate_rasters, ValidationError
-from .core.raster_reader import get_nodata_value
-from .core.change_metrics import (
-    compute_max_class,
-    compute_area_by_class,
-    compute_interval_metrics,
-    build_top_transitions,
-)
-from .core.persistence import write_change_frequency
-from .core.intensity import compute_intensity_rows
+from .core.alignment import align_layers, pending_fill_blocks
+from .core.sieve import DEFAULT_SIEVE_PIXELS, MAX_SIEVE_PIXELS, sieve_layers
+from .core.temporal import DEFAULT_TEMPORAL_WINDOW, TemporalFilter, parse_forbidden_transitions
+from .core.raster_reader import RasterStack, get_nodata_value
+from .core.change_metrics import area_counts_from_array, area_counts_to_array, padded_counts
+from .core.raster_stats import MODE_EXACT, MODE_SAMPLED, has_cached_statistics, layer_statistics
+from .core.persistence import write_change_frequency, write_change_frequency_from_masks, update_change_frequency
+from .core.intensity import compute_intensity_table
 from .core.hotspot import build_hotspot_raster
-from .core.exports import write_csv, add_raster_to_project, reproject_raster
+from .core.transition_raster import TransitionCodeWriter, dense_class_ids
+from .core.polygonize import DEFAULT_MIN_AREA_HA, PATCHES_NAME, polygonize_changes
+from .core.exports import FORMAT_CSV, FORMAT_GPKG, FORMAT_PARQUET, TableWriter, add_raster_to_project, reproject_raster, write_result_arrays
+from .core.tables import (
+    Table,
+    area_by_class_table,
+    fragmentation_table,
+    label_column,
+    net_gross_table,
+    top_transitions_table,
+    transition_matrix_table,
+    transition_values,
+    zonal_area_table,
+    zonal_net_gross_table,
+    zonal_transition_table,
+)
+from .core.zonal import compute_zonal_metrics
+from .core.area import area_factor_from, is_geographic, pixel_area_rows, pixel_edge_rows
+from .core.profiling import StageProfiler, profiling_requested
+from .core.cache import ResultCache, DEFAULT_CACHE_LIMIT_MB, digest_parts, geometry_fingerprint, layer_fingerprint
+from .core.checkpoint import Checkpoint, DEFAULT_CHECKPOINT_SECONDS
+from .core.change_masks import ChangeMaskStore
+from .core.tile_index import TileIndex
+from .core.hierarchy import (
+    group_area_counts, group_area_factor, group_matrix, group_targets, grouping_matrix, parse_group, unmapped_classes, unmapped_offset,
+)
+from .core.cube import CubeStore, clear_cubes
+from .core.run_state import RunState
+from .core.quicklook import DEFAULT_QUICKLOOK_FACTOR, compute_quicklook
+from .core.raster_reader import decimated_size
 from .core import charts
 
-RasterItem = namedtuple('RasterItem', ['layer', 'path', 'year', 'nodata'])
+RasterItem = namedtuple('RasterItem', ['layer', 'path', 'year', 'nodata', 'band'], defaults=[1])
 
 
 class LayerPickerDialog(QDialog):
@@ -57,6 +89,7 @@ class LandChangeAccountingPlugin:
         self.dock = None
         self.action = None
         self.rasters = []
+        self._extent_tool = None
 
     def initGui(self):
         self.action = QAction('Spatiotemporal LULC Analysis', self.iface.mainWindow())
@@ -169,6 +202,7 @@ class LandChangeAccountingPlugin:
     def _setup_ui(self):
         from qgis.PyQt.QtWidgets import QSizePolicy
         self.widget.nodataMode.addItems(['Use raster NoData', 'Use value'])
+        self.widget.statsModeCombo.addItems(['Exact (GDAL histogram)', 'Sampled (overviews)'])
         self.widget.nodataValue.setEnabled(False)
         self.widget.nodataMode.setMinimumWidth(140)
         self.widget.nodataMode.setMaximumWidth(180)
@@ -188,6 +222,10 @@ class LandChangeAccountingPlugin:
         self.widget.aboutButton.clicked.connect(self._show_about)
         self.widget.helpButton.clicked.connect(self._show_help)
         self.widget.runButton.clicked.connect(self._run_analysis)
+        self.widget.quickLookButton.clicked.connect(self._run_quicklook)
+        self.widget.queryExtentButton.clicked.connect(self._start_extent_query)
+        self.widget.quickLookFactorSpin.setRange(2, 64)
+        self.widget.quickLookFactorSpin.setValue(DEFAULT_QUICKLOOK_FACTOR)
         self.widget.runButton.setStyleSheet(
             'QPushButton {'
             'background-color: #2e7d32;'
@@ -217,6 +255,20 @@ class LandChangeAccountingPlugin:
         self.widget.aoiCombo.deleteLater()
         self.widget.aoiCombo = aoi_combo
 
+        zone_combo = QgsMapLayerComboBox(self.widget)
+        zone_combo.setFilters(QgsMapLayerProxyModel.PolygonLayer)
+        zone_combo.setAllowEmptyLayer(True)
+        zone_combo.setLayer(None)
+        self.widget.zoneLayout.replaceWidget(self.widget.zoneCombo, zone_combo)
+        self.widget.zoneCombo.deleteLater()
+        self.widget.zoneCombo = zone_combo
+        zone_field_combo = QgsFieldComboBox(self.widget)
+        zone_field_combo.setFilters(QgsFieldProxyModel.Int | QgsFieldProxyModel.LongLong)
+        self.widget.zoneLayout.replaceWidget(self.widget.zoneFieldCombo, zone_field_combo)
+        self.widget.zoneFieldCombo.deleteLater()
+        self.widget.zoneFieldCombo = zone_field_combo
+        zone_combo.layerChanged.connect(zone_field_combo.setLayer)
+
         crs_widget = QgsProjectionSelectionWidget(self.widget)
         self.widget.crsLayout.replaceWidget(self.widget.crsWidget, crs_widget)
         self.widget.crsWidget.deleteLater()
@@ -235,8 +287,62 @@ class LandChangeAccountingPlugin:
             self.widget.hotspotCheck,
         ):
             checkbox.setChecked(True)
+        self.widget.transitionRasterCheck.setChecked(False)
+        self.widget.polygonCheck.setChecked(False)
+        self.widget.polygonMinAreaSpin.setRange(0.0, 1e6)
+        self.widget.polygonMinAreaSpin.setDecimals(2)
+        self.widget.polygonMinAreaSpin.setSuffix(' ha')
+        self.widget.polygonMinAreaSpin.setValue(DEFAULT_MIN_AREA_HA)
+        self.widget.polygonMinAreaSpin.setEnabled(False)
+        self.widget.polygonCheck.toggled.connect(self.widget.polygonMinAreaSpin.setEnabled)
         self.widget.chartsCheck.setChecked(False)
+        self.widget.dashboardCheck.setChecked(False)
+        self.widget.dashboardCheck.setEnabled(False)
+        self.widget.chartsCheck.toggled.connect(self.widget.dashboardCheck.setEnabled)
+        self.widget.compressChartsCheck.setChecked(False)
+        self.widget.csvCheck.setChecked(True)
+        self.widget.parquetCheck.setChecked(False)
+        self.widget.gpkgCheck.setChecked(False)
+        self.widget.npzCheck.setChecked(False)
+        self.widget.compressChartsCheck.setEnabled(False)
+        self.widget.chartsCheck.toggled.connect(self.widget.compressChartsCheck.setEnabled)
         self.widget.includeNodataClassCheck.setChecked(False)
+        self.widget.alignCheck.setChecked(True)
+        self.widget.profileCheck.setChecked(False)
+        self.widget.cacheCheck.setChecked(True)
+        self.widget.cubeCheck.setChecked(False)
+        self.widget.incrementalCheck.setChecked(False)
+        self.widget.changeMasksCheck.setChecked(False)
+        self.widget.tileIndexCheck.setChecked(False)
+        self.widget.fragmentationCheck.setChecked(False)
+        self.widget.checkpointCheck.setChecked(False)
+        self.widget.checkpointSpin.setRange(10, 24 * 3600)
+        self.widget.checkpointSpin.setSuffix(' s')
+        self.widget.checkpointSpin.setValue(DEFAULT_CHECKPOINT_SECONDS)
+        self.widget.checkpointSpin.setEnabled(False)
+        self.widget.checkpointCheck.toggled.connect(self.widget.checkpointSpin.setEnabled)
+        self.widget.cacheLimitSpin.setRange(64, 1024 * 1024)
+        self.widget.cacheLimitSpin.setSingleStep(256)
+        self.widget.cacheLimitSpin.setValue(DEFAULT_CACHE_LIMIT_MB)
+        self.widget.clearCacheButton.clicked.connect(self._clear_cache)
+        self.widget.sieveCheck.setChecked(False)
+        self.widget.sieveSpin.setRange(2, MAX_SIEVE_PIXELS)
+        self.widget.sieveSpin.setSuffix(' px')
+        self.widget.sieveSpin.setValue(DEFAULT_SIEVE_PIXELS)
+        self.widget.sieveConnectivityCombo.addItems(['4-connected', '8-connected'])
+        self.widget.sieveSpin.setEnabled(False)
+        self.widget.sieveConnectivityCombo.setEnabled(False)
+        self.widget.sieveCheck.toggled.connect(self.widget.sieveSpin.setEnabled)
+        self.widget.sieveCheck.toggled.connect(self.widget.sieveConnectivityCombo.setEnabled)
+        self.widget.temporalCheck.setChecked(False)
+        self.widget.temporalWindowSpin.setRange(1, 9)
+        self.widget.temporalWindowSpin.setSingleStep(2)
+        self.widget.temporalWindowSpin.setSuffix(' years')
+        self.widget.temporalWindowSpin.setValue(DEFAULT_TEMPORAL_WINDOW)
+        self.widget.temporalWindowSpin.setEnabled(False)
+        self.widget.forbiddenEdit.setEnabled(False)
+        self.widget.temporalCheck.toggled.connect(self.widget.temporalWindowSpin.setEnabled)
+        self.widget.temporalCheck.toggled.connect(self.widget.forbiddenEdit.setEnabled)
 
         header = self.widget.rasterTable.horizontalHeader()
         header.setSectionResizeMode(0, header.Stretch)
@@ -247,6 +353,8 @@ class LandChangeAccountingPlugin:
         legend_header = self.widget.legendTable.horizontalHeader()
         legend_header.setSectionResizeMode(0, legend_header.ResizeToContents)
         legend_header.setSectionResizeMode(1, legend_header.Stretch)
+        legend_header.setSectionResizeMode(2, legend_header.ResizeToContents)
+        legend_header.setSectionResizeMode(3, legend_header.ResizeToContents)
         self.widget.legendTable.setMaximumHeight(180)
 
         validation_header = self.widget.validationTable.horizontalHeader()
@@ -259,6 +367,42 @@ class LandChangeAccountingPlugin:
     def _log(self, message):
         self.widget.logText.appendPlainText(message)
 
+    def _table_writer(self, output_dir):
+        formats = []
+        if self.widget.csvCheck.isChecked():
+            formats.append(FORMAT_CSV)
+        if self.widget.parquetCheck.isChecked():
+            formats.append(FORMAT_PARQUET)
+        if self.widget.gpkgCheck.isChecked():
+            formats.append(FORMAT_GPKG)
+        writer = TableWriter(output_dir, formats)
+        if writer.parquet_fallback:
+            self._log('Parquet: pyarrow not available, writing .npz tables instead.')
+        return writer
+
+    def _write_table(self, writer, name, table, prefix=''):
+        for path in writer.write(name, table):
+            self._log('Wrote {}{}'.format(prefix, path))
+
+    def _log_chart(self, ok, name, dashboard=None):
+        if not ok:
+            return
+        if dashboard is None:
+            self._log('Wrote charts/{}.html'.format(name))
+        else:
+            self._log('Added {} to charts/index.html'.format(name))
+
+    def _log_resume(self, checkpoint, label):
+        if checkpoint is not None and checkpoint.resumed_from:
+            self._log('Resumed {} from checkpoint at block {}'.format(label, checkpoint.resumed_from))
+
+    def _clear_cache(self):
+        removed = ResultCache().clear()
+        self._log('Cleared {} cached result(s).'.format(removed))
+        removed = clear_cubes()
+        if removed:
+            self._log('Removed {} data cube(s).'.format(removed))
+
     def _nodata_mode_changed(self, idx):
         self.widget.nodataValue.setEnabled(idx == 1)
 
@@ -274,9 +418,7 @@ class LandChangeAccountingPlugin:
             if not layer.isValid():
                 self._log('Invalid raster: {}'.format(path))
                 continue
-            year = self._infer_year(path)
-            nodata = get_nodata_value(layer)
-            self.rasters.append(RasterItem(layer, path, year, nodata))
+            self._append_layer(layer, path, path)
         self._refresh_table()
 
     def _add_from_project(self):
@@ -290,10 +432,17 @@ class LandChangeAccountingPlugin:
             return
         for idx in dialog.selected_indexes():
             layer = layers[idx]
-            nodata = get_nodata_value(layer)
-            self.rasters.append(RasterItem(layer, layer.source(), self._infer_year(layer.name()), nodata))
+            self._append_layer(layer, layer.source(), layer.name())
         self._refresh_table()
 
+    def _append_layer(self, layer, path, year_text):
+        if layer.bandCount() == 1:
+            self.rasters.append(RasterItem(layer, path, self._infer_year(year_text), get_nodata_value(layer)))
+            return
+        for band in range(1, layer.bandCount() + 1):
+            year = self._infer_year(layer.bandName(band))
+            self.rasters.append(RasterItem(layer, path, year, get_nodata_value(layer, band), band))
+
     def _remove_selected(self):
         selected = sorted({idx.row() for idx in self.widget.rasterTable.selectedIndexes()}, reverse=True)
         for row in selected:
@@ -305,6 +454,8 @@ class LandChangeAccountingPlugin:
         self.widget.rasterTable.setRowCount(len(self.rasters))
         for row, item in enumerate(self.rasters):
             label = item.layer.name() or os.path.basename(item.path)
+            if item.layer.bandCount() > 1:
+                label = '{} [band {}]'.format(label, item.band)
             self.widget.rasterTable.setItem(row, 0, self._make_item(label))
             year_item = self._make_item(item.year or '')
             year_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
@@ -340,6 +491,36 @@ class LandChangeAccountingPlugin:
             legend[class_id] = label
         return legend
 
+    def _read_legend_colors(self):
+        colors = {}
+        for row in range(self.widget.legendTable.rowCount()):
+            id_item = self.widget.legendTable.item(row, 0)
+            color_item = self.widget.legendTable.item(row, 2)
+            if not id_item or not id_item.text().strip() or not color_item or not color_item.text().strip():
+                continue
+            color = QColor(color_item.text().strip())
+            if not color.isValid():
+                raise ValueError('Invalid color in legend at row {}'.format(row + 1))
+            colors[int(id_item.text().strip())] = (color.red(), color.green(), color.blue())
+        return colors
+
+    def _read_legend_groups(self):
+        groups = {}
+        labels = {}
+        for row in range(self.widget.legendTable.rowCount()):
+            id_item = self.widget.legendTable.item(row, 0)
+            group_item = self.widget.legendTable.item(row, 3)
+            if not id_item or not id_item.text().strip() or not group_item or not group_item.text().strip():
+                continue
+            try:
+                group_id, label = parse_group(group_item.text())
+            except ValueError as exc:
+                raise ValueError('{} in legend at row {}'.format(exc, row + 1))
+            groups[int(id_item.text().strip())] = group_id
+            if label and not labels.get(group_id):
+                labels[group_id] = label
+        return groups, labels
+
     def _clear_validation(self):
         self.widget.validationTable.setRowCount(0)
 
@@ -378,33 +559,10 @@ class LandChangeAccountingPlugin:
     def _is_integer_datatype(self, dtype):
         return dtype in (Qgis.Byte, Qgis.UInt16, Qgis.Int16, Qgis.UInt32, Qgis.Int32)
 
-    def _compute_min_max_unique(self, layer, nodata, max_unique=1024, progress=None):
-        from .core.raster_reader import iter_blocks
-        import numpy as np
-        min_val = None
-        max_val = None
-        unique_vals = set()
-        capped = False
-        for _, _, array in iter_blocks(layer, on_block=progress):
-            if nodata is None:
-                valid = np.ones(array.shape, dtype=bool)
-            else:
-                valid = array != nodata
-            if not valid.any():
-                continue
-            values = array[valid]
-            local_min = float(np.min(values))
-            local_max = float(np.max(values))
-            min_val = local_min if min_val is None else min(min_val, local_min)
-            max_val = local_max if max_val is None else max(max_val, local_max)
-            if not capped:
-                uniques = np.unique(values)
-                for val in uniques:
-                    unique_vals.add(int(val))
-                    if len(unique_vals) >= max_unique:
-                        capped = True
-                        break
-        return min_val, max_val, unique_vals, capped
+    def _statistics_mode(self):
+        if self.widget.statsModeCombo.currentIndex() == 1:
+            return MODE_SAMPLED
+        return MODE_EXACT
 
     def _count_blocks(self, layer, block_size=256):
         import math
@@ -419,8 +577,8 @@ class LandChangeAccountingPlugin:
         self.widget.progressBar.setTextVisible(True)
         self.widget.progressBar.setFormat('Processing blocks: %v / %m')
 
-    def _progress_callback(self, total_steps):
-        progress = {'value': 0}
+    def _progress_callback(self, total_steps, done=0):
+        progress = {'value': done}
 
         def advance():
             progress['value'] += 1
@@ -451,7 +609,13 @@ class LandChangeAccountingPlugin:
                 self._add_validation_row('NoData value', 'FAIL', 'NoData override is not numeric.')
                 return
 
-        raster_layers = [item.layer for item in rasters]
+        stack = RasterStack([item.layer for item in rasters], [item.band for item in rasters])
+        try:
+            self._validate_layers(rasters, list(stack), nodata_override, output_dir, progress)
+        finally:
+            stack.close()
+
+    def _validate_layers(self, rasters, raster_layers, nodata_override, output_dir, progress):
         base = raster_layers[0]
         base_crs = base.crs()
         base_extent = base.extent()
@@ -460,9 +624,11 @@ class LandChangeAccountingPlugin:
         base_width = base.width()
         base_height = base.height()
 
+        mismatch_status = 'WARN' if self.widget.alignCheck.isChecked() else 'FAIL'
+        mismatch_text = 'Aligned on the fly: {}' if self.widget.alignCheck.isChecked() else 'Mismatch: {}'
         mismatched = [layer.name() for layer in raster_layers if layer.crs() != base_crs]
         if mismatched:
-            self._add_validation_row('CRS', 'FAIL', 'Mismatch: {}'.format(', '.join(mismatched)))
+            self._add_validation_row('CRS', mismatch_status, mismatch_text.format(', '.join(mismatched)))
         else:
             self._add_validation_row('CRS', 'PASS', base_crs.authid())
 
@@ -471,13 +637,13 @@ class LandChangeAccountingPlugin:
             if abs(layer.rasterUnitsPerPixelX() - base_px_x) > 1e-9 or abs(layer.rasterUnitsPerPixelY() - base_px_y) > 1e-9:
                 size_mismatch.append(layer.name())
         if size_mismatch:
-            self._add_validation_row('Pixel size', 'FAIL', 'Mismatch: {}'.format(', '.join(size_mismatch)))
+            self._add_validation_row('Pixel size', mismatch_status, mismatch_text.format(', '.join(size_mismatch)))
         else:
             self._add_validation_row('Pixel size', 'PASS', '{} x {}'.format(base_px_x, base_px_y))
 
         extent_mismatch = [layer.name() for layer in raster_layers if layer.extent() != base_extent]
         if extent_mismatch:
-            self._add_validation_row('Extent', 'FAIL', 'Mismatch: {}'.format(', '.join(extent_mismatch)))
+            self._add_validation_row('Extent', mismatch_status, mismatch_text.format(', '.join(extent_mismatch)))
         else:
             self._add_validation_row('Extent', 'PASS', 'All match')
 
@@ -486,7 +652,7 @@ class LandChangeAccountingPlugin:
             if layer.width() != base_width or layer.height() != base_height:
                 dim_mismatch.append(layer.name())
         if dim_mismatch:
-            self._add_validation_row('Dimensions', 'FAIL', 'Mismatch: {}'.format(', '.join(dim_mismatch)))
+            self._add_validation_row('Dimensions', mismatch_status, mismatch_text.format(', '.join(dim_mismatch)))
         else:
             self._add_validation_row('Dimensions', 'PASS', '{} x {}'.format(base_width, base_height))
 
@@ -495,14 +661,14 @@ class LandChangeAccountingPlugin:
             if layer.extent().xMinimum() != base_extent.xMinimum() or layer.extent().yMaximum() != base_extent.yMaximum():
                 origin_mismatch.append(layer.name())
         if origin_mismatch:
-            self._add_validation_row('Grid alignment', 'FAIL', 'Mismatch: {}'.format(', '.join(origin_mismatch)))
+            self._add_validation_row('Grid alignment', mismatch_status, mismatch_text.format(', '.join(origin_mismatch)))
         else:
             self._add_validation_row('Grid alignment', 'PASS', 'Origins match')
 
         datatype_info = []
         any_float = False
         for layer in raster_layers:
-            dtype = layer.dataProvider().dataType(1)
+            dtype = layer.dataProvider().dataType(layer.band)
             datatype_info.append('{}: {}'.format(layer.name(), self._datatype_name(dtype)))
             if not self._is_integer_datatype(dtype):
                 any_float = True
@@ -531,13 +697,17 @@ class LandChangeAccountingPlugin:
 
         ranges = []
         uniques = []
+        methods = []
+        stats_mode = self._statistics_mode()
         for layer, nodata in zip(raster_layers, nodata_values):
-            min_val, max_val, unique_vals, capped = self._compute_min_max_unique(layer, nodata, progress=progress)
-            ranges.append('{}: {}..{}'.format(layer.name(), min_val, max_val))
-            count_text = '>= {}'.format(len(unique_vals)) if capped else str(len(unique_vals))
+            stats = layer_statistics(layer, nodata, mode=stats_mode, progress=progress)
+            ranges.append('{}: {}..{}'.format(layer.name(), stats['min'], stats['max']))
+            count_text = '>= {}'.format(stats['unique_count']) if stats['capped'] else str(stats['unique_count'])
             uniques.append('{}: {}'.format(layer.name(), count_text))
+            methods.append('{}: {}'.format(layer.name(), stats['method']))
         self._add_validation_row('Value range', 'INFO', '; '.join(ranges))
         self._add_validation_row('Unique classes', 'INFO', '; '.join(uniques))
+        self._add_validation_row('Statistics source', 'INFO', '; '.join(methods))
 
         aoi_layer = self.widget.aoiCombo.currentLayer()
         if aoi_layer is None:
@@ -549,7 +719,6 @@ class LandChangeAccountingPlugin:
             else:
                 mask_layer = self._build_mask_raster(aoi_layer, base, out_dir)
                 from .core.raster_reader import iter_blocks, read_block
-                import numpy as np
                 total_valid = 0
                 covered = 0
                 for col, row, array in iter_blocks(base, on_block=progress):
@@ -621,31 +790,410 @@ class LandChangeAccountingPlugin:
             raise ValueError('Failed to create AOI mask raster.')
         return mask_layer
 
-    def _run_analysis(self):
+    def _build_zone_raster(self, zone_layer, field_name, reference_layer, output_dir):
+        if not field_name:
+            raise ValueError('Select an integer zone ID field for the zone layer.')
+        zone_path = os.path.join(output_dir, 'zones.tif')
+        params = {
+            'INPUT': zone_layer,
+            'FIELD': field_name,
+            'BURN': 0,
+            'UNITS': 1,
+            'WIDTH': reference_layer.width(),
+            'HEIGHT': reference_layer.height(),
+            'EXTENT': reference_layer.extent(),
+            'NODATA': -1,
+            'OPTIONS': '',
+            'DATA_TYPE': 4,
+            'INIT': -1,
+            'INVERT': False,
+            'EXTRA': '',
+            'OUTPUT': zone_path,
+        }
+        processing.run('gdal:rasterize', params)
+        zone_raster = QgsRasterLayer(zone_path, 'Zones')
+        if not zone_raster.isValid():
+            raise ValueError('Failed to create zone raster.')
+        return zone_raster
+
+    def _nodata_override(self):
+        if self.widget.nodataMode.currentIndex() != 1:
+            return None
+        text = self.widget.nodataValue.text().strip()
+        if not text:
+            raise ValueError('NoData value is required.')
+        return float(text)
+
+    def _align_inputs(self, raster_layers, nodata_list, bands, progress=None):
+        if not self.widget.alignCheck.isChecked():
+            return raster_layers, nodata_list
+        raster_layers, nodata_list, aligned_names = align_layers(raster_layers, nodata_list, bands, progress=progress)
+        if aligned_names:
+            self._log('Aligned to the base grid (nearest neighbour): {}'.format(', '.join(aligned_names)))
+        return raster_layers, nodata_list
+
+    def _filter_inputs(self, raster_layers, nodata_list, sieve=True):
+        if self.widget.sieveCheck.isChecked() and not sieve:
+            self._log('Sieve: not applied at reduced resolution, results are unsieved')
+        elif self.widget.sieveCheck.isChecked():
+            min_pixels = self.widget.sieveSpin.value()
+            connectivity = 8 if self.widget.sieveConnectivityCombo.currentIndex() == 1 else 4
+            raster_layers = sieve_layers(raster_layers, nodata_list, min_pixels, connectivity)
+            self._log('Sieve: removing patches under {} px ({}-connected)'.format(min_pixels, connectivity))
+        if self.widget.temporalCheck.isChecked() and len(raster_layers) > 1:
+            window = self.widget.temporalWindowSpin.value()
+            if window % 2 == 0:
+                raise ValueError('Temporal filter window must be an odd number of years.')
+            forbidden = parse_forbidden_transitions(self.widget.forbiddenEdit.text())
+            raster_layers = TemporalFilter(raster_layers, nodata_list, window, forbidden).bands()
+            self._log('Temporal filter: {}-year mode window, {} forbidden transition(s)'.format(window, len(forbidden)))
+        return raster_layers
+
+    def _unit_info(self, layer):
+        unit_text = self.widget.outputUnits.currentText()
+        if unit_text == 'Pixels':
+            return 'pixels', 1.0
+        if is_geographic(layer):
+            px_area = float(pixel_area_rows(layer).mean())
+        else:
+            px_area = abs(layer.rasterUnitsPerPixelX() * layer.rasterUnitsPerPixelY())
+        if unit_text == 'Square meters':
+            return 'm2', px_area
+        return 'km2', px_area / 1e6
+
+    def _run_quicklook(self):
         self.widget.progressBar.setValue(0)
         self.widget.logText.clear()
+        stack = None
         try:
             rasters = self._collect_inputs()
             output_dir = self.widget.outputDir.text().strip()
             if not output_dir:
                 raise ValueError('Output directory is required.')
+            nodata_override = self._nodata_override()
+            raster_layers = [item.layer for item in rasters]
+            nodata_list = [nodata_override if nodata_override is not None else item.nodata for item in rasters]
+            bands = [item.band for item in rasters]
+            raster_layers, nodata_list = self._align_inputs(raster_layers, nodata_list, bands)
+            validate_rasters(raster_layers)
+            stack = RasterStack(raster_layers, bands)
+            raster_layers = stack.adopt(self._filter_inputs(list(stack), nodata_list, sieve=False))
+            quicklook_dir = os.path.join(output_dir, 'quicklook')
+            os.makedirs(quicklook_dir, exist_ok=True)
+            table_writer = self._table_writer(quicklook_dir)
+            aoi_layer = self.widget.aoiCombo.currentLayer()
+            mask_layer = stack.handle(self._build_mask_raster(aoi_layer, raster_layers[0], output_dir) if aoi_layer else None)
 
-            nodata_mode = self.widget.nodataMode.currentIndex()
-            nodata_override = None
-            if nodata_mode == 1:
-                text = self.widget.nodataValue.text().strip()
-                if not text:
-                    raise ValueError('NoData value is required.')
-                nodata_override = float(text)
+            factor = self.widget.quickLookFactorSpin.value()
+            width, height = decimated_size(raster_layers[0], factor)
+            total_blocks = max(1, int(math.ceil(width / 128.0)) * int(math.ceil(height / 128.0)))
+            self._init_progress(total_blocks)
+            started = time.perf_counter()
+            result = compute_quicklook(raster_layers, nodata_list, mask_layer, factor=factor, progress=self._progress_callback(total_blocks))
+            self._log('Quick look at 1/{} resolution took {:.1f} s'.format(factor, time.perf_counter() - started))
 
-            aoi_layer = self.widget.aoiCombo.currentLayer()
+            legend_map = self._read_legend_map()
+            unit_label, area_factor = self._unit_info(raster_layers[0])
+            if unit_label != 'pixels' and is_geographic(raster_layers[0]):
+                self._log('Quick look: geographic CRS, areas use the mean pixel area and are approximate')
+            area = result['area']
+            area_se = result['area_se']
+            year_idx, class_ids = np.nonzero(area)
+            counts = area[year_idx, class_ids]
+            year_totals = area.sum(axis=1)[year_idx]
+            table = Table(
+                ['year', 'class_id', 'class_label', 'est_pixel_count', 'area_{}'.format(unit_label), 'stderr_{}'.format(unit_label), 'percent_share'],
+                [
+                    np.array([item.year for item in rasters], dtype=np.int64)[year_idx],
+                    class_ids,
+                    label_column(class_ids, legend_map),
+                    counts,
+                    counts * area_factor,
+                    area_se[year_idx, class_ids] * area_factor,
+                    np.where(year_totals > 0, counts / np.where(year_totals > 0, year_totals, 1.0) * 100.0, 0.0),
+                ],
+            )
+            self._write_table(table_writer, 'area_by_class', table, prefix='quicklook/')
+
+            interval_results = []
+            for idx, interval in enumerate(result['intervals']):
+                r0 = rasters[idx]
+                r1 = rasters[idx + 1]
+                nodata_class = self._nodata_class(nodata_list[idx], nodata_list[idx + 1])
+                matrix = interval['matrix']
+                matrix_se = interval['matrix_se']
+                from_ids, to_ids = np.nonzero(matrix)
+                if nodata_class is not None:
+                    keep = (from_ids != nodata_class) & (to_ids != nodata_class)
+                    from_ids = from_ids[keep]
+                    to_ids = to_ids[keep]
+                counts = matrix[from_ids, to_ids]
+                table = Table(
+                    ['from_class', 'from_label', 'to_class', 'to_label', 'est_pixel_count', 'area_{}'.format(unit_label), 'stderr_{}'.format(unit_label)],
+                    [
+                        from_ids,
+                        label_column(from_ids, legend_map),
+                        to_ids,
+                        label_column(to_ids, legend_map),
+                        counts,
+                        counts * area_factor,
+                        matrix_se[from_ids, to_ids] * area_factor,
+                    ],
+                )
+                self._write_table(table_writer, 'transitions_{}_{}'.format(r0.year, r1.year), table, prefix='quicklook/')
+                interval_results.append((r0, r1, nodata_list[idx], nodata_list[idx + 1], interval))
+
+            table = compute_intensity_table(interval_results)
+            changed_se = np.array([interval['changed_pixels_se'] for _, _, _, _, interval in interval_results], dtype=np.float64)
+            total = table['total_pixels']
+            table = Table(
+                ['year0', 'year1', 'interval_years', 'est_changed_pixels', 'est_total_pixels', 'interval_intensity', 'annualized_intensity', 'stderr_changed_pixels', 'stderr_interval_intensity'],
+                table.columns + [changed_se, np.where(total > 0, changed_se / np.where(total > 0, total, 1.0), 0.0)],
+            )
+            self._write_table(table_writer, 'change_intensity', table, prefix='quicklook/')
+            self._log('Done.')
+            self.widget.progressBar.setValue(self.widget.progressBar.maximum())
+        except (ValidationError, ValueError) as exc:
+            self._log('Error: {}'.format(exc))
+        except Exception as exc:
+            self._log('Unexpected error: {}'.format(exc))
+        finally:
+            if stack is not None:
+                stack.close()
+
+    def _start_extent_query(self):
+        canvas = self.iface.mapCanvas()
+        if self._extent_tool is None:
+            self._extent_tool = QgsMapToolExtent(canvas)
+            self._extent_tool.extentChanged.connect(self._query_extent)
+        canvas.setMapTool(self._extent_tool)
+        self._log('Draw a rectangle on the map to query the tile index.')
+
+    def _query_extent(self, extent):
+        canvas = self.iface.mapCanvas()
+        canvas.unsetMapTool(self._extent_tool)
+        self.widget.logText.clear()
+        stack = None
+        try:
+            rasters = self._collect_inputs()
+            output_dir = self.widget.outputDir.text().strip()
+            if not output_dir:
+                raise ValueError('Output directory is required.')
+            nodata_override = self._nodata_override()
             raster_layers = [item.layer for item in rasters]
+            nodata_list = [nodata_override if nodata_override is not None else item.nodata for item in rasters]
+            bands = [item.band for item in rasters]
+            raster_layers, nodata_list = self._align_inputs(raster_layers, nodata_list, bands)
             validate_rasters(raster_layers)
-            base_blocks = self._count_blocks(raster_layers[0])
+            stack = RasterStack(raster_layers, bands)
+            raster_layers = stack.adopt(self._filter_inputs(list(stack), nodata_list))
+
+            aoi_layer = self.widget.aoiCombo.currentLayer()
+            mask_key = 'none'
+            if aoi_layer is not None:
+                mask_key = [geometry_fingerprint(aoi_layer), layer_fingerprint(raster_layers[0], None)]
+            fingerprints = [layer_fingerprint(layer, nodata) for layer, nodata in zip(raster_layers, nodata_list)]
+            tile_index = TileIndex(output_dir, digest_parts(fingerprints + [mask_key]))
+            if not tile_index.load():
+                raise ValueError('No tile index matches the current inputs. Run the analysis with the tile index enabled first.')
+
+            mask_layer = stack.handle(self._build_mask_raster(aoi_layer, raster_layers[0], output_dir) if aoi_layer else None)
+            transform = QgsCoordinateTransform(canvas.mapSettings().destinationCrs(), raster_layers[0].crs(), QgsProject.instance())
+            geometry = QgsGeometry.fromRect(transform.transformBoundingBox(extent))
+            started = time.perf_counter()
+            result = tile_index.query(geometry, raster_layers, nodata_list, mask_layer)
+            self._log('Query: {} indexed cell(s), {} boundary tile(s) read, {:.2f} s'.format(
+                result['full_cells'], result['boundary_tiles'], time.perf_counter() - started))
+
+            query_dir = os.path.join(output_dir, 'query')
+            os.makedirs(query_dir, exist_ok=True)
+            table_writer = self._table_writer(query_dir)
+            legend_map = self._read_legend_map()
+            unit_label, area_factor = self._unit_info(raster_layers[0])
+            area_factors = [area_factor] * len(rasters)
+            matrix_factors = [area_factor] * len(result['matrices'])
+            if unit_label != 'pixels' and 'weighted_area' in result:
+                unit_scale = 1e-6 if unit_label == 'km2' else 1.0
+                area_factors = [area_factor_from(counts, areas) * unit_scale for counts, areas in zip(result['area'], result['weighted_area'])]
+                matrix_factors = [area_factor_from(counts, areas) * unit_scale for counts, areas in zip(result['matrices'], result['weighted_matrices'])]
+            table = area_by_class_table(
+                [item.year for item in rasters],
+                [area_counts_from_array(counts) for counts in result['area']],
+                area_factors,
+                legend_map,
+                unit_label,
+            )
+            self._write_table(table_writer, 'area_by_class', table, prefix='query/')
+            for idx, (matrix, area_factor) in enumerate(zip(result['matrices'], matrix_factors)):
+                r0 = rasters[idx]
+                r1 = rasters[idx + 1]
+                from_ids, to_ids = np.nonzero(matrix)
+                counts = matrix[from_ids, to_ids]
+                table = Table(
+                    ['from_class', 'from_label', 'to_class', 'to_label', 'pixel_count', 'area_{}'.format(unit_label)],
+                    [
+                        from_ids,
+                        label_column(from_ids, legend_map),
+                        to_ids,
+                        label_column(to_ids, legend_map),
+                        counts,
+                        counts * np.broadcast_to(area_factor, matrix.shape)[from_ids, to_ids],
+                    ],
+                )
+                self._write_table(table_writer, 'transitions_{}_{}'.format(r0.year, r1.year), table, prefix='query/')
+            self._log('Done.')
+        except (ValidationError, ValueError) as exc:
+            self._log('Error: {}'.format(exc))
+        except Exception as exc:
+            self._log('Unexpected error: {}'.format(exc))
+        finally:
+            if stack is not None:
+                stack.close()
+
+    def _write_group_outputs(self, output_dir, groups, legend_map, group_labels, rasters, nodata_list, area_counts_list, interval_results,
+                             max_class, year_areas, unit_scale, charts_enabled, chart_options):
+        size = max_class + 1
+        excluded = {self._nodata_class(nodata0, nodata1) for _, _, nodata0, nodata1, _ in interval_results}
+        excluded = {class_id for class_id in excluded if class_id is not None and 0 <= class_id < size}
+        targets = group_targets(groups, size, excluded)
+        grouping = grouping_matrix(groups, size, excluded)
+        unmapped = unmapped_classes(groups, area_counts_list)
+        if unmapped:
+            self._log('Class groups: classes without a group are reported as {} + class ID: {}'.format(
+                unmapped_offset(groups), ', '.join('{} -> {}'.format(class_id, targets[class_id]) for class_id in unmapped)))
+        for class_id in sorted(excluded & set(groups)):
+            self._log('Class groups: NoData class {} is kept out of group {} as ID {}'.format(class_id, groups[class_id], targets[class_id]))
+        group_labels = {
+            **{int(targets[class_id]): label for class_id, label in legend_map.items()
+               if (class_id not in groups or class_id in excluded) and 0 <= class_id < size},
+            **group_labels,
+        }
+        group_dir = os.path.join(output_dir, 'groups')
+        os.makedirs(group_dir, exist_ok=True)
+        table_writer = self._table_writer(group_dir)
+        chart_dir = os.path.join(output_dir, 'charts', 'groups')
+        dashboard = chart_options['dashboard'].section('Groups') if chart_options['dashboard'] is not None else None
+        chart_options = dict(chart_options, dashboard=dashboard)
+        unit_label, _ = self._unit_info(rasters[0].layer)
+
+        def year_area_factor(idx):
+            if year_areas is None:
+                return self._unit_info(rasters[idx].layer)[1]
+            counts = np.zeros(size, dtype=np.int64)
+            for class_id, count in area_counts_list[idx].items():
+                counts[class_id] = count
+            return group_area_factor(counts, year_areas[idx], grouping, unit_scale)
+
+        def interval_area_factor(idx, result):
+            if 'area_matrix' not in result:
+                return self._unit_info(rasters[idx].layer)[1]
+            return group_area_factor(result['matrix'], result['area_matrix'], grouping, unit_scale)
+
+        def group_class(nodata0, nodata1):
+            nodata_class = self._nodata_class(nodata0, nodata1)
+            if nodata_class is None or not 0 <= nodata_class < size:
+                return nodata_class
+            return int(targets[nodata_class])
+
+        group_max = grouping.shape[1] - 1
+        if self.widget.areaByClassCheck.isChecked():
+            table = area_by_class_table(
+                [item.year for item in rasters],
+                [group_area_counts(area_counts, grouping) for area_counts in area_counts_list],
+                [year_area_factor(idx) for idx in range(len(rasters))],
+                group_labels,
+                unit_label,
+            )
+            self._write_table(table_writer, 'area_by_class', table, prefix='groups/')
+            if charts_enabled:
+                ok, _ = charts.export_area_by_class(table, chart_dir, unit_label, **chart_options)
+                self._log_chart(ok, 'groups/area_by_class', dashboard)
+
+        sankey_intervals = []
+        for idx, (r0, r1, nodata0, nodata1, result) in enumerate(interval_results):
+            matrix = group_matrix(result['matrix'], grouping)
+            area_factor = interval_area_factor(idx, result)
+            suffix = '{}_{}'.format(r0.year, r1.year)
+            if self.widget.netGrossCheck.isChecked():
+                table = net_gross_table(matrix, group_max, area_factor, group_labels, unit_label)
+                self._write_table(table_writer, 'net_gross_change_' + suffix, table, prefix='groups/')
+                if charts_enabled:
+                    ok, _ = charts.export_net_gross(table, r0.year, r1.year, unit_label, chart_dir, **chart_options)
+                    self._log_chart(ok, 'groups/net_gross_change_' + suffix, dashboard)
+            if self.widget.transitionCheck.isChecked():
+                classes = [i for i in range(group_max + 1) if i != group_class(nodata0, nodata1)]
+                values = transition_values(matrix, classes, unit_label, area_factor)
+                self._write_table(table_writer, 'transition_matrix_' + suffix, transition_matrix_table(values, classes, group_labels), prefix='groups/')
+                if charts_enabled:
+                    ok, _ = charts.export_transition_matrix(values, classes, group_labels, r0.year, r1.year, chart_dir, unit_label, **chart_options)
+                    self._log_chart(ok, 'groups/transition_matrix_' + suffix, dashboard)
+            if self.widget.topTransitionsCheck.isChecked():
+                table = top_transitions_table(matrix, area_factor, group_labels, unit_label)
+                self._write_table(table_writer, 'top_transitions_' + suffix, table, prefix='groups/')
+                if charts_enabled:
+                    ok, _ = charts.export_top_transitions(table, r0.year, r1.year, chart_dir, unit_label, **chart_options)
+                    self._log_chart(ok, 'groups/top_transitions_' + suffix, dashboard)
+            sankey_intervals.append({
+                'year0': r0.year,
+                'year1': r1.year,
+                'matrix': matrix,
+                'nodata_class': group_class(nodata0, nodata1),
+                'unit_label': unit_label,
+                'area_factor': area_factor,
+            })
+        if charts_enabled and sankey_intervals:
+            ok, _ = charts.export_sankey(sankey_intervals, group_labels, chart_dir, **chart_options)
+            self._log_chart(ok, 'groups/class_flow_sankey', dashboard)
+        self._log('Class groups: {} class(es) rolled up into {} group(s)'.format(len(groups), len(set(groups.values()))))
 
+    def _run_analysis(self):
+        self.widget.progressBar.setValue(0)
+        self.widget.logText.clear()
+        profiler = None
+        stack = None
+        cube = None
+        change_masks = None
+        try:
+            rasters = self._collect_inputs()
+            output_dir = self.widget.outputDir.text().strip()
+            if not output_dir:
+                raise ValueError('Output directory is required.')
+            profiler = StageProfiler(output_dir, enabled=profiling_requested(self.widget.profileCheck.isChecked()))
+
+            nodata_override = self._nodata_override()
+
+            aoi_layer = self.widget.aoiCombo.currentLayer()
+            raster_layers = [item.layer for item in rasters]
             nodata_list = []
             for item in rasters:
                 nodata_list.append(nodata_override if nodata_override is not None else item.nodata)
+            bands = [item.band for item in rasters]
+            fill_blocks = pending_fill_blocks(raster_layers, nodata_list, bands) if self.widget.alignCheck.isChecked() else 0
+            self._init_progress(fill_blocks)
+            raster_layers, nodata_list = self._align_inputs(raster_layers, nodata_list, bands, progress=self._progress_callback(fill_blocks))
+            validate_rasters(raster_layers)
+            stack = RasterStack(raster_layers, bands)
+            raster_layers = stack.adopt(self._filter_inputs(list(stack), nodata_list))
+            rasters = [item._replace(layer=layer) for item, layer in zip(rasters, raster_layers)]
+            base_blocks = self._count_blocks(raster_layers[0])
+
+            mask_key = 'none'
+            if aoi_layer is not None:
+                mask_key = [geometry_fingerprint(aoi_layer), layer_fingerprint(raster_layers[0], None)]
+            fingerprints = [layer_fingerprint(layer, nodata) for layer, nodata in zip(raster_layers, nodata_list)]
+            row_areas = None
+            if self.widget.outputUnits.currentText() != 'Pixels' and is_geographic(raster_layers[0]):
+                row_areas = pixel_area_rows(raster_layers[0])
+            run_state = None
+            reused = 0
+            if self.widget.incrementalCheck.isChecked():
+                run_state = RunState(output_dir)
+                if run_state.load():
+                    reused = run_state.reusable_years(fingerprints, mask_key, weighted=row_areas is not None)
+                if reused:
+                    self._log('Incremental update: reusing {} of {} years from run_state/'.format(reused, len(rasters)))
+                else:
+                    self._log('Incremental update: no matching run state, processing all years.')
 
             steps = [
                 self.widget.areaByClassCheck.isChecked(),
@@ -661,258 +1209,447 @@ class LandChangeAccountingPlugin:
                 self._log('Charts: Plotly.js not available. Reinstall plugin v0.1.1 to restore charts.')
                 charts_enabled = False
             chart_dir = None
+            dashboard = None
+            compress_charts = self.widget.compressChartsCheck.isChecked()
             if charts_enabled:
                 chart_dir = os.path.join(output_dir, 'charts')
                 os.makedirs(chart_dir, exist_ok=True)
+                if self.widget.dashboardCheck.isChecked():
+                    dashboard = charts.Dashboard(compress=compress_charts)
+            chart_options = {'dashboard': dashboard, 'compress': compress_charts}
             intervals = max(0, len(rasters) - 1)
+            new_years = len(rasters) - reused
+            new_intervals = min(intervals, new_years)
             passes = 0
-            passes += len(rasters)  # compute_max_class
-            if self.widget.areaByClassCheck.isChecked():
-                passes += len(rasters)
-            if any(steps[1:4]) or self.widget.intensityCheck.isChecked() or self.widget.hotspotCheck.isChecked():
-                passes += intervals  # interval metrics
+            if new_years:
+                passes += 1  # class histograms
+            if any(steps[1:4]) or self.widget.intensityCheck.isChecked() or self.widget.hotspotCheck.isChecked() or self.widget.transitionRasterCheck.isChecked():
+                passes += new_intervals  # interval metrics
             if self.widget.transitionFirstLastCheck.isChecked():
                 passes += 1
             if self.widget.changeFreqCheck.isChecked():
                 passes += 1
             if self.widget.hotspotCheck.isChecked():
-                passes += intervals
-            passes += len(rasters)  # validation min/max/unique
+                passes += new_intervals
+            if self.widget.fragmentationCheck.isChecked():
+                passes += 1
+            if self.widget.polygonCheck.isChecked():
+                passes += 2 * intervals
+            stats_mode = self._statistics_mode()
+            passes += sum(1 for layer, nodata in zip(raster_layers, nodata_list) if not has_cached_statistics(layer, nodata, stats_mode))
             if self.widget.aoiCombo.currentLayer() is not None:
                 passes += 1
-            total_blocks = max(1, base_blocks * passes)
+            zone_layer = self.widget.zoneCombo.currentLayer()
+            if zone_layer is not None:
+                passes += 1
+            if self.widget.cubeCheck.isChecked():
+                cube = CubeStore(fingerprints)
+                if not cube.load():
+                    passes += 1
+            if self.widget.changeMasksCheck.isChecked() and (self.widget.changeFreqCheck.isChecked() or self.widget.hotspotCheck.isChecked()):
+                change_masks = ChangeMaskStore(output_dir, digest_parts(fingerprints + [mask_key]))
+                if not change_masks.load():
+                    passes += 1
+            tile_index = None
+            if self.widget.tileIndexCheck.isChecked():
+                tile_index = TileIndex(output_dir, digest_parts(fingerprints + [mask_key]))
+                if not tile_index.load():
+                    passes += 1
+            total_blocks = max(1, base_blocks * passes + fill_blocks)
             self._init_progress(total_blocks)
-            progress_cb = self._progress_callback(total_blocks)
+            self.widget.progressBar.setValue(fill_blocks)
+            progress_cb = self._progress_callback(total_blocks, done=fill_blocks)
+
+            with profiler.stage('aoi_mask'):
+                mask_layer = stack.handle(self._build_mask_raster(aoi_layer, rasters[0].layer, output_dir) if aoi_layer else None)
+            with profiler.stage('validation'):
+                self._run_validation(output_dir=output_dir, log_errors=False, progress=progress_cb)
+            if cube is not None:
+                with profiler.stage('cube'):
+                    if cube.meta is None:
+                        cube.ingest(raster_layers, progress=progress_cb)
+                        self._log('Data cube: ingested {} year(s)'.format(len(raster_layers)))
+                    else:
+                        self._log('Data cube: reusing {}'.format(cube.cube_dir))
+                raster_layers = stack.adopt(cube.bands(raster_layers))
+                rasters = [item._replace(layer=band) for item, band in zip(rasters, raster_layers)]
+
+            result_cache = ResultCache(limit_mb=self.widget.cacheLimitSpin.value(), enabled=self.widget.cacheCheck.isChecked())
+            with profiler.stage('histograms'):
+                area_counts_list = []
+                year_areas = [None] * len(rasters)
+                scan = []
+                for idx, item in enumerate(rasters):
+                    stats = None
+                    if mask_layer is None and row_areas is None and has_cached_statistics(item.layer, nodata_list[idx], MODE_EXACT):
+                        stats = layer_statistics(item.layer, nodata_list[idx], mode=MODE_EXACT)
+                    if idx < reused:
+                        area_counts_list.append(run_state.area_counts(idx))
+                        year_areas[idx] = run_state.year_areas(idx)
+                    elif stats is not None and stats['histogram'] is not None:
+                        area_counts_list.append(area_counts_from_array(stats['histogram']))
+                    else:
+                        area_counts_list.append(None)
+                        scan.append(idx)
+                if scan:
+                    scanned, scanned_areas = result_cache.area_by_class([rasters[idx].layer for idx in scan], [nodata_list[idx] for idx in scan], mask_layer, mask_key,
+                                                                        progress=progress_cb, row_areas=row_areas)
+                    for idx, area_counts, areas in zip(scan, scanned, scanned_areas):
+                        area_counts_list[idx] = area_counts
+                        year_areas[idx] = areas
+                max_class = max((max(counts) for counts in area_counts_list if counts), default=0)
+                self._log('Max class id: {}'.format(max_class))
+
+            checkpoint_seconds = self.widget.checkpointSpin.value() if self.widget.checkpointCheck.isChecked() else 0
+            checkpoints = []
+
+            def make_checkpoint(name, *parts):
+                if not checkpoint_seconds:
+                    return None
+                checkpoint = Checkpoint(output_dir, name, digest_parts([mask_key, max_class] + list(parts)), every_seconds=checkpoint_seconds)
+                checkpoints.append(checkpoint)
+                return checkpoint
 
-            mask_layer = self._build_mask_raster(aoi_layer, rasters[0].layer, output_dir) if aoi_layer else None
-            max_class = compute_max_class(raster_layers, nodata_list, mask_layer, progress=progress_cb)
-            self._log('Max class id: {}'.format(max_class))
             target_crs = self.widget.crsWidget.crs() if self.widget.crsWidget else None
             if target_crs is None or not target_crs.isValid():
                 target_crs = QgsProject.instance().crs()
             legend_map = self._read_legend_map()
-            unit_text = self.widget.outputUnits.currentText()
-
-            def unit_info(layer):
-                if unit_text == 'Pixels':
-                    return 'pixels', 1.0
-                px_area = abs(layer.rasterUnitsPerPixelX() * layer.rasterUnitsPerPixelY())
-                if unit_text == 'Square meters':
-                    return 'm2', px_area
-                return 'km2', px_area / 1e6
-
-            self._run_validation(output_dir=output_dir, log_errors=False, progress=progress_cb)
+            legend_groups, group_labels = self._read_legend_groups()
+            unit_info = self._unit_info
+            table_writer = self._table_writer(output_dir)
+            if row_areas is not None:
+                self._log('Areas: geographic CRS, using per-row ellipsoidal pixel areas')
+            unit_scale = 1e-6 if unit_info(rasters[0].layer)[0] == 'km2' else 1.0
+            if row_areas is not None:
+                year_areas = [padded_counts(areas, max_class + 1) for areas in year_areas]
+
+            def year_area_factor(idx):
+                if row_areas is None:
+                    return unit_info(rasters[idx].layer)[1]
+                counts = padded_counts(area_counts_to_array(area_counts_list[idx]), max_class + 1)
+                return area_factor_from(counts, year_areas[idx]) * unit_scale
+
+            def interval_area_factor(pair_index, result):
+                if 'area_matrix' not in result:
+                    return unit_info(rasters[max(pair_index, 0)].layer)[1]
+                return area_factor_from(result['matrix'], result['area_matrix']) * unit_scale
 
             if self.widget.areaByClassCheck.isChecked():
-                rows = []
-                for idx, item in enumerate(rasters):
-                    area_counts = compute_area_by_class(item.layer, nodata_list[idx], mask_layer, progress=progress_cb)
-                    total_pixels = sum(area_counts.values())
-                    unit_label, area_factor = unit_info(item.layer)
-                    for class_id, count in sorted(area_counts.items()):
-                        area_value = count * area_factor
-                        percent = (count / total_pixels * 100.0) if total_pixels else 0.0
-                        rows.append([item.year, class_id, legend_map.get(class_id, ''), count, area_value, percent])
-                unit_label, _ = unit_info(rasters[0].layer)
-                write_csv(os.path.join(output_dir, 'area_by_class.csv'),
-                          ['year', 'class_id', 'class_label', 'pixel_count', 'area_{}'.format(unit_label), 'percent_share'],
-                          rows)
-                self._log('Wrote area_by_class.csv')
-                if charts_enabled:
-                    ok, _ = charts.export_area_by_class(rows, chart_dir, unit_label)
-                    if ok:
-                        self._log('Wrote charts/area_by_class.html')
-
-            interval_results = []
-            for idx in range(len(rasters) - 1):
-                r0 = rasters[idx]
-                r1 = rasters[idx + 1]
-                result = compute_interval_metrics(r0.layer, r1.layer, nodata_list[idx], nodata_list[idx + 1], mask_layer, max_class, progress=progress_cb)
-                interval_results.append((r0, r1, nodata_list[idx], nodata_list[idx + 1], result))
+                with profiler.stage('area_by_class'):
+                    unit_label, _ = unit_info(rasters[0].layer)
+                    table = area_by_class_table(
+                        [item.year for item in rasters],
+                        area_counts_list,
+                        [year_area_factor(idx) for idx in range(len(rasters))],
+                        legend_map,
+                        unit_label,
+                    )
+                    self._write_table(table_writer, 'area_by_class', table)
+                    if charts_enabled:
+                        ok, _ = charts.export_area_by_class(table, chart_dir, unit_label, **chart_options)
+                        self._log_chart(ok, 'area_by_class', dashboard)
+
+            with profiler.stage('interval_metrics'):
+                interval_results = []
+                code_classes = None
+                keep_codes = False
+                if self.widget.transitionRasterCheck.isChecked():
+                    code_classes = dense_class_ids(area_counts_list)
+                    legend_colors = self._read_legend_colors()
+                    keep_codes = bool(reused) and run_state.code_classes() == code_classes.tolist()
+                    if reused and not keep_codes:
+                        self._log('Transition rasters: class list changed since the saved run, rewriting all intervals')
+                for idx in range(len(rasters) - 1):
+                    r0 = rasters[idx]
+                    r1 = rasters[idx + 1]
+                    code_writer = None
+                    if code_classes is not None:
+                        code_path = os.path.join(output_dir, 'transition_codes_{}_{}.tif'.format(r0.year, r1.year))
+                        if not (idx + 1 < reused and keep_codes and os.path.isfile(code_path)):
+                            code_writer = TransitionCodeWriter(raster_layers[0], code_path, code_classes, legend_map, legend_colors)
+                    if idx + 1 < reused and code_writer is None:
+                        result = run_state.interval_result(idx, max_class)
+                    else:
+                        checkpoint = make_checkpoint('interval_{}_{}'.format(r0.year, r1.year), fingerprints[idx], fingerprints[idx + 1])
+                        result = result_cache.interval_metrics(r0.layer, r1.layer, nodata_list[idx], nodata_list[idx + 1], mask_layer, mask_key, max_class, progress=progress_cb, checkpoint=checkpoint,
+                                                               code_writer=code_writer, row_areas=row_areas)
+                        self._log_resume(checkpoint, 'interval {}-{}'.format(r0.year, r1.year))
+                    if code_writer is not None:
+                        add_raster_to_project(code_path)
+                        self._log('Wrote {}'.format(os.path.basename(code_path)))
+                    interval_results.append((r0, r1, nodata_list[idx], nodata_list[idx + 1], result))
             if charts_enabled:
-                sankey_intervals = []
-                for r0, r1, nodata0, nodata1, result in interval_results:
-                    nodata_class = self._nodata_class(nodata0, nodata1)
-                    unit_label, area_factor = unit_info(r0.layer)
-                    sankey_intervals.append({
-                        'year0': r0.year,
-                        'year1': r1.year,
-                        'matrix': result['matrix'],
-                        'nodata_class': nodata_class,
-                        'unit_label': unit_label,
-                        'area_factor': area_factor,
-                    })
-                ok, _ = charts.export_sankey(sankey_intervals, legend_map, chart_dir)
-                if ok:
-                    self._log('Wrote charts/class_flow_sankey.html')
+                with profiler.stage('sankey'):
+                    sankey_intervals = []
+                    for idx, (r0, r1, nodata0, nodata1, result) in enumerate(interval_results):
+                        nodata_class = self._nodata_class(nodata0, nodata1)
+                        unit_label, _ = unit_info(r0.layer)
+                        area_factor = interval_area_factor(idx, result)
+                        sankey_intervals.append({
+                            'year0': r0.year,
+                            'year1': r1.year,
+                            'matrix': result['matrix'],
+                            'nodata_class': nodata_class,
+                            'unit_label': unit_label,
+                            'area_factor': area_factor,
+                        })
+                    ok, _ = charts.export_sankey(sankey_intervals, legend_map, chart_dir, **chart_options)
+                    self._log_chart(ok, 'class_flow_sankey', dashboard)
 
             if self.widget.netGrossCheck.isChecked():
-                combined_intervals = []
-                for r0, r1, _, _, result in interval_results:
-                    gain = result['gain']
-                    loss = result['loss']
-                    unit_label, area_factor = unit_info(r0.layer)
-                    rows = []
-                    for class_id in range(max_class + 1):
-                        gain_px = int(gain[class_id])
-                        loss_px = int(loss[class_id])
-                        net_px = gain_px - loss_px
-                        gross_px = gain_px + loss_px
-                        rows.append([
-                            class_id,
-                            legend_map.get(class_id, ''),
-                            gain_px,
-                            loss_px,
-                            net_px,
-                            gross_px,
-                            net_px * area_factor,
-                            gross_px * area_factor,
-                        ])
-                    fname = 'net_gross_change_{}_{}.csv'.format(r0.year, r1.year)
-                    write_csv(os.path.join(output_dir, fname),
-                              ['class_id', 'class_label', 'gain_pixels', 'loss_pixels', 'net_pixels', 'gross_pixels', 'area_{}_net'.format(unit_label), 'area_{}_gross'.format(unit_label)],
-                              rows)
-                    self._log('Wrote {}'.format(fname))
-                    combined_intervals.append({
-                        'label': '{}-{}'.format(r0.year, r1.year),
-                        'rows': rows,
-                        'unit_label': unit_label,
-                        'area_factor': area_factor,
-                    })
-                    if charts_enabled:
-                        ok, _ = charts.export_net_gross(rows, r0.year, r1.year, unit_label, area_factor, chart_dir)
-                        if ok:
-                            self._log('Wrote charts/{}.html'.format(fname.replace('.csv', '')))
-                if charts_enabled and combined_intervals:
-                    ok, _ = charts.export_net_gross_combined(combined_intervals, legend_map, chart_dir)
-                    if ok:
-                        self._log('Wrote charts/net_gross_change_all_intervals.html')
+                with profiler.stage('net_gross'):
+                    combined_intervals = []
+                    for idx, (r0, r1, _, _, result) in enumerate(interval_results):
+                        unit_label, _ = unit_info(r0.layer)
+                        area_factor = interval_area_factor(idx, result)
+                        table = net_gross_table(result['matrix'], max_class, area_factor, legend_map, unit_label)
+                        fname = 'net_gross_change_{}_{}'.format(r0.year, r1.year)
+                        self._write_table(table_writer, fname, table)
+                        combined_intervals.append({
+                            'label': '{}-{}'.format(r0.year, r1.year),
+                            'table': table,
+                            'unit_label': unit_label,
+                        })
+                        if charts_enabled:
+                            ok, _ = charts.export_net_gross(table, r0.year, r1.year, unit_label, chart_dir, **chart_options)
+                            self._log_chart(ok, fname, dashboard)
+                    if charts_enabled and combined_intervals:
+                        ok, _ = charts.export_net_gross_combined(combined_intervals, legend_map, chart_dir, **chart_options)
+                        self._log_chart(ok, 'net_gross_change_all_intervals', dashboard)
 
             if self.widget.transitionCheck.isChecked():
-                for r0, r1, nodata0, nodata1, result in interval_results:
+                with profiler.stage('transition_matrix'):
+                    for idx, (r0, r1, nodata0, nodata1, result) in enumerate(interval_results):
+                        matrix = result['matrix']
+                        fname = 'transition_matrix_{}_{}'.format(r0.year, r1.year)
+                        nodata_class = self._nodata_class(nodata0, nodata1)
+                        classes = [i for i in range(max_class + 1) if i != nodata_class]
+                        unit_label, _ = unit_info(r0.layer)
+                        area_factor = interval_area_factor(idx, result)
+                        values = transition_values(matrix, classes, unit_label, area_factor)
+                        self._write_table(table_writer, fname, transition_matrix_table(values, classes, legend_map))
+                        if charts_enabled:
+                            ok, _ = charts.export_transition_matrix(values, classes, legend_map, r0.year, r1.year, chart_dir, unit_label, **chart_options)
+                            self._log_chart(ok, fname, dashboard)
+
+            if self.widget.transitionFirstLastCheck.isChecked():
+                with profiler.stage('transition_first_last'):
+                    r0 = rasters[0]
+                    r1 = rasters[-1]
+                    nodata0 = nodata_list[0]
+                    nodata1 = nodata_list[-1]
+                    checkpoint = make_checkpoint('first_last_{}_{}'.format(r0.year, r1.year), fingerprints[0], fingerprints[-1])
+                    result = result_cache.interval_metrics(r0.layer, r1.layer, nodata0, nodata1, mask_layer, mask_key, max_class, progress=progress_cb, checkpoint=checkpoint,
+                                                           row_areas=row_areas)
+                    self._log_resume(checkpoint, 'first-last transition matrix')
                     matrix = result['matrix']
-                    fname = 'transition_matrix_{}_{}.csv'.format(r0.year, r1.year)
+                    fname = 'transition_matrix_first_last_{}_{}'.format(r0.year, r1.year)
                     nodata_class = self._nodata_class(nodata0, nodata1)
                     classes = [i for i in range(max_class + 1) if i != nodata_class]
-                    rows = []
-                    unit_label, area_factor = unit_info(r0.layer)
-                    for i in classes:
-                        values = []
-                        for j in classes:
-                            val = matrix[i, j]
-                            if unit_label != 'pixels':
-                                val = float(val) * area_factor
-                            else:
-                                val = int(val)
-                            values.append(val)
-                        rows.append([i, legend_map.get(i, '')] + values)
-                    header = ['from_class', 'from_label'] + [
-                        '{} {}'.format(i, legend_map.get(i, '')).strip() for i in classes
-                    ]
-                    write_csv(os.path.join(output_dir, fname), header, rows)
-                    self._log('Wrote {}'.format(fname))
+                    unit_label, _ = unit_info(r0.layer)
+                    area_factor = interval_area_factor(-1, result)
+                    values = transition_values(matrix, classes, unit_label, area_factor)
+                    self._write_table(table_writer, fname, transition_matrix_table(values, classes, legend_map))
                     if charts_enabled:
-                        import numpy as np
-                        sub_matrix = matrix[np.ix_(classes, classes)]
-                        if unit_label != 'pixels':
-                            sub_matrix = sub_matrix.astype(float) * area_factor
-                        ok, _ = charts.export_transition_matrix(sub_matrix, classes, legend_map, r0.year, r1.year, chart_dir, unit_label)
-                        if ok:
-                            self._log('Wrote charts/{}.html'.format(fname.replace('.csv', '')))
-
-            if self.widget.transitionFirstLastCheck.isChecked():
-                r0 = rasters[0]
-                r1 = rasters[-1]
-                nodata0 = nodata_list[0]
-                nodata1 = nodata_list[-1]
-                result = compute_interval_metrics(r0.layer, r1.layer, nodata0, nodata1, mask_layer, max_class, progress=progress_cb)
-                matrix = result['matrix']
-                fname = 'transition_matrix_first_last_{}_{}.csv'.format(r0.year, r1.year)
-                nodata_class = self._nodata_class(nodata0, nodata1)
-                classes = [i for i in range(max_class + 1) if i != nodata_class]
-                rows = []
-                unit_label, area_factor = unit_info(r0.layer)
-                for i in classes:
-                    values = []
-                    for j in classes:
-                        val = matrix[i, j]
-                        if unit_label != 'pixels':
-                            val = float(val) * area_factor
-                        else:
-                            val = int(val)
-                        values.append(val)
-                    rows.append([i, legend_map.get(i, '')] + values)
-                header = ['from_class', 'from_label'] + [
-                    '{} {}'.format(i, legend_map.get(i, '')).strip() for i in classes
-                ]
-                write_csv(os.path.join(output_dir, fname), header, rows)
-                self._log('Wrote {}'.format(fname))
-                if charts_enabled:
-                    import numpy as np
-                    sub_matrix = matrix[np.ix_(classes, classes)]
-                    if unit_label != 'pixels':
-                        sub_matrix = sub_matrix.astype(float) * area_factor
-                    ok, _ = charts.export_transition_matrix(sub_matrix, classes, legend_map, r0.year, r1.year, chart_dir, unit_label)
-                    if ok:
-                        self._log('Wrote charts/{}.html'.format(fname.replace('.csv', '')))
+                        ok, _ = charts.export_transition_matrix(values, classes, legend_map, r0.year, r1.year, chart_dir, unit_label, **chart_options)
+                        self._log_chart(ok, fname, dashboard)
 
             if self.widget.topTransitionsCheck.isChecked():
-                for r0, r1, _, _, result in interval_results:
-                    matrix = result['matrix']
-                    rows = build_top_transitions(matrix, r0.layer)
-                    fname = 'top_transitions_{}_{}.csv'.format(r0.year, r1.year)
-                    labeled = []
-                    unit_label, area_factor = unit_info(r0.layer)
-                    for row in rows:
-                        from_id, to_id, count, area_km2, percent = row
-                        area_value = count * area_factor
-                        labeled.append([
-                            from_id,
-                            legend_map.get(from_id, ''),
-                            to_id,
-                            legend_map.get(to_id, ''),
-                            count,
-                            area_value,
-                            percent,
-                        ])
-                    write_csv(os.path.join(output_dir, fname),
-                              ['from_class', 'from_label', 'to_class', 'to_label', 'pixel_count', 'area_{}'.format(unit_label), 'percent_of_total_change'],
-                              labeled)
-                    self._log('Wrote {}'.format(fname))
-                    if charts_enabled:
-                        ok, _ = charts.export_top_transitions(labeled, r0.year, r1.year, chart_dir, unit_label)
-                        if ok:
-                            self._log('Wrote charts/{}.html'.format(fname.replace('.csv', '')))
+                with profiler.stage('top_transitions'):
+                    for idx, (r0, r1, _, _, result) in enumerate(interval_results):
+                        matrix = result['matrix']
+                        fname = 'top_transitions_{}_{}'.format(r0.year, r1.year)
+                        unit_label, _ = unit_info(r0.layer)
+                        area_factor = interval_area_factor(idx, result)
+                        table = top_transitions_table(matrix, area_factor, legend_map, unit_label)
+                        self._write_table(table_writer, fname, table)
+                        if charts_enabled:
+                            ok, _ = charts.export_top_transitions(table, r0.year, r1.year, chart_dir, unit_label, **chart_options)
+                            self._log_chart(ok, fname, dashboard)
+
+            if legend_groups:
+                with profiler.stage('class_groups'):
+                    self._write_group_outputs(
+                        output_dir, legend_groups, legend_map, group_labels, rasters, nodata_list, area_counts_list, interval_results,
+                        max_class, year_areas if row_areas is not None else None, unit_scale, charts_enabled, chart_options,
+                    )
+
+            if zone_layer is not None:
+                with profiler.stage('zonal'):
+                    zone_raster = stack.handle(self._build_zone_raster(zone_layer, self.widget.zoneFieldCombo.currentField(), rasters[0].layer, output_dir))
+                    zonal = compute_zonal_metrics(raster_layers, nodata_list, zone_raster, mask_layer, max_class, progress=progress_cb, row_areas=row_areas)
+                    self._log('Zonal accounting: {} zone(s)'.format(zonal['zone_ids'].shape[0]))
+                    weighted_area = zonal['weighted_area']
+                    unit_label, _ = unit_info(rasters[0].layer)
+                    if weighted_area is None:
+                        area_factors = [unit_info(item.layer)[1] for item in rasters]
+                    else:
+                        area_factors = area_factor_from(zonal['area'], weighted_area) * unit_scale
+                    table = zonal_area_table(zonal['zone_ids'], [item.year for item in rasters], zonal['area'], area_factors, legend_map, unit_label)
+                    self._write_table(table_writer, 'zonal_area_by_class', table)
+                    for idx in range(len(rasters) - 1):
+                        r0 = rasters[idx]
+                        r1 = rasters[idx + 1]
+                        unit_label, area_factor = unit_info(r0.layer)
+                        transitions = zonal['transitions'][idx]
+                        if transitions['area'] is not None:
+                            area_factor = area_factor_from(transitions['count'], transitions['area']) * unit_scale
+                        nodata_class = self._nodata_class(nodata_list[idx], nodata_list[idx + 1])
+                        table = zonal_transition_table(zonal['zone_ids'], transitions, area_factor, legend_map, unit_label, exclude_class=nodata_class)
+                        self._write_table(table_writer, 'zonal_transitions_{}_{}'.format(r0.year, r1.year), table)
+                        table = zonal_net_gross_table(zonal['zone_ids'], transitions, area_factor, legend_map, unit_label)
+                        self._write_table(table_writer, 'zonal_net_gross_{}_{}'.format(r0.year, r1.year), table)
+
+            if change_masks is not None:
+                with profiler.stage('change_masks'):
+                    if change_masks.meta is None:
+                        change_masks.build(raster_layers, nodata_list, mask_layer, progress=progress_cb, fingerprints=fingerprints, mask_key=mask_key)
+                        self._log('Change masks: stored {} interval(s)'.format(change_masks.intervals))
+                    else:
+                        self._log('Change masks: reusing {}'.format(change_masks.mask_dir))
+
+            if tile_index is not None:
+                with profiler.stage('tile_index'):
+                    if tile_index.meta is None:
+                        tile_index.build(raster_layers, nodata_list, mask_layer, max_class, progress=progress_cb, fingerprints=fingerprints, mask_key=mask_key)
+                        self._log('Tile index: {} level(s) in {}'.format(tile_index.meta['levels'], tile_index.index_dir))
+                    else:
+                        self._log('Tile index: reusing {}'.format(tile_index.index_dir))
 
             if self.widget.changeFreqCheck.isChecked():
-                change_path = os.path.join(output_dir, 'change_frequency.tif')
-                write_change_frequency(raster_layers, nodata_list, mask_layer, change_path, progress=progress_cb)
-                change_path = reproject_raster(change_path, rasters[0].layer.crs(), target_crs)
-                add_raster_to_project(change_path)
-                self._log('Wrote change_frequency.tif')
+                with profiler.stage('change_frequency'):
+                    change_path = os.path.join(output_dir, 'change_frequency.tif')
+                    checkpoint = make_checkpoint('change_frequency', *fingerprints)
+                    if change_masks is not None:
+                        write_change_frequency_from_masks(change_masks, raster_layers[0], change_path, progress=progress_cb)
+                        if run_state is not None:
+                            os.makedirs(run_state.state_dir, exist_ok=True)
+                            shutil.copyfile(change_path, run_state.change_frequency_path)
+                    elif run_state is None:
+                        write_change_frequency(raster_layers, nodata_list, mask_layer, change_path, progress=progress_cb, checkpoint=checkpoint)
+                    else:
+                        state_path = run_state.change_frequency_path
+                        if reused and run_state.has_change_frequency():
+                            if new_years:
+                                update_change_frequency(state_path, raster_layers[reused - 1:], nodata_list[reused - 1:], mask_layer, progress=progress_cb)
+                        else:
+                            os.makedirs(run_state.state_dir, exist_ok=True)
+                            write_change_frequency(raster_layers, nodata_list, mask_layer, state_path, progress=progress_cb, checkpoint=checkpoint)
+                        shutil.copyfile(state_path, change_path)
+                    self._log_resume(checkpoint, 'change frequency')
+                    change_path = reproject_raster(change_path, rasters[0].layer.crs(), target_crs)
+                    add_raster_to_project(change_path)
+                    self._log('Wrote change_frequency.tif')
+
+            if self.widget.fragmentationCheck.isChecked():
+                with profiler.stage('fragmentation'):
+                    layer = rasters[0].layer
+                    unit_label, _ = unit_info(layer)
+                    edge_lengths = (layer.rasterUnitsPerPixelX(), abs(layer.rasterUnitsPerPixelY()))
+                    pixel_area = edge_lengths[0] * edge_lengths[1]
+                    patch_row_areas = edge_rows = None
+                    if is_geographic(layer):
+                        patch_row_areas = row_areas if row_areas is not None else pixel_area_rows(layer)
+                        edge_rows = pixel_edge_rows(layer)
+                    results = result_cache.fragmentation([item.layer for item in rasters], nodata_list, mask_layer, mask_key, max_class, progress=progress_cb,
+                                                         row_areas=patch_row_areas, edge_rows=edge_rows)
+                    table = fragmentation_table(
+                        [item.year for item in rasters],
+                        results,
+                        [year_area_factor(idx) for idx in range(len(rasters))],
+                        legend_map,
+                        unit_label,
+                        edge_lengths,
+                        pixel_area,
+                        area_scale=unit_scale if row_areas is not None else None,
+                    )
+                    self._write_table(table_writer, 'fragmentation', table)
 
             if self.widget.intensityCheck.isChecked():
-                rows = compute_intensity_rows(interval_results)
-                write_csv(os.path.join(output_dir, 'change_intensity.csv'),
-                          ['year0', 'year1', 'interval_years', 'changed_pixels', 'total_pixels', 'interval_intensity', 'annualized_intensity'],
-                          rows)
-                self._log('Wrote change_intensity.csv')
-                if charts_enabled:
-                    ok, _ = charts.export_intensity(rows, chart_dir)
-                    if ok:
-                        self._log('Wrote charts/change_intensity.html')
+                with profiler.stage('intensity'):
+                    table = compute_intensity_table(interval_results)
+                    self._write_table(table_writer, 'change_intensity', table)
+                    if charts_enabled:
+                        ok, _ = charts.export_intensity(table, chart_dir, **chart_options)
+                        self._log_chart(ok, 'change_intensity', dashboard)
 
             if self.widget.hotspotCheck.isChecked():
-                for r0, r1, nodata0, nodata1, _ in interval_results:
-                    hotspot_path = os.path.join(output_dir, 'change_hotspot_{}_{}.tif'.format(r0.year, r1.year))
-                    build_hotspot_raster(r0.layer, r1.layer, nodata0, nodata1, mask_layer, hotspot_path, progress=progress_cb)
-                    hotspot_path = reproject_raster(hotspot_path, r0.layer.crs(), target_crs)
-                    add_raster_to_project(hotspot_path)
-                    self._log('Wrote {}'.format(os.path.basename(hotspot_path)))
-
+                with profiler.stage('hotspots'):
+                    for idx, (r0, r1, nodata0, nodata1, _) in enumerate(interval_results):
+                        hotspot_path = os.path.join(output_dir, 'change_hotspot_{}_{}.tif'.format(r0.year, r1.year))
+                        if idx + 1 < reused and os.path.isfile(hotspot_path):
+                            add_raster_to_project(hotspot_path)
+                            self._log('Kept {}'.format(os.path.basename(hotspot_path)))
+                            continue
+                        build_hotspot_raster(r0.layer, r1.layer, nodata0, nodata1, mask_layer, hotspot_path, progress=progress_cb,
+                                             change_masks=change_masks, interval=idx)
+                        hotspot_path = reproject_raster(hotspot_path, r0.layer.crs(), target_crs)
+                        add_raster_to_project(hotspot_path)
+                        self._log('Wrote {}'.format(os.path.basename(hotspot_path)))
+
+            if self.widget.polygonCheck.isChecked():
+                with profiler.stage('change_polygons'):
+                    patches_path = os.path.join(output_dir, PATCHES_NAME)
+                    if os.path.isfile(patches_path):
+                        os.remove(patches_path)
+                    base = raster_layers[0]
+                    patch_row_areas = pixel_area_rows(base) if is_geographic(base) else None
+                    for r0, r1, nodata0, nodata1, _ in interval_results:
+                        name = 'change_patches_{}_{}'.format(r0.year, r1.year)
+                        count = polygonize_changes(
+                            r0.layer, r1.layer, nodata0, nodata1, mask_layer, max_class, patches_path, name,
+                            legend_map=legend_map,
+                            min_area_ha=self.widget.polygonMinAreaSpin.value(),
+                            row_areas=patch_row_areas,
+                            progress=progress_cb,
+                        )
+                        layer = QgsVectorLayer('{}|layername={}'.format(patches_path, name), name, 'ogr')
+                        if layer.isValid():
+                            QgsProject.instance().addMapLayer(layer)
+                        self._log('Wrote {} ({}): {} polygon(s)'.format(PATCHES_NAME, name, count))
+
+            if self.widget.npzCheck.isChecked():
+                write_result_arrays(
+                    os.path.join(output_dir, 'results.npz'),
+                    [item.year for item in rasters],
+                    area_counts_list,
+                    [(r0.year, r1.year, result) for r0, r1, _, _, result in interval_results],
+                )
+                self._log('Wrote results.npz')
+
+            if dashboard is not None and dashboard.charts:
+                dashboard.write(os.path.join(chart_dir, 'index.html'))
+                self._log('Wrote charts/index.html ({} chart(s))'.format(len(dashboard.charts)))
+
+            if run_state is not None:
+                run_state.save(
+                    [item.year for item in rasters],
+                    fingerprints,
+                    mask_key,
+                    area_counts_list,
+                    [result for _, _, _, _, result in interval_results],
+                    change_frequency=self.widget.changeFreqCheck.isChecked(),
+                    year_areas=year_areas if row_areas is not None else None,
+                    code_classes=code_classes.tolist() if code_classes is not None else None,
+                )
+                self._log('Saved run state for incremental updates')
+            if checkpoints:
+                overhead = sum(checkpoint.overhead_seconds for checkpoint in checkpoints)
+                self._log('Checkpoint overhead: {:.1f} s'.format(overhead))
+            if result_cache.enabled:
+                self._log('Result cache: {} hit(s), {} miss(es)'.format(result_cache.hits, result_cache.misses))
             self._log('Done.')
             self.widget.progressBar.setValue(self.widget.progressBar.maximum())
         except (ValidationError, ValueError) as exc:
             self._log('Error: {}'.format(exc))
         except Exception as exc:
             self._log('Unexpected error: {}'.format(exc))
+        finally:
+            if cube is not None:
+                cube.close()
+            if change_masks is not None:
+                change_masks.close()
+            if stack is not None:
+                stack.close()
+            if profiler is not None and profiler.finish():
+                self._log('Wrote profile/ (stage timings, pstats, allocations, collapsed stacks)')